@@ -1,4 +1,7 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.db.models import Q
+from .espacial import filtro_recuadro, leer_bbox
 from .models import (
     PrioridadReporte,
     EstadoReporte,
@@ -8,7 +11,8 @@ from .models import (
     Asignacion,
     HistorialReporte,
     Notificacion,
-    RegistroAuditoria
+    RegistroAuditoria,
+    Zona
 )
 
 
@@ -31,8 +35,11 @@ class EstadoReporteAdmin(admin.ModelAdmin):
 
 @admin.register(GrupoDuplicado)
 class GrupoDuplicadoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'fechaDeteccion', 'razon')
-    readonly_fields = ('fechaDeteccion',)
+    list_display = ('id', 'fechaDeteccion', 'razon', 'total_reportes', 'total_usuarios', 'fecha_ultimo_reporte')
+    readonly_fields = (
+        'fechaDeteccion', 'reporte_principal', 'total_reportes', 'total_usuarios',
+        'total_evidencias', 'fecha_primer_reporte', 'fecha_ultimo_reporte',
+    )
 
 
 # ============================================
@@ -58,6 +65,37 @@ class HistorialInline(admin.TabularInline):
     can_delete = False
 
 
+class UbicacionFilter(admin.SimpleListFilter):
+    """
+    Filtra por coordenadas. Además de con/sin coordenadas acepta
+    ?recuadro=oeste,sur,este,norte (el enlace "Ver en el admin" del mapa),
+    que se resuelve con el índice R*Tree.
+    """
+    title = 'ubicación'
+    parameter_name = 'recuadro'
+
+    def lookups(self, request, model_admin):
+        opciones = [('con', 'Con coordenadas'), ('sin', 'Sin coordenadas')]
+        if self.value() and leer_bbox(self.value()):
+            opciones.append((self.value(), 'Recuadro del mapa'))
+        return opciones
+
+    def queryset(self, request, queryset):
+        valor = self.value()
+        if not valor:
+            return queryset
+        if valor == 'con':
+            return queryset.filter(latitud__isnull=False, longitud__isnull=False)
+        if valor == 'sin':
+            return queryset.filter(Q(latitud__isnull=True) | Q(longitud__isnull=True))
+
+        bbox = leer_bbox(valor)
+        if bbox is None:
+            raise IncorrectLookupParameters(f'Recuadro inválido: {valor}')
+        oeste, sur, este, norte = bbox
+        return queryset.filter(filtro_recuadro(sur, oeste, norte, este))
+
+
 @admin.register(Reporte)
 class ReporteAdmin(admin.ModelAdmin):
     list_display = (
@@ -71,16 +109,19 @@ class ReporteAdmin(admin.ModelAdmin):
         'reportado_en',
     )
 
-    list_filter = ('tipo', 'estado', 'prioridad', 'duplicado', 'reportado_en')
+    list_filter = (
+        'tipo', 'estado', 'prioridad', 'duplicado', UbicacionFilter,
+        ('localidad', admin.RelatedOnlyFieldListFilter), 'reportado_en'
+    )
     search_fields = ('titulo', 'descripcion', 'direccion', 'usuario__username')
-    readonly_fields = ('reportado_en', 'actualizado_en')
+    readonly_fields = ('localidad', 'barrio', 'reportado_en', 'actualizado_en')
 
     fieldsets = (
         ('Información General', {
             'fields': ('titulo', 'tipo', 'descripcion', 'usuario')
         }),
         ('Georreferenciación', {
-            'fields': ('latitud', 'longitud', 'direccion')
+            'fields': ('latitud', 'longitud', 'direccion', 'localidad', 'barrio')
         }),
         ('Estado y Prioridad', {
             'fields': ('estado', 'prioridad', 'duplicado', 'grupoDuplicado')
@@ -105,11 +146,20 @@ class ReporteAdmin(admin.ModelAdmin):
 # OTROS MODELOS
 # ============================================
 
+@admin.register(Zona)
+class ZonaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nombre', 'nivel', 'padre', 'actualizada_en')
+    list_filter = ('nivel',)
+    search_fields = ('nombre',)
+    exclude = ('poligonos',)
+    readonly_fields = ('oeste', 'sur', 'este', 'norte', 'actualizada_en')
+
+
 @admin.register(Evidencia)
 class EvidenciaAdmin(admin.ModelAdmin):
     list_display = ('id', 'reporte', 'tipo_evidencia', 'nombre_archivo', 'es_evidencia_reparacion', 'subida_por', 'fechaSubida')
     list_filter = ('tipo_evidencia', 'es_evidencia_reparacion', 'fechaSubida')
-    readonly_fields = ('fechaSubida', 'tamano_bytes')
+    readonly_fields = ('fechaSubida', 'tamano_bytes', 'hash_perceptual', 'hash_fallido')
 
 @admin.register(Asignacion)
 class AsignacionAdmin(admin.ModelAdmin):
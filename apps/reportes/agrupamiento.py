@@ -0,0 +1,255 @@
+"""
+Agrupamiento de reportes duplicados en lote
+Calcula vecindarios con NumPy sobre una malla espacio-temporal
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+RADIO_TIERRA_KM = 6371.0
+
+# Celdas vecinas "hacia adelante" en la malla (x, y, t). Junto con la propia
+# celda cubren cada par de celdas adyacentes exactamente una vez.
+_DESPLAZAMIENTOS = [
+    (dx, dy, dt)
+    for dx in (-1, 0, 1)
+    for dy in (-1, 0, 1)
+    for dt in (-1, 0, 1)
+    if (dx, dy, dt) > (0, 0, 0)
+]
+
+
+def distancia_haversine(lat1, lon1, lat2, lon2):
+    """ Versión vectorizada de DetectorDuplicados.calcular_distancia_haversine """
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return RADIO_TIERRA_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _proyectar(latitudes, longitudes):
+    """
+    Proyección equirectangular en km con el coseno de la latitud más extrema:
+    las distancias proyectadas nunca superan a las reales, así que dos puntos
+    a menos de radio_km siempre caen en celdas (o teselas) adyacentes.
+    """
+    cos_ref = np.cos(np.radians(np.abs(latitudes).max()))
+    x = RADIO_TIERRA_KM * np.radians(longitudes) * cos_ref
+    y = RADIO_TIERRA_KM * np.radians(latitudes)
+    return x, y
+
+
+def _por_punto(valor, n):
+    """ Convierte un umbral escalar o por punto en un arreglo de n valores """
+    return np.broadcast_to(np.asarray(valor, dtype=np.float64), (n,))
+
+
+def _claves_malla(latitudes, longitudes, tipos, tiempos, radio_km, ventana_seg):
+    """ Índices enteros de celda (x, y, t) desplazados para que empiecen en 1 """
+    x, y = _proyectar(latitudes, longitudes)
+
+    cx = np.floor(x / radio_km).astype(np.int64)
+    cy = np.floor(y / radio_km).astype(np.int64)
+    ct = np.floor(tiempos / ventana_seg).astype(np.int64)
+
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    ct -= ct.min() - 1
+
+    dimensiones = (int(tipos.max()) + 1, int(cx.max()) + 2, int(cy.max()) + 2, int(ct.max()) + 2)
+    if np.prod([float(d) for d in dimensiones]) >= 2 ** 62:
+        raise ValueError('La malla es demasiado grande para el radio y la ventana indicados')
+
+    return cx, cy, ct, dimensiones
+
+
+def pares_cercanos(latitudes, longitudes, tipos, tiempos, radio_km, ventana_seg):
+    """
+    Encuentra todos los pares de reportes del mismo tipo a menos de radio_km
+    y separados a lo sumo ventana_seg segundos.
+
+    latitudes y longitudes van en grados, tipos como enteros y tiempos en
+    segundos. radio_km y ventana_seg pueden ser un valor o un arreglo por
+    punto (iguales dentro de cada tipo); la malla usa el mayor de ellos.
+    Devuelve dos arreglos (i, j) de índices con i != j.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    tipos = np.asarray(tipos, dtype=np.int64)
+    tiempos = np.asarray(tiempos, dtype=np.float64)
+
+    n = len(latitudes)
+    vacio = np.empty(0, dtype=np.int64)
+    if n < 2:
+        return vacio, vacio
+
+    radios = _por_punto(radio_km, n)
+    ventanas = _por_punto(ventana_seg, n)
+    cx, cy, ct, (_, nx, ny, nt) = _claves_malla(
+        latitudes, longitudes, tipos, tiempos, radios.max(), ventanas.max()
+    )
+
+    def clave(dx, dy, dt):
+        return ((tipos * nx + cx + dx) * ny + cy + dy) * nt + ct + dt
+
+    orden = np.argsort(clave(0, 0, 0), kind='stable')
+    claves_ordenadas = clave(0, 0, 0)[orden]
+    posiciones = np.arange(n)
+
+    pares_i = []
+    pares_j = []
+    for dx, dy, dt in [(0, 0, 0)] + _DESPLAZAMIENTOS:
+        objetivo = clave(dx, dy, dt)[orden]
+        inicio = np.searchsorted(claves_ordenadas, objetivo, side='left')
+        fin = np.searchsorted(claves_ordenadas, objetivo, side='right')
+        if (dx, dy, dt) == (0, 0, 0):
+            # En la propia celda solo los pares (i, j) con j posterior a i
+            inicio = posiciones + 1
+
+        cantidad = np.maximum(fin - inicio, 0)
+        total = int(cantidad.sum())
+        if total == 0:
+            continue
+
+        i = np.repeat(posiciones, cantidad)
+        desplazamiento = np.arange(total) - np.repeat(np.cumsum(cantidad) - cantidad, cantidad)
+        j = np.repeat(inicio, cantidad) + desplazamiento
+
+        a = orden[i]
+        b = orden[j]
+        cerca = np.abs(tiempos[a] - tiempos[b]) <= ventanas[a]
+        a = a[cerca]
+        b = b[cerca]
+        cerca = distancia_haversine(latitudes[a], longitudes[a], latitudes[b], longitudes[b]) <= radios[a]
+        pares_i.append(a[cerca])
+        pares_j.append(b[cerca])
+
+    if not pares_i:
+        return vacio, vacio
+    return np.concatenate(pares_i), np.concatenate(pares_j)
+
+
+def _pares_fragmentos(fragmentos):
+    """
+    Calcula los pares de varios fragmentos (se ejecuta en un proceso hijo).
+    Cada par se conserva solo en el fragmento "propio" del punto de menor
+    índice global, para no repetirlo entre fragmentos vecinos.
+    """
+    resultados_i = []
+    resultados_j = []
+    for indices, propios, latitudes, longitudes, tipos, tiempos, radio_km, ventana_seg in fragmentos:
+        i, j = pares_cercanos(latitudes, longitudes, tipos, tiempos, radio_km, ventana_seg)
+        menor = np.where(indices[i] < indices[j], i, j)
+        conservar = propios[menor]
+        resultados_i.append(indices[i[conservar]])
+        resultados_j.append(indices[j[conservar]])
+
+    if not resultados_i:
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, vacio
+    return np.concatenate(resultados_i), np.concatenate(resultados_j)
+
+
+def pares_cercanos_paralelo(latitudes, longitudes, tipos, tiempos, radio_km, ventana_seg,
+                            trabajadores, tamano_tesela_km=1.0):
+    """
+    Igual que pares_cercanos, pero reparte el trabajo en fragmentos por
+    (tipo, tesela) y los procesa en un ProcessPoolExecutor.
+
+    Cada fragmento lleva los puntos de su tesela más los de las teselas
+    vecinas que están a menos de radio_km del borde, así que los pares que
+    cruzan la frontera entre teselas también se encuentran.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    tipos = np.asarray(tipos, dtype=np.int64)
+    tiempos = np.asarray(tiempos, dtype=np.float64)
+
+    n = len(latitudes)
+    if n < 2:
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, vacio
+
+    radios = _por_punto(radio_km, n)
+    ventanas = _por_punto(ventana_seg, n)
+    radio_km = radios.max()
+    tamano = max(tamano_tesela_km, radio_km)
+    x, y = _proyectar(latitudes, longitudes)
+    tx = np.floor(x / tamano).astype(np.int64)
+    ty = np.floor(y / tamano).astype(np.int64)
+
+    # Pertenencia de cada punto a su tesela y, como margen, a las vecinas
+    cerca_x = {-1: x - tx * tamano <= radio_km, 0: np.ones(n, dtype=bool), 1: (tx + 1) * tamano - x <= radio_km}
+    cerca_y = {-1: y - ty * tamano <= radio_km, 0: np.ones(n, dtype=bool), 1: (ty + 1) * tamano - y <= radio_km}
+
+    puntos = []
+    claves = []
+    propios = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            mascara = cerca_x[dx] & cerca_y[dy]
+            indices = np.nonzero(mascara)[0]
+            puntos.append(indices)
+            claves.append(np.stack([tipos[indices], tx[indices] + dx, ty[indices] + dy], axis=1))
+            propios.append(np.full(len(indices), dx == 0 and dy == 0))
+
+    puntos = np.concatenate(puntos)
+    claves = np.concatenate(claves)
+    propios = np.concatenate(propios)
+
+    orden = np.lexsort((claves[:, 2], claves[:, 1], claves[:, 0]))
+    puntos = puntos[orden]
+    claves = claves[orden]
+    propios = propios[orden]
+    limites = np.flatnonzero(np.any(np.diff(claves, axis=0) != 0, axis=1)) + 1
+
+    fragmentos = []
+    for indices, es_propio in zip(np.split(puntos, limites), np.split(propios, limites)):
+        # Fragmentos solo con puntos prestados de otras teselas no aportan pares
+        if len(indices) < 2 or not es_propio.any():
+            continue
+        fragmentos.append((
+            indices, es_propio, latitudes[indices], longitudes[indices],
+            tipos[indices], tiempos[indices], radios[indices], ventanas[indices]
+        ))
+
+    # Repartir los fragmentos en unas pocas tareas por trabajador
+    tareas = [fragmentos[k::trabajadores * 4] for k in range(trabajadores * 4)]
+    tareas = [tarea for tarea in tareas if tarea]
+
+    with ProcessPoolExecutor(max_workers=trabajadores) as ejecutor:
+        resultados = list(ejecutor.map(_pares_fragmentos, tareas))
+
+    if not resultados:
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, vacio
+    return (
+        np.concatenate([i for i, _ in resultados]),
+        np.concatenate([j for _, j in resultados]),
+    )
+
+
+def componentes_conexas(n, i, j):
+    """
+    Etiqueta las componentes conexas del grafo de n nodos con aristas (i, j).
+    Cada nodo recibe como etiqueta el menor índice de su componente.
+    """
+    etiquetas = np.arange(n)
+    if len(i) == 0:
+        return etiquetas
+
+    while True:
+        menor = np.minimum(etiquetas[i], etiquetas[j])
+        nuevas = etiquetas.copy()
+        np.minimum.at(nuevas, i, menor)
+        np.minimum.at(nuevas, j, menor)
+        # Salto de punteros: cada nodo apunta a la etiqueta de su etiqueta
+        nuevas = nuevas[nuevas]
+        if np.array_equal(nuevas, etiquetas):
+            return etiquetas
+        etiquetas = nuevas
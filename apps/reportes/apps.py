@@ -9,3 +9,8 @@ class ReportesConfig(AppConfig):
         import apps.reportes.duplicate_detector
         from . import duplicate_detector
         from . import signals
+        from . import mantenimiento
+        from django.core import checks
+        from .gazetteer import revisar_gazetteer
+
+        checks.register(revisar_gazetteer)
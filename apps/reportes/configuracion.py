@@ -0,0 +1,135 @@
+"""
+Configuración de la detección de duplicados
+Parámetros inmutables que se pasan explícitamente a cada ejecución
+"""
+
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from math import isfinite
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def _positivo(valor):
+    """ Número finito mayor que cero; NaN e infinito no sirven como radio ni ventana """
+    return isfinite(valor) and valor > 0
+
+
+@dataclass(frozen=True)
+class ConfiguracionDeteccion:
+    """
+    Radio y ventana temporal de una ejecución del detector.
+
+    por_tipo guarda excepciones por tipo de falla como tuplas
+    (tipo, radio_km, ventana_dias); un valor None usa el general.
+    Al ser inmutable, una ejecución manual nunca altera los parámetros
+    de las demás ejecuciones ni de los reportes que llegan en paralelo.
+    """
+
+    # Radio de búsqueda en kilómetros (50 metros = 0.05 km)
+    radio_km: float = 0.05
+
+    # Ventana temporal en días
+    ventana_dias: float = 7
+
+    # Bits distintos tolerados entre los dHash de dos fotos "iguales"
+    distancia_imagen: int = 6
+
+    # Similitud de Jaccard mínima entre textos de reportes sin coordenadas
+    similitud_texto: float = 0.5
+    por_tipo: tuple = field(default=())
+
+    def __post_init__(self):
+        if not _positivo(self.radio_km) or not _positivo(self.ventana_dias):
+            raise ValueError('El radio y la ventana temporal deben ser números positivos')
+        if not 0 <= self.distancia_imagen < 64:
+            raise ValueError('La distancia entre imágenes debe estar entre 0 y 63 bits')
+        if not 0 < self.similitud_texto <= 1:
+            raise ValueError('La similitud de texto debe estar entre 0 y 1')
+        for tipo, radio, ventana in self.por_tipo:
+            if (radio is not None and not _positivo(radio)) or (ventana is not None and not _positivo(ventana)):
+                raise ValueError(f'Parámetros inválidos para el tipo "{tipo}"')
+
+    def _excepcion(self, tipo):
+        for tipo_excepcion, radio, ventana in self.por_tipo:
+            if tipo_excepcion == tipo:
+                return radio, ventana
+        return None, None
+
+    def radio_para(self, tipo):
+        """ Radio en km que se aplica a un tipo de falla """
+        radio, _ = self._excepcion(tipo)
+        return radio or self.radio_km
+
+    def ventana_para(self, tipo):
+        """ Ventana temporal en días que se aplica a un tipo de falla """
+        _, ventana = self._excepcion(tipo)
+        return ventana or self.ventana_dias
+
+    @property
+    def radio_maximo(self):
+        return max([self.radio_km] + [radio for _, radio, _ in self.por_tipo if radio])
+
+    @property
+    def ventana_maxima(self):
+        return max([self.ventana_dias] + [ventana for _, _, ventana in self.por_tipo if ventana])
+
+    def ajustada(self, radio_km=None, ventana_dias=None):
+        """
+        Copia con otro radio o ventana para todos los tipos, como en las
+        ejecuciones manuales. Las excepciones por tipo conservan el valor
+        que no se cambió. Sin cambios devuelve la misma configuración.
+        """
+        if radio_km is None and ventana_dias is None:
+            return self
+        por_tipo = tuple(
+            (tipo, radio, ventana)
+            for tipo, radio, ventana in (
+                (tipo, None if radio_km is not None else radio, None if ventana_dias is not None else ventana)
+                for tipo, radio, ventana in self.por_tipo
+            )
+            if radio is not None or ventana is not None
+        )
+        return replace(
+            self,
+            radio_km=self.radio_km if radio_km is None else radio_km,
+            ventana_dias=self.ventana_dias if ventana_dias is None else ventana_dias,
+            por_tipo=por_tipo
+        )
+
+    @classmethod
+    def desde_diccionario(cls, datos):
+        """
+        Construye la configuración desde un diccionario como el de
+        settings.DETECCION_DUPLICADOS:
+
+            {'RADIO_KM': 0.05, 'VENTANA_DIAS': 7, 'DISTANCIA_IMAGEN': 6,
+             'SIMILITUD_TEXTO': 0.5,
+             'POR_TIPO': {'inundacion': {'RADIO_KM': 0.15, 'VENTANA_DIAS': 2}}}
+        """
+        por_defecto = cls()
+        return cls(
+            radio_km=datos.get('RADIO_KM', por_defecto.radio_km),
+            ventana_dias=datos.get('VENTANA_DIAS', por_defecto.ventana_dias),
+            distancia_imagen=datos.get('DISTANCIA_IMAGEN', por_defecto.distancia_imagen),
+            similitud_texto=datos.get('SIMILITUD_TEXTO', por_defecto.similitud_texto),
+            por_tipo=tuple(
+                (tipo, valores.get('RADIO_KM'), valores.get('VENTANA_DIAS'))
+                for tipo, valores in sorted(datos.get('POR_TIPO', {}).items())
+            )
+        )
+
+
+@lru_cache(maxsize=None)
+def obtener_configuracion():
+    """ Configuración por defecto leída una sola vez de settings """
+    return ConfiguracionDeteccion.desde_diccionario(getattr(settings, 'DETECCION_DUPLICADOS', {}))
+
+
+@receiver(setting_changed)
+def limpiar_configuracion(setting, **kwargs):
+    """ Descarta la configuración en caché cuando las pruebas cambian settings """
+    if setting == 'DETECCION_DUPLICADOS':
+        obtener_configuracion.cache_clear()
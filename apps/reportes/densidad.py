@@ -0,0 +1,273 @@
+"""
+Mapa de calor de los reportes
+Malla fija sobre la ciudad con una capa por tipo de falla y mes
+(CeldaDensidad), suavizada con un núcleo gaussiano y pintada en PNG
+"""
+
+import hashlib
+import io
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DateField, F, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+# Recuadro de la malla (oeste, sur, este, norte): Barranquilla con Soledad
+# y Puerto Colombia. Los reportes de afuera no entran al mapa de calor
+RECUADRO_DENSIDAD = (-74.90, 10.88, -74.74, 11.06)
+
+# Lado de la celda en grados, unos 110 metros
+TAMANO_CELDA = 0.001
+
+COLUMNAS = round((RECUADRO_DENSIDAD[2] - RECUADRO_DENSIDAD[0]) / TAMANO_CELDA)
+FILAS = round((RECUADRO_DENSIDAD[3] - RECUADRO_DENSIDAD[1]) / TAMANO_CELDA)
+
+# Desviación del suavizado en celdas: cada reporte se reparte en unos 200 m
+SIGMA_CELDAS = 2.0
+
+# Segundos que una imagen queda en la caché; la clave ya cambia con los datos
+DURACION_CACHE = 24 * 60 * 60
+
+# Escala de color de poco a mucho: (posición, rojo, verde, azul, opacidad)
+ESCALA_COLOR = (
+    (0.00, 37, 99, 235, 0),
+    (0.15, 37, 99, 235, 110),
+    (0.40, 22, 163, 74, 160),
+    (0.65, 250, 204, 21, 190),
+    (1.00, 220, 38, 38, 220),
+)
+
+
+def celda_densidad(latitud, longitud):
+    """ (fila, columna) de un punto en la malla, o None si queda afuera; fila 0 al norte """
+    oeste, _, _, norte = RECUADRO_DENSIDAD
+    fila = int(np.floor((norte - float(latitud)) / TAMANO_CELDA))
+    columna = int(np.floor((float(longitud) - oeste) / TAMANO_CELDA))
+    if 0 <= fila < FILAS and 0 <= columna < COLUMNAS:
+        return fila, columna
+    return None
+
+
+def mes_de(fecha):
+    """ Primer día del mes de una fecha y hora, en la zona horaria del proyecto """
+    return timezone.localtime(fecha).date().replace(day=1)
+
+
+# ============================================
+# ACTUALIZACIÓN INCREMENTAL
+# ============================================
+
+def _fila_densidad(valores, mes, signo):
+    if valores.get('latitud') is None or valores.get('longitud') is None:
+        return []
+    celda = celda_densidad(valores['latitud'], valores['longitud'])
+    if celda is None:
+        return []
+    return [(valores['tipo'], mes, *celda, signo)]
+
+
+def sumar_densidad(filas):
+    """
+    Suma las filas (tipo, mes, fila, columna, cantidad) a CeldaDensidad y sube
+    la versión de las capas tocadas. Las celdas que quedan en cero se borran.
+    """
+    from apps.reportes.models import CeldaDensidad, CapaDensidad
+    from .mantenimiento import sumar_contadores
+
+    sumar_contadores(
+        CeldaDensidad, ('tipo', 'mes', 'fila', 'columna'), ('cantidad',), filas, borrar_vacias='cantidad'
+    )
+    sumar_contadores(
+        CapaDensidad, ('tipo', 'mes'), ('version',), sorted({(tipo, mes, 1) for tipo, mes, *_ in filas})
+    )
+
+
+def filas_guardado(instance, created):
+    """ Filas que suman el reporte nuevo o lo cambian de celda si se movió o cambió de tipo """
+    if instance.reportado_en is None:
+        return []
+
+    mes = mes_de(instance.reportado_en)
+    actuales = instance._valores_campos(instance.CAMPOS_MAPA)
+    if created:
+        return _fila_densidad(actuales, mes, 1)
+
+    anteriores = getattr(instance, '_valores_mapa_anteriores', None)
+    campos = ('latitud', 'longitud', 'tipo')
+    if anteriores is None or any(campo not in anteriores or campo not in actuales for campo in campos):
+        return []  # No se sabe dónde estaba (campos diferidos); construir_densidad lo corrige
+    if all(anteriores[campo] == actuales[campo] for campo in campos):
+        return []
+
+    return _fila_densidad(anteriores, mes, -1) + _fila_densidad(actuales, mes, 1)
+
+
+def filas_borrado(instance):
+    """ Filas que descuentan el reporte eliminado """
+    if instance.reportado_en is None:
+        return []
+    return _fila_densidad(instance._valores_campos(instance.CAMPOS_MAPA), mes_de(instance.reportado_en), -1)
+
+
+# ============================================
+# CONSTRUCCIÓN EN LOTE
+# ============================================
+
+def construir_densidad(tamano_lote=5000):
+    """
+    Recalcula CeldaDensidad desde cero con NumPy, contando los reportes de
+    cada celda de la malla por tipo y mes. Todas las capas suben de versión,
+    así que las imágenes en caché se regeneran; hace falta al cambiar
+    RECUADRO_DENSIDAD o TAMANO_CELDA, o si el mapa de calor no coincide con
+    los reportes. Devuelve la cantidad de celdas creadas.
+    """
+    from apps.reportes.models import Reporte, CeldaDensidad, CapaDensidad
+
+    oeste, sur, este, norte = RECUADRO_DENSIDAD
+    filas = list(
+        Reporte.objects.filter(
+            latitud__gte=sur, latitud__lte=norte, longitud__gte=oeste, longitud__lte=este
+        )
+        .annotate(mes=TruncMonth('reportado_en', output_field=DateField()))
+        .order_by()
+        .values_list('tipo', 'mes', 'latitud', 'longitud')
+    )
+
+    with transaction.atomic():
+        CeldaDensidad.objects.all().delete()
+        CapaDensidad.objects.update(version=F('version') + 1)
+        if not filas:
+            return 0
+
+        columnas = np.array(filas, dtype=object).reshape(-1, 4)
+        tipos, codigos_tipo = np.unique(columnas[:, 0].astype(str), return_inverse=True)
+        meses, codigos_mes = np.unique(columnas[:, 1].astype('datetime64[D]'), return_inverse=True)
+        celdas_fila = np.floor((norte - columnas[:, 2].astype(np.float64)) / TAMANO_CELDA).astype(np.int64)
+        celdas_columna = np.floor((columnas[:, 3].astype(np.float64) - oeste) / TAMANO_CELDA).astype(np.int64)
+        dentro = (celdas_fila >= 0) & (celdas_fila < FILAS) & (celdas_columna >= 0) & (celdas_columna < COLUMNAS)
+
+        # Una clave entera por (tipo, mes, fila, columna) para contar con np.unique
+        claves = np.ravel_multi_index(
+            (codigos_tipo.ravel()[dentro], codigos_mes.ravel()[dentro], celdas_fila[dentro], celdas_columna[dentro]),
+            (len(tipos), len(meses), FILAS, COLUMNAS)
+        )
+        unicas, cantidades = np.unique(claves, return_counts=True)
+        tipo, mes, fila, columna = np.unravel_index(unicas, (len(tipos), len(meses), FILAS, COLUMNAS))
+        meses = meses.astype(object)
+
+        creados = 0
+        lote = []
+        capas = set()
+        for t, m, f, c, cantidad in zip(tipo.tolist(), mes.tolist(), fila.tolist(), columna.tolist(), cantidades.tolist()):
+            capas.add((str(tipos[t]), meses[m]))
+            lote.append(CeldaDensidad(
+                tipo=str(tipos[t]), mes=meses[m], fila=f, columna=c, cantidad=cantidad
+            ))
+            if len(lote) >= tamano_lote:
+                CeldaDensidad.objects.bulk_create(lote)
+                creados += len(lote)
+                lote = []
+        CeldaDensidad.objects.bulk_create(lote)
+        creados += len(lote)
+
+        capas -= set(CapaDensidad.objects.values_list('tipo', 'mes'))
+        CapaDensidad.objects.bulk_create([CapaDensidad(tipo=t, mes=m, version=1) for t, m in capas])
+    return creados
+
+
+# ============================================
+# IMAGEN
+# ============================================
+
+def _capas(tipo=None, desde=None, hasta=None):
+    """ Filtro de las capas (tipo, mes) elegidas; desde y hasta son fechas cualesquiera del mes """
+    filtro = Q()
+    if tipo:
+        filtro &= Q(tipo=tipo)
+    if desde:
+        filtro &= Q(mes__gte=desde.replace(day=1))
+    if hasta:
+        filtro &= Q(mes__lte=hasta.replace(day=1))
+    return filtro
+
+
+def version_densidad(tipo=None, desde=None, hasta=None):
+    """ Huella de las versiones de las capas elegidas: cambia si cambia alguna celda """
+    from apps.reportes.models import CapaDensidad
+
+    versiones = CapaDensidad.objects.filter(_capas(tipo, desde, hasta)).order_by('tipo', 'mes').values_list(
+        'tipo', 'mes', 'version'
+    )
+    huella = hashlib.sha1(repr(list(versiones)).encode('utf-8'))
+    return huella.hexdigest()[:20]
+
+
+def raster_densidad(tipo=None, desde=None, hasta=None):
+    """ Reportes por celda (FILAS × COLUMNAS) sumando las capas elegidas """
+    from apps.reportes.models import CeldaDensidad
+
+    celdas = np.array(
+        list(CeldaDensidad.objects.filter(_capas(tipo, desde, hasta)).values_list('fila', 'columna', 'cantidad')),
+        dtype=np.int64
+    ).reshape(-1, 3)
+    return np.bincount(
+        celdas[:, 0] * COLUMNAS + celdas[:, 1], weights=celdas[:, 2], minlength=FILAS * COLUMNAS
+    ).reshape(FILAS, COLUMNAS)
+
+
+def suavizar(raster, sigma=SIGMA_CELDAS):
+    """ Desenfoque gaussiano separable: una pasada por filas y otra por columnas """
+    radio = max(1, int(3 * sigma))
+    desplazamientos = np.arange(-radio, radio + 1)
+    nucleo = np.exp(-desplazamientos ** 2 / (2 * sigma ** 2))
+    nucleo /= nucleo.sum()
+
+    for eje in (0, 1):
+        relleno = [(0, 0), (0, 0)]
+        relleno[eje] = (radio, radio)
+        ampliado = np.pad(raster, relleno)
+        largo = raster.shape[eje]
+        raster = sum(
+            peso * np.take(ampliado, np.arange(i, i + largo), axis=eje)
+            for i, peso in enumerate(nucleo)
+        )
+    return raster
+
+
+def pintar_densidad(raster):
+    """ PNG con transparencia; el 99,5 % de las celdas con reportes queda por debajo del rojo """
+    from PIL import Image
+
+    positivos = raster[raster > 0]
+    tope = np.percentile(positivos, 99.5) if len(positivos) else 1.0
+    intensidad = np.clip(raster / max(tope, 1e-9), 0, 1)
+
+    posiciones = [parada[0] for parada in ESCALA_COLOR]
+    rgba = np.stack([
+        np.interp(intensidad, posiciones, [parada[canal] for parada in ESCALA_COLOR])
+        for canal in range(1, 5)
+    ], axis=-1)
+    rgba[intensidad < 0.01, 3] = 0
+
+    salida = io.BytesIO()
+    Image.fromarray(rgba.round().astype(np.uint8), 'RGBA').save(salida, format='PNG', optimize=True)
+    return salida.getvalue()
+
+
+def imagen_densidad(tipo=None, desde=None, hasta=None, version=None):
+    """
+    (versión, PNG) del mapa de calor. La imagen se guarda en la caché de
+    Django con la versión en la clave, así que nunca se sirve una vieja.
+    """
+    desde = desde.replace(day=1) if desde else None
+    hasta = hasta.replace(day=1) if hasta else None
+    version = version or version_densidad(tipo, desde, hasta)
+    clave = f'densidad:{version}:{tipo or ""}:{desde or ""}:{hasta or ""}'
+    imagen = cache.get(clave)
+    if imagen is None:
+        imagen = pintar_densidad(suavizar(raster_densidad(tipo, desde, hasta)))
+        cache.set(clave, imagen, DURACION_CACHE)
+    return version, imagen
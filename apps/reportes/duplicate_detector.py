@@ -7,7 +7,54 @@ from decimal import Decimal
 from math import radians, sin, cos, sqrt, atan2
 from datetime import timedelta
 from django.utils import timezone
-from django.db import transaction
+from django.conf import settings
+from django.db import connection, transaction
+from .espacial import celdas_vecinas
+from .configuracion import obtener_configuracion
+
+
+def _en_bloques(valores, tamano=500):
+    """ Divide una lista de ids en bloques para no exceder el límite de parámetros SQL """
+    for inicio in range(0, len(valores), tamano):
+        yield valores[inicio:inicio + tamano]
+
+
+RAZON_MISMA_FOTO = 'Reportes con la misma fotografía'
+RAZON_TEXTO_SIMILAR = 'Reportes sin ubicación con descripción similar'
+
+
+class ConjuntoDisjunto:
+    """ Estructura union-find con compresión de caminos y unión por rango """
+
+    def __init__(self):
+        self.padre = {}
+        self.rango = {}
+
+    def agregar(self, elemento):
+        if elemento not in self.padre:
+            self.padre[elemento] = elemento
+            self.rango[elemento] = 0
+
+    def buscar(self, elemento):
+        self.agregar(elemento)
+        raiz = elemento
+        while self.padre[raiz] != raiz:
+            raiz = self.padre[raiz]
+        while self.padre[elemento] != raiz:
+            self.padre[elemento], elemento = raiz, self.padre[elemento]
+        return raiz
+
+    def unir(self, a, b):
+        raiz_a = self.buscar(a)
+        raiz_b = self.buscar(b)
+        if raiz_a == raiz_b:
+            return raiz_a
+        if self.rango[raiz_a] < self.rango[raiz_b]:
+            raiz_a, raiz_b = raiz_b, raiz_a
+        self.padre[raiz_b] = raiz_a
+        if self.rango[raiz_a] == self.rango[raiz_b]:
+            self.rango[raiz_a] += 1
+        return raiz_a
 
 
 class DetectorDuplicados:
@@ -16,13 +63,10 @@ class DetectorDuplicados:
     - Proximidad geográfica (radio configurable)
     - Tipo de falla similar
     - Ventana temporal
-    """
-
-    # Radio de búsqueda en kilómetros (50 metros = 0.05 km)
-    RADIO_BUSQUEDA_KM = 0.05
 
-    # Ventana temporal en días
-    VENTANA_TEMPORAL_DIAS = 7
+    Los parámetros llegan en una ConfiguracionDeteccion; sin ella se usa
+    la configuración por defecto de settings.DETECCION_DUPLICADOS.
+    """
 
     @staticmethod
     def calcular_distancia_haversine(lat1, lon1, lat2, lon2):
@@ -43,9 +87,11 @@ class DetectorDuplicados:
         return R * c
 
     @classmethod
-    def buscar_reportes_cercanos(cls, reporte, radio_km=None):
+    def buscar_reportes_cercanos(cls, reporte, config=None):
         from apps.reportes.models import Reporte
 
+        config = config or obtener_configuracion()
+
         if not reporte.latitud or not reporte.longitud:
             return Reporte.objects.none()
 
@@ -53,7 +99,8 @@ class DetectorDuplicados:
         lat = Decimal(str(reporte.latitud))
         lon = Decimal(str(reporte.longitud))
 
-        radio = radio_km or cls.RADIO_BUSQUEDA_KM
+        radio = config.radio_para(reporte.tipo)
+        ventana = timedelta(days=config.ventana_para(reporte.tipo))
 
         # 1 grado ≈ 111 km
         delta_lat = Decimal(radio / 111.0)
@@ -64,10 +111,17 @@ class DetectorDuplicados:
         lon_min = lon - delta_lon
         lon_max = lon + delta_lon
 
-        fecha_min = reporte.reportado_en - timedelta(days=cls.VENTANA_TEMPORAL_DIAS)
-        fecha_max = reporte.reportado_en + timedelta(days=cls.VENTANA_TEMPORAL_DIAS)
+        fecha_min = reporte.reportado_en - ventana
+        fecha_max = reporte.reportado_en + ventana
+
+        # Las celdas vecinas acotan la búsqueda usando el índice (celda, tipo, reportado_en).
+        # Aquí no se usa el R*Tree (filtro_recuadro): ese índice solo acota el espacio, y
+        # este acota a la vez espacio, tipo y ventana; las celdas además son las que se
+        # bloquean con CandadoCelda y las que agrupa detectar_en_lote.
+        celdas = celdas_vecinas(lat, lon, radio)
 
         candidatos = Reporte.objects.filter(
+            celda__in=celdas,
             latitud__gte=lat_min,
             latitud__lte=lat_max,
             longitud__gte=lon_min,
@@ -90,75 +144,870 @@ class DetectorDuplicados:
 
         return Reporte.objects.filter(id__in=reportes_cercanos)
 
+    @classmethod
+    def buscar_reportes_por_imagen(cls, reporte, config=None):
+        """
+        Reportes con alguna foto parecida a las del reporte dentro de la
+        ventana temporal, tengan o no coordenadas. Calcula los hashes que
+        falten y consulta el índice BK-tree de imágenes.
+        """
+        from apps.reportes.models import Reporte
+        from .imagenes import actualizar_hashes, indice_imagenes
+
+        config = config or obtener_configuracion()
+
+        hashes = actualizar_hashes(reporte.evidencias.all())
+        if not hashes:
+            return Reporte.objects.none()
+
+        parecidas = set()
+        for valor in hashes.values():
+            parecidas.update(indice_imagenes.buscar(valor, config.distancia_imagen))
+        parecidas -= set(hashes)
+        if not parecidas:
+            return Reporte.objects.none()
+
+        ventana = timedelta(days=config.ventana_para(reporte.tipo))
+        ids = set()
+        for bloque in _en_bloques(sorted(parecidas)):
+            ids.update(
+                Reporte.objects.filter(
+                    evidencias__id__in=bloque,
+                    reportado_en__gte=reporte.reportado_en - ventana,
+                    reportado_en__lte=reporte.reportado_en + ventana
+                ).exclude(id=reporte.id).values_list('id', flat=True)
+            )
+        return Reporte.objects.filter(id__in=ids)
+
+    @classmethod
+    def buscar_reportes_por_texto(cls, reporte, config=None):
+        """
+        Reportes del mismo tipo dentro de la ventana temporal cuyo texto se
+        parece al del reporte. Las bandas LSH dan los candidatos con una
+        consulta indexada y la firma MinHash confirma la similitud.
+        """
+        from django.db.models import Q
+        from apps.reportes.models import Reporte, BandaTexto
+        from .texto import bandas, firma_desde_bytes, similitud
+
+        config = config or obtener_configuracion()
+
+        if not reporte.firma_texto:
+            return Reporte.objects.none()
+
+        firma = firma_desde_bytes(reporte.firma_texto)
+        coincidencias = Q()
+        for banda, cubeta in bandas(firma):
+            coincidencias |= Q(banda=banda, cubeta=cubeta)
+
+        ventana = timedelta(days=config.ventana_para(reporte.tipo))
+        candidatos = Reporte.objects.filter(
+            id__in=BandaTexto.objects.filter(coincidencias).values('reporte_id'),
+            tipo=reporte.tipo,
+            reportado_en__gte=reporte.reportado_en - ventana,
+            reportado_en__lte=reporte.reportado_en + ventana
+        ).exclude(id=reporte.id).values_list('id', 'firma_texto')
+
+        parecidos = [
+            candidato_id for candidato_id, firma_candidato in candidatos
+            if firma_candidato and similitud(firma, firma_desde_bytes(firma_candidato)) >= config.similitud_texto
+        ]
+        return Reporte.objects.filter(id__in=parecidos)
+
     @classmethod
     @transaction.atomic
-    def detectar_y_marcar_duplicado(cls, reporte):
-        from apps.reportes.models import GrupoDuplicado, HistorialReporte
+    def detectar_y_marcar_duplicado(cls, reporte, config=None):
+        config = config or obtener_configuracion()
+
+        # Serializa la detección con otros reportes cercanos antes de leer candidatos
+        if reporte.latitud and reporte.longitud:
+            cls._bloquear_celdas(
+                celdas_vecinas(reporte.latitud, reporte.longitud, config.radio_para(reporte.tipo))
+            )
 
-        reportes_cercanos = cls.buscar_reportes_cercanos(reporte)
+        reportes_cercanos = list(
+            cls.buscar_reportes_cercanos(reporte, config).values_list('id', 'grupoDuplicado_id')
+        )
+        reportes_misma_foto = list(
+            cls.buscar_reportes_por_imagen(reporte, config).values_list('id', 'grupoDuplicado_id')
+        )
+        # Sin coordenadas solo queda comparar el texto
+        reportes_texto_similar = []
+        if not reporte.latitud or not reporte.longitud:
+            reportes_texto_similar = list(
+                cls.buscar_reportes_por_texto(reporte, config).values_list('id', 'grupoDuplicado_id')
+            )
 
-        if not reportes_cercanos.exists():
+        if not reportes_cercanos and not reportes_misma_foto and not reportes_texto_similar:
             return False, None
 
-        # Verificar si alguno ya tiene grupo
-        grupos_existentes = GrupoDuplicado.objects.filter(
-            reportes__in=reportes_cercanos
-        ).distinct()
+        grupo_actual = dict(reportes_cercanos + reportes_misma_foto + reportes_texto_similar)
+        grupo_actual[reporte.id] = reporte.grupoDuplicado_id
+
+        if reportes_cercanos:
+            razon = f'Reportes de tipo "{reporte.get_tipo_display()}" en un radio de {config.radio_para(reporte.tipo) * 1000}m'
+        elif reportes_misma_foto:
+            razon = RAZON_MISMA_FOTO
+        else:
+            razon = RAZON_TEXTO_SIMILAR
+        grupos = cls._consolidar_grupos([
+            (list(grupo_actual), {g for g in grupo_actual.values() if g}, razon)
+        ], grupo_actual)
+
+        grupo = grupos[0]
+        reporte.duplicado = True
+        reporte.grupoDuplicado = grupo
+        return True, grupo
 
-        if grupos_existentes.exists():
-            grupo = grupos_existentes.first()
-            reporte.duplicado = True
-            reporte.grupoDuplicado = grupo
-            reporte.save()
+    @classmethod
+    def _detectar_por_imagen(cls, reporte_ids, config):
+        """
+        Agrupa los reportes indicados con los que tienen fotos parecidas.
+        Devuelve la cantidad de duplicados marcados.
+        """
+        from apps.reportes.models import Evidencia
+
+        con_foto = set()
+        for bloque in _en_bloques(sorted(reporte_ids)):
+            con_foto.update(
+                Evidencia.objects.filter(
+                    reporte_id__in=bloque,
+                    tipo_evidencia='foto',
+                    es_evidencia_reparacion=False
+                ).values_list('reporte_id', flat=True)
+            )
+
+        return cls._detectar_por_candidatos(con_foto, cls.buscar_reportes_por_imagen, RAZON_MISMA_FOTO, config)
+
+    @classmethod
+    def _detectar_por_texto(cls, reporte_ids, config):
+        """
+        Agrupa los reportes sin coordenadas indicados con los que tienen
+        texto parecido. Devuelve la cantidad de duplicados marcados.
+        """
+        from django.db.models import Q
+        from apps.reportes.models import Reporte
+
+        sin_coordenadas = set()
+        for bloque in _en_bloques(sorted(reporte_ids)):
+            sin_coordenadas.update(
+                Reporte.objects.filter(id__in=bloque)
+                .filter(Q(latitud__isnull=True) | Q(longitud__isnull=True))
+                .values_list('id', flat=True)
+            )
+
+        return cls._detectar_por_candidatos(sin_coordenadas, cls.buscar_reportes_por_texto, RAZON_TEXTO_SIMILAR, config)
+
+    @classmethod
+    def _detectar_por_candidatos(cls, reporte_ids, buscar, razon, config):
+        """
+        Une cada reporte indicado con los candidatos que devuelve
+        buscar(reporte, config) y escribe los grupos resultantes.
+        Devuelve la cantidad de duplicados marcados.
+        """
+        from apps.reportes.models import Reporte
+
+        union = ConjuntoDisjunto()
+        grupo_actual = {}
+        for bloque in _en_bloques(sorted(reporte_ids)):
+            for reporte in Reporte.objects.filter(id__in=bloque):
+                candidatos = list(
+                    buscar(reporte, config).values_list('id', 'grupoDuplicado_id')
+                )
+                if candidatos:
+                    grupo_actual[reporte.id] = reporte.grupoDuplicado_id
+                for candidato_id, grupo_id in candidatos:
+                    grupo_actual[candidato_id] = grupo_id
+                    union.unir(reporte.id, candidato_id)
+
+        marcados, _ = cls._escribir_componentes(union, grupo_actual, razon)
+        return marcados
+
+    @classmethod
+    def _escribir_componentes(cls, union, grupo_actual, razon):
+        """
+        Escribe como grupos las componentes del conjunto disjunto sobre los
+        reportes de grupo_actual, salvo las que ya forman un único grupo.
+        Devuelve (duplicados marcados, grupos finales).
+        """
+        partes = {}
+        for reporte_id in grupo_actual:
+            partes.setdefault(union.buscar(reporte_id), []).append(reporte_id)
+
+        conjuntos = []
+        for ids_parte in partes.values():
+            if len(ids_parte) < 2:
+                continue
+            grupos_parte = {grupo_actual[reporte_id] for reporte_id in ids_parte}
+            if len(grupos_parte) == 1 and None not in grupos_parte:
+                continue
+            conjuntos.append((ids_parte, grupos_parte - {None}, razon))
+
+        if not conjuntos:
+            return 0, []
+
+        marcados = sum(1 for ids_parte, _, _ in conjuntos for reporte_id in ids_parte if grupo_actual[reporte_id] is None)
+        return marcados, cls._consolidar_grupos(conjuntos, grupo_actual)
+
+    @classmethod
+    @transaction.atomic
+    def detectar_por_texto_en_lote(cls, reportes=None, config=None):
+        """
+        Agrupa en una pasada los reportes sin coordenadas con texto parecido.
+        Solo se comparan firmas de reportes que comparten una cubeta LSH,
+        del mismo tipo y dentro de la ventana temporal, así que el costo
+        crece con la cantidad de reportes y no con la de pares posibles.
+        Devuelve (reportes marcados, grupos creados).
+        """
+        from django.db.models import Q
+        from apps.reportes.models import Reporte, BandaTexto
+        from .texto import firma_desde_bytes, similitud
+
+        config = config or obtener_configuracion()
+
+        if reportes is None:
+            reportes = Reporte.objects.all()
+        reportes = reportes.filter(
+            Q(latitud__isnull=True) | Q(longitud__isnull=True),
+            firma_texto__isnull=False
+        ).order_by()
+
+        datos = {}
+        for reporte_id, tipo, fecha, grupo_id, firma in reportes.values_list(
+            'id', 'tipo', 'reportado_en', 'grupoDuplicado_id', 'firma_texto'
+        ).iterator(chunk_size=10000):
+            datos[reporte_id] = (tipo, fecha, grupo_id, firma_desde_bytes(firma))
+
+        cubetas = {}
+        for reporte_id, banda, cubeta in BandaTexto.objects.filter(
+            reporte__in=reportes
+        ).values_list('reporte_id', 'banda', 'cubeta').iterator(chunk_size=10000):
+            cubetas.setdefault((banda, cubeta), []).append(reporte_id)
+
+        union = ConjuntoDisjunto()
+        for miembros in cubetas.values():
+            if len(miembros) < 2:
+                continue
+            # Ventana deslizante sobre los miembros ordenados por tipo y fecha
+            miembros.sort(key=lambda reporte_id: (datos[reporte_id][0], datos[reporte_id][1]))
+            inicio = 0
+            for k, reporte_id in enumerate(miembros):
+                tipo, fecha, _, firma = datos[reporte_id]
+                ventana = timedelta(days=config.ventana_para(tipo))
+                while datos[miembros[inicio]][0] != tipo or fecha - datos[miembros[inicio]][1] > ventana:
+                    inicio += 1
+                for otro_id in miembros[inicio:k]:
+                    if union.buscar(otro_id) == union.buscar(reporte_id):
+                        continue
+                    if similitud(firma, datos[otro_id][3]) >= config.similitud_texto:
+                        union.unir(otro_id, reporte_id)
+
+        grupo_actual = {
+            reporte_id: datos[reporte_id][2]
+            for reporte_id in union.padre
+        }
+        grupos_previos = {grupo_id for grupo_id in grupo_actual.values() if grupo_id}
+        marcados, grupos_finales = cls._escribir_componentes(union, grupo_actual, RAZON_TEXTO_SIMILAR)
+        return marcados, len({grupo.id for grupo in grupos_finales} - grupos_previos)
+
+    @classmethod
+    def _bloquear_celdas(cls, celdas):
+        """
+        Bloquea hasta el final de la transacción en curso las celdas de la
+        malla indicadas. Con bloqueo de filas (PostgreSQL, MySQL) dos
+        detecciones que comparten alguna celda se ejecutan una después de la
+        otra y las demás no se esperan; las filas se crean si faltan y se
+        bloquean en orden ascendente para que dos transacciones nunca se
+        esperen mutuamente.
+
+        SQLite no tiene SELECT ... FOR UPDATE: ahí se escribe una sola fila,
+        que toma el bloqueo de escritura de toda la base, y las detecciones
+        se serializan aunque estén en zonas distintas de la ciudad.
+        """
+        from apps.reportes.models import CandadoCelda
+
+        celdas = sorted(set(celdas))
+        if not celdas:
+            return
+        if not connection.features.has_select_for_update:
+            CandadoCelda.objects.bulk_create([CandadoCelda(celda=celdas[0])], ignore_conflicts=True)
+            return
+
+        CandadoCelda.objects.bulk_create(
+            [CandadoCelda(celda=celda) for celda in celdas],
+            ignore_conflicts=True,
+            batch_size=500
+        )
+        for bloque in _en_bloques(celdas):
+            list(
+                CandadoCelda.objects.select_for_update()
+                .filter(celda__in=bloque)
+                .order_by('celda')
+                .values_list('id', flat=True)
+            )
+
+    @classmethod
+    def _consolidar_grupos(cls, conjuntos, grupo_actual):
+        """
+        Escribe en la base de datos una agrupación ya calculada.
+
+        conjuntos es una lista de (ids de reportes, ids de grupos existentes,
+        razón para un grupo nuevo). Los conjuntos que comparten algún grupo se
+        fusionan mediante un conjunto disjunto; cada resultado conserva su grupo
+        más antiguo y absorbe los demás. grupo_actual indica el grupo de cada
+        reporte antes de agrupar.
+
+        Devuelve el grupo final de cada conjunto, en el mismo orden.
+        """
+        from apps.reportes.models import Reporte, GrupoDuplicado, HistorialReporte
+
+        union = ConjuntoDisjunto()
+        for indice, (ids_reportes, ids_grupos, _) in enumerate(conjuntos):
+            union.agregar(('conjunto', indice))
+            for grupo_id in ids_grupos:
+                union.unir(('conjunto', indice), ('grupo', grupo_id))
+
+        # Reunir reportes y grupos de cada conjunto fusionado
+        fusionados = {}
+        for indice, (ids_reportes, ids_grupos, razon) in enumerate(conjuntos):
+            raiz = union.buscar(('conjunto', indice))
+            datos = fusionados.setdefault(raiz, {'reportes': set(), 'grupos': set(), 'razon': razon})
+            datos['reportes'].update(ids_reportes)
+            datos['grupos'].update(ids_grupos)
+
+        # Crear los grupos que faltan en una sola sentencia
+        sin_grupo = [datos for datos in fusionados.values() if not datos['grupos']]
+        creados = GrupoDuplicado.objects.bulk_create([
+            GrupoDuplicado(razon=datos['razon']) for datos in sin_grupo
+        ])
+        for datos, grupo in zip(sin_grupo, creados):
+            datos['canonico'] = grupo.id
+
+        involucrados = {}
+        for datos in fusionados.values():
+            if datos['grupos']:
+                datos['canonico'] = min(datos['grupos'])
+                for grupo_id in datos['grupos']:
+                    involucrados[grupo_id] = datos
+
+        # Todos los miembros actuales de los grupos involucrados
+        for bloque in _en_bloques(list(involucrados)):
+            miembros = Reporte.objects.filter(grupoDuplicado_id__in=bloque).values_list('id', 'grupoDuplicado_id')
+            for reporte_id, grupo_id in miembros:
+                involucrados[grupo_id]['reportes'].add(reporte_id)
+                grupo_actual.setdefault(reporte_id, grupo_id)
+
+        ahora = timezone.now()
+        actualizados = []
+        historial = []
+        for datos in fusionados.values():
+            canonico = datos['canonico']
+            otros = len(datos['reportes']) - 1
+            for reporte_id in datos['reportes']:
+                anterior = grupo_actual.get(reporte_id)
+                if anterior == canonico:
+                    continue
+                actualizados.append(Reporte(
+                    id=reporte_id,
+                    duplicado=True,
+                    grupoDuplicado_id=canonico,
+                    actualizado_en=ahora
+                ))
+                if anterior:
+                    historial.append(HistorialReporte(
+                        reporte_id=reporte_id,
+                        usuario=None,
+                        accion='Grupo de duplicados fusionado',
+                        detalles=f'Grupo #{anterior} fusionado en el Grupo #{canonico}'
+                    ))
+                else:
+                    historial.append(HistorialReporte(
+                        reporte_id=reporte_id,
+                        usuario=None,
+                        accion='Marcado como duplicado',
+                        detalles=f'Agrupado con otros {otros} reportes similares'
+                    ))
+
+        Reporte.objects.bulk_update(
+            actualizados,
+            ['duplicado', 'grupoDuplicado', 'actualizado_en'],
+            batch_size=1000
+        )
+        HistorialReporte.objects.bulk_create(historial, batch_size=1000)
+
+        absorbidos = [g for g, datos in involucrados.items() if g != datos['canonico']]
+        for bloque in _en_bloques(absorbidos):
+            GrupoDuplicado.objects.filter(id__in=bloque).delete()
+
+        ids_canonicos = list({datos['canonico'] for datos in fusionados.values()})
+        cls.actualizar_estadisticas(ids_canonicos)
+
+        canonicos = {}
+        for bloque in _en_bloques(ids_canonicos):
+            canonicos.update(GrupoDuplicado.objects.in_bulk(bloque))
+
+        return [
+            canonicos[fusionados[union.buscar(('conjunto', indice))]['canonico']]
+            for indice in range(len(conjuntos))
+        ]
+
+    @classmethod
+    @transaction.atomic
+    def detectar_en_lote(cls, reportes=None, config=None, trabajadores=1):
+        """
+        Detecta duplicados de todos los reportes con coordenadas en una sola
+        pasada. Los vecindarios se calculan en memoria con NumPy y los
+        resultados se escriben con unas pocas sentencias masivas.
+        Con trabajadores > 1 los vecindarios se calculan en paralelo por
+        fragmentos (tipo, tesela); la escritura sigue en este proceso.
+        Devuelve (reportes marcados, grupos creados).
+        """
+        import numpy as np
+        from apps.reportes.models import Reporte
+        from .agrupamiento import pares_cercanos, pares_cercanos_paralelo, componentes_conexas
+
+        config = config or obtener_configuracion()
+
+        if reportes is None:
+            reportes = Reporte.objects.all()
+
+        filas = reportes.filter(
+            latitud__isnull=False,
+            longitud__isnull=False
+        ).order_by().values_list(
+            'id', 'latitud', 'longitud', 'tipo', 'reportado_en', 'grupoDuplicado_id'
+        )
+
+        codigos_tipo = {tipo: codigo for codigo, (tipo, _) in enumerate(Reporte.TIPOS_FALLA)}
+        nombres_tipo = dict(Reporte.TIPOS_FALLA)
+
+        ids, latitudes, longitudes, tipos, tiempos, grupos = [], [], [], [], [], []
+        for id_, lat, lon, tipo, fecha, grupo_id in filas.iterator(chunk_size=10000):
+            ids.append(id_)
+            latitudes.append(float(lat))
+            longitudes.append(float(lon))
+            tipos.append(codigos_tipo.get(tipo, len(codigos_tipo)))
+            tiempos.append(fecha.timestamp())
+            grupos.append(grupo_id or 0)
+
+        n = len(ids)
+        if n < 2:
+            return 0, 0
+
+        ids = np.array(ids, dtype=np.int64)
+        tipos = np.array(tipos, dtype=np.int64)
+        grupos = np.array(grupos, dtype=np.int64)
+
+        # Umbrales de cada punto según su tipo (el código extra es "sin tipo")
+        tipo_por_codigo = {codigo: tipo for tipo, codigo in codigos_tipo.items()}
+        radios_tipo = np.array([
+            config.radio_para(tipo_por_codigo.get(codigo)) for codigo in range(len(codigos_tipo) + 1)
+        ])
+        ventanas_tipo = np.array([
+            config.ventana_para(tipo_por_codigo.get(codigo)) * 24 * 3600 for codigo in range(len(codigos_tipo) + 1)
+        ])
+
+        if trabajadores > 1:
+            i, j = pares_cercanos_paralelo(
+                latitudes, longitudes, tipos, tiempos,
+                radios_tipo[tipos], ventanas_tipo[tipos], trabajadores
+            )
+        else:
+            i, j = pares_cercanos(
+                latitudes, longitudes, tipos, tiempos,
+                radios_tipo[tipos], ventanas_tipo[tipos]
+            )
+        etiquetas = componentes_conexas(n, i, j)
+
+        # Un conjunto por componente con duplicados sin marcar o con varios grupos
+        nombres_por_codigo = {codigo: nombres_tipo.get(tipo, tipo) for tipo, codigo in codigos_tipo.items()}
+        orden = np.argsort(etiquetas, kind='stable')
+        limites = np.flatnonzero(np.diff(etiquetas[orden])) + 1
+
+        conjuntos = []
+        grupo_actual = {}
+        for componente in np.split(orden, limites):
+            if len(componente) < 2:
+                continue
+            grupos_componente = set(grupos[componente].tolist()) - {0}
+            if len(grupos_componente) == 1 and (grupos[componente] > 0).all():
+                continue
+            ids_componente = ids[componente].tolist()
+            for reporte_id, grupo_id in zip(ids_componente, grupos[componente].tolist()):
+                grupo_actual[reporte_id] = grupo_id or None
+            codigo = int(tipos[componente[0]])
+            razon = f'Reportes de tipo "{nombres_por_codigo.get(codigo, "Otro")}" en un radio de {radios_tipo[codigo] * 1000}m'
+            conjuntos.append((ids_componente, grupos_componente, razon))
+
+        if not conjuntos:
+            return 0, 0
+
+        marcados = sum(1 for grupo_id in grupo_actual.values() if grupo_id is None)
+        grupos_finales = cls._consolidar_grupos(conjuntos, grupo_actual)
+        grupos_creados = {grupo.id for grupo in grupos_finales} - set(grupos[grupos > 0].tolist())
+
+        return marcados, len(grupos_creados)
+
+    @classmethod
+    def detectar_incremental(cls, config=None, trabajadores=1,
+                             tamano_lote=5000, nombre='detectar_duplicados'):
+        """
+        Detección por lotes que solo recorre los reportes posteriores a la
+        marca de agua guardada, más los de la ventana temporal anterior (los
+        únicos que todavía pueden coincidir con ellos).
+
+        Cada lote guarda su marca de agua en la misma transacción que sus
+        resultados, así que una ejecución interrumpida continúa donde quedó.
+        Genera (reportes nuevos, duplicados marcados, punto de control) por lote.
+        """
+        from django.db.models import Q
+        from apps.reportes.models import Reporte, PuntoControlDeteccion
+
+        config = config or obtener_configuracion()
+        ventana = timedelta(days=config.ventana_maxima)
+
+        while True:
+            with transaction.atomic():
+                punto, _ = PuntoControlDeteccion.objects.select_for_update().get_or_create(nombre=nombre)
+
+                nuevos = Reporte.objects.filter(latitud__isnull=False, longitud__isnull=False)
+                if punto.ultimo_reportado_en:
+                    nuevos = nuevos.filter(
+                        Q(reportado_en__gt=punto.ultimo_reportado_en) |
+                        Q(reportado_en=punto.ultimo_reportado_en, id__gt=punto.ultimo_id)
+                    )
+                lote = list(
+                    nuevos.order_by('reportado_en', 'id').values_list('id', 'reportado_en')[:tamano_lote]
+                )
+                if not lote:
+                    return
+
+                desde = lote[0][1]
+                punto.ultimo_id, punto.ultimo_reportado_en = lote[-1]
+
+                contexto = Reporte.objects.filter(
+                    reportado_en__gte=desde - ventana,
+                    reportado_en__lte=punto.ultimo_reportado_en
+                )
+                marcados, _ = cls.detectar_en_lote(
+                    contexto,
+                    config=config,
+                    trabajadores=trabajadores
+                )
+                punto.save()
+
+            yield len(lote), marcados, punto
+
+    @classmethod
+    @transaction.atomic
+    def reagrupar(cls, reporte, config=None):
+        """
+        Reagrupa un reporte cuya ubicación o tipo cambió: lo saca de su grupo,
+        revisa el grupo que deja y vuelve a detectar en su nueva posición.
+        Si se le quitaron las coordenadas también se vuelve a detectar: sin
+        ellas aún puede agruparse por foto o por texto. El texto se vuelve a
+        indexar porque guardar una instancia anterior a la indexación lo borra.
+        """
+        from apps.reportes.models import Reporte, HistorialReporte
+
+        grupo_id = getattr(reporte, '_grupo_anterior', reporte.grupoDuplicado_id)
+        if grupo_id:
+            Reporte.objects.filter(id=reporte.id).update(duplicado=False, grupoDuplicado=None)
+            reporte.duplicado = False
+            reporte.grupoDuplicado = None
 
             HistorialReporte.objects.create(
                 reporte=reporte,
                 usuario=None,
-                accion='Marcado como duplicado',
-                detalles=f'Agrupado con {grupo.reportes.count()} reportes similares en {cls.RADIO_BUSQUEDA_KM * 1000}m'
+                accion='Retirado de grupo de duplicados',
+                detalles=f'Cambió su ubicación o tipo; retirado del Grupo #{grupo_id}'
+            )
+            cls.revisar_grupo(grupo_id, config)
+
+        cls.encolar_o_detectar(reporte, config, indexar=True)
+
+    @classmethod
+    @transaction.atomic
+    def revisar_grupo(cls, grupo_id, config=None):
+        """
+        Revisa un grupo que perdió miembros. Los miembros siguen unidos si
+        están cerca, comparten una foto parecida o, sin coordenadas, tienen
+        texto parecido, como al detectarlos. La parte conectada más antigua
+        conserva el grupo, las demás partes con dos o más reportes pasan a
+        grupos nuevos y los reportes que quedan solos se desmarcan. Si no
+        queda ninguna parte con dos reportes, el grupo se disuelve.
+        """
+        import numpy as np
+        from apps.reportes.models import Reporte, GrupoDuplicado, HistorialReporte, Evidencia
+        from .agrupamiento import pares_cercanos
+        from .imagenes import ArbolBK
+        from .texto import firma_desde_bytes, similitud
+
+        config = config or obtener_configuracion()
+
+        grupo = GrupoDuplicado.objects.filter(id=grupo_id).first()
+        if grupo is None:
+            return
+
+        miembros = list(
+            Reporte.objects.filter(grupoDuplicado_id=grupo_id)
+            .order_by('reportado_en', 'id')
+            .values_list('id', 'latitud', 'longitud', 'reportado_en', 'tipo', 'firma_texto')
+        )
+        datos = {m[0]: m for m in miembros}
+
+        def en_ventana(a, b):
+            ventana = max(config.ventana_para(datos[a][4]), config.ventana_para(datos[b][4]))
+            return abs(datos[a][3] - datos[b][3]) <= timedelta(days=ventana)
+
+        union = ConjuntoDisjunto()
+        for m in miembros:
+            union.agregar(m[0])
+
+        # Cercanía
+        con_coordenadas = [m for m in miembros if m[1] is not None and m[2] is not None]
+        if con_coordenadas:
+            i, j = pares_cercanos(
+                [float(m[1]) for m in con_coordenadas],
+                [float(m[2]) for m in con_coordenadas],
+                np.zeros(len(con_coordenadas), dtype=np.int64),
+                [m[3].timestamp() for m in con_coordenadas],
+                [config.radio_para(m[4]) for m in con_coordenadas],
+                [config.ventana_para(m[4]) * 24 * 3600 for m in con_coordenadas]
             )
+            for a, b in zip(i.tolist(), j.tolist()):
+                union.unir(con_coordenadas[a][0], con_coordenadas[b][0])
 
-            return True, grupo
+        # Fotos parecidas, con los hashes calculados al detectar
+        arbol = ArbolBK()
+        for reporte_id, valor in Evidencia.objects.filter(
+            reporte__grupoDuplicado_id=grupo_id,
+            tipo_evidencia='foto',
+            es_evidencia_reparacion=False,
+            hash_perceptual__isnull=False
+        ).values_list('reporte_id', 'hash_perceptual'):
+            for otro_id, _ in arbol.buscar(valor, config.distancia_imagen):
+                if otro_id != reporte_id and en_ventana(otro_id, reporte_id):
+                    union.unir(otro_id, reporte_id)
+            arbol.agregar(valor, reporte_id)
 
+        # Texto parecido de los reportes sin coordenadas
+        firmas = {m[0]: firma_desde_bytes(m[5]) for m in miembros if m[5]}
+        for reporte_id, firma in firmas.items():
+            if datos[reporte_id][1] is not None and datos[reporte_id][2] is not None:
+                continue
+            for otro_id, otra_firma in firmas.items():
+                if (
+                    otro_id != reporte_id
+                    and datos[otro_id][4] == datos[reporte_id][4]
+                    and union.buscar(otro_id) != union.buscar(reporte_id)
+                    and en_ventana(otro_id, reporte_id)
+                    and similitud(firma, otra_firma) >= config.similitud_texto
+                ):
+                    union.unir(otro_id, reporte_id)
+
+        # Partes en orden de su reporte más antiguo
+        partes = {}
+        for m in miembros:
+            partes.setdefault(union.buscar(m[0]), []).append(m[0])
+
+        ahora = timezone.now()
+        conserva_grupo = True
+        grupos_resultantes = [grupo_id]
+        actualizados = []
+        historial = []
+        for parte in partes.values():
+            if len(parte) < 2:
+                for reporte_id in parte:
+                    actualizados.append(Reporte(id=reporte_id, duplicado=False, grupoDuplicado_id=None, actualizado_en=ahora))
+                    historial.append(HistorialReporte(
+                        reporte_id=reporte_id,
+                        usuario=None,
+                        accion='Desmarcado como duplicado',
+                        detalles=f'Ya no tiene reportes similares en el Grupo #{grupo_id}'
+                    ))
+            elif conserva_grupo:
+                conserva_grupo = False
+            else:
+                nuevo = GrupoDuplicado.objects.create(razon=grupo.razon)
+                grupos_resultantes.append(nuevo.id)
+                for reporte_id in parte:
+                    actualizados.append(Reporte(id=reporte_id, duplicado=True, grupoDuplicado_id=nuevo.id, actualizado_en=ahora))
+                    historial.append(HistorialReporte(
+                        reporte_id=reporte_id,
+                        usuario=None,
+                        accion='Grupo de duplicados dividido',
+                        detalles=f'Separado del Grupo #{grupo_id} al Grupo #{nuevo.id}'
+                    ))
+
+        Reporte.objects.bulk_update(
+            actualizados,
+            ['duplicado', 'grupoDuplicado', 'actualizado_en'],
+            batch_size=1000
+        )
+        HistorialReporte.objects.bulk_create(historial, batch_size=1000)
+
+        if conserva_grupo:
+            grupo.delete()
+        cls.actualizar_estadisticas(grupos_resultantes)
+
+    @classmethod
+    def encolar_o_detectar(cls, reporte, config=None, asincrona=None, indexar=False):
+        """
+        Encola el reporte o lo procesa en el acto según asincrona o, si es
+        None, según DETECCION_DUPLICADOS_ASINCRONA. La cola se procesa con
+        la configuración que reciba procesar_pendientes.
+        Con indexar, la firma de texto se calcula antes de detectar en el
+        acto; los reportes encolados los indexa procesar_pendientes.
+        """
+        from .texto import indexar_textos
+
+        if asincrona is None:
+            asincrona = getattr(settings, 'DETECCION_DUPLICADOS_ASINCRONA', True)
+        if asincrona:
+            cls.encolar(reporte)
         else:
-            # Crear grupo nuevo
-            grupo = GrupoDuplicado.objects.create(
-                razon=f'Reportes de tipo "{reporte.get_tipo_display()}" en un radio de {cls.RADIO_BUSQUEDA_KM * 1000}m'
+            if indexar:
+                indexar_textos([reporte])
+            cls.detectar_y_marcar_duplicado(reporte, config)
+
+    @classmethod
+    def encolar(cls, reporte):
+        """ Deja el reporte en la cola de detección por lotes """
+        from apps.reportes.models import DeteccionPendiente
+
+        DeteccionPendiente.objects.get_or_create(reporte=reporte)
+
+    @classmethod
+    def procesar_pendientes(cls, limite=200, config=None):
+        """
+        Procesa un lote de la cola de detección. Los reportes del lote y sus
+        vecinos se agrupan en una sola pasada, de modo que una ráfaga de
+        reportes sobre el mismo evento se resuelve junta. Después se
+        comparan sus fotos con el índice de imágenes y, si no tienen
+        coordenadas, su texto con el índice LSH; el texto de los reportes
+        del lote se indexa aquí y no al crearlos.
+        Devuelve (reportes procesados, duplicados marcados).
+        """
+        from apps.reportes.models import Reporte, DeteccionPendiente
+        from .texto import indexar_textos
+
+        config = config or obtener_configuracion()
+
+        with transaction.atomic():
+            pendientes = list(
+                DeteccionPendiente.objects.select_for_update(skip_locked=True)
+                .order_by('encolado_en')
+                .values_list('id', 'reporte_id')[:limite]
+            )
+            if not pendientes:
+                return 0, 0
+            ids_pendientes = [reporte_id for _, reporte_id in pendientes]
+
+            indexar_textos(
+                Reporte.objects.filter(id__in=ids_pendientes, firma_texto__isnull=True)
+                .only('id', 'titulo', 'descripcion', 'direccion')
             )
 
-            reportes_para_agrupar = list(reportes_cercanos) + [reporte]
+            reportes = Reporte.objects.filter(
+                id__in=ids_pendientes,
+                latitud__isnull=False,
+                longitud__isnull=False
+            ).order_by('celda').values_list('latitud', 'longitud', 'tipo', 'reportado_en')
 
-            for rep in reportes_para_agrupar:
-                rep.duplicado = True
-                rep.grupoDuplicado = grupo
-                rep.save()
+            celdas = set()
+            tipos = set()
+            fechas = []
+            for lat, lon, tipo, fecha in reportes:
+                celdas.update(celdas_vecinas(lat, lon, config.radio_para(tipo)))
+                tipos.add(tipo)
+                fechas.append(fecha)
 
-                HistorialReporte.objects.create(
-                    reporte=rep,
-                    usuario=None,
-                    accion='Marcado como duplicado',
-                    detalles=f'Agrupado con otros {len(reportes_para_agrupar)-1} reportes similares'
+            marcados = 0
+            if celdas:
+                cls._bloquear_celdas(celdas)
+                ventana = timedelta(days=config.ventana_maxima)
+                vecindario = Reporte.objects.filter(
+                    celda__in=sorted(celdas),
+                    tipo__in=tipos,
+                    reportado_en__gte=min(fechas) - ventana,
+                    reportado_en__lte=max(fechas) + ventana
                 )
+                marcados, _ = cls.detectar_en_lote(vecindario, config=config)
+
+            # Las fotos repetidas y el texto agrupan también reportes sin coordenadas
+            marcados += cls._detectar_por_imagen(ids_pendientes, config)
+            marcados += cls._detectar_por_texto(ids_pendientes, config)
+
+            DeteccionPendiente.objects.filter(id__in=[id_ for id_, _ in pendientes]).delete()
 
-            return True, grupo
+        return len(pendientes), marcados
+
+    @classmethod
+    def actualizar_estadisticas(cls, grupo_ids):
+        """
+        Recalcula las estadísticas guardadas en los grupos indicados con
+        unas pocas consultas agregadas por cada bloque de grupos.
+        """
+        from django.db.models import Count, Min, Max, OuterRef, Subquery
+        from apps.reportes.models import Reporte, GrupoDuplicado, Evidencia
+
+        for bloque in _en_bloques(list(set(grupo_ids))):
+            principales = Reporte.objects.filter(
+                grupoDuplicado=OuterRef('pk')
+            ).order_by('reportado_en', 'id').values('id')[:1]
+            grupos = list(
+                GrupoDuplicado.objects.filter(id__in=bloque).annotate(principal_id=Subquery(principales))
+            )
+
+            resumen = {
+                fila['grupoDuplicado']: fila
+                for fila in Reporte.objects.filter(grupoDuplicado_id__in=bloque)
+                .order_by()
+                .values('grupoDuplicado')
+                .annotate(
+                    total=Count('id'),
+                    usuarios=Count('usuario', distinct=True),
+                    primero=Min('reportado_en'),
+                    ultimo=Max('reportado_en'),
+                )
+            }
+            evidencias = dict(
+                Evidencia.objects.filter(reporte__grupoDuplicado_id__in=bloque)
+                .order_by()
+                .values('reporte__grupoDuplicado')
+                .annotate(total=Count('id'))
+                .values_list('reporte__grupoDuplicado', 'total')
+            )
+
+            for grupo in grupos:
+                datos = resumen.get(grupo.id, {})
+                grupo.reporte_principal_id = grupo.principal_id
+                grupo.total_reportes = datos.get('total', 0)
+                grupo.total_usuarios = datos.get('usuarios', 0)
+                grupo.fecha_primer_reporte = datos.get('primero')
+                grupo.fecha_ultimo_reporte = datos.get('ultimo')
+                grupo.total_evidencias = evidencias.get(grupo.id, 0)
+
+            GrupoDuplicado.objects.bulk_update(grupos, [
+                'reporte_principal', 'total_reportes', 'total_usuarios',
+                'total_evidencias', 'fecha_primer_reporte', 'fecha_ultimo_reporte',
+            ])
 
     @classmethod
     def obtener_reporte_principal(cls, grupo):
-        return grupo.reportes.order_by('reportado_en').first()
+        return grupo.reporte_principal
 
     @classmethod
     def obtener_estadisticas_grupo(cls, grupo):
-        reportes = grupo.reportes.all()
-        principal = cls.obtener_reporte_principal(grupo)
-
         return {
-            'total_reportes': reportes.count(),
-            'reporte_principal': principal,
-            'fecha_primer_reporte': principal.reportado_en if principal else None,
-            'fecha_ultimo_reporte': reportes.order_by('-reportado_en').first().reportado_en,
-            'usuarios_reportaron': reportes.values('usuario').distinct().count(),
-            'tiene_evidencias': reportes.filter(evidencias__isnull=False).exists(),
-            'total_evidencias': sum(r.evidencias.count() for r in reportes),
+            'total_reportes': grupo.total_reportes,
+            'reporte_principal': grupo.reporte_principal,
+            'fecha_primer_reporte': grupo.fecha_primer_reporte,
+            'fecha_ultimo_reporte': grupo.fecha_ultimo_reporte,
+            'usuarios_reportaron': grupo.total_usuarios,
+            'tiene_evidencias': grupo.total_evidencias > 0,
+            'total_evidencias': grupo.total_evidencias,
         }
 
 
@@ -166,13 +1015,80 @@ class DetectorDuplicados:
 # SIGNALS PARA DETECCIÓN AUTOMÁTICA
 # ============================================
 
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.dispatch import receiver
-from apps.reportes.models import Reporte
+from apps.reportes.models import Reporte, Evidencia, GrupoDuplicado
 
 
 @receiver(post_save, sender=Reporte)
 def detectar_duplicados_automaticamente(sender, instance, created, **kwargs):
-    """ Detecta duplicados al crear un reporte """
-    if created and instance.latitud and instance.longitud:
-        DetectorDuplicados.detectar_y_marcar_duplicado(instance)
+    """
+    Encola la detección de duplicados del reporte nuevo, que también indexa
+    su texto. Con DETECCION_DUPLICADOS_ASINCRONA = False se indexa y se
+    detecta en la misma petición. Quien crea el reporte puede fijar en la
+    instancia _configuracion_deteccion y _deteccion_asincrona para esa
+    detección, como hace simular_reportes.
+    """
+    if created and not kwargs.get('raw'):
+        DetectorDuplicados.encolar_o_detectar(
+            instance,
+            getattr(instance, '_configuracion_deteccion', None),
+            asincrona=getattr(instance, '_deteccion_asincrona', None),
+            indexar=True
+        )
+
+
+@receiver(post_save, sender=Reporte)
+def reagrupar_reporte_modificado(sender, instance, created, raw=False, **kwargs):
+    """ Reagrupa el reporte si cambiaron sus coordenadas o su tipo """
+    if not created and not raw and getattr(instance, '_campos_modificados', None):
+        DetectorDuplicados.reagrupar(instance)
+
+
+@receiver(pre_delete, sender=Reporte)
+def leer_grupo_reporte_eliminado(sender, instance, **kwargs):
+    """
+    Lee de la base el grupo del reporte que se va a eliminar: la instancia
+    puede haberse cargado antes de que el reporte se agrupara o cambiara de grupo
+    """
+    instance._grupo_eliminado = (
+        Reporte.objects.filter(id=instance.pk).values_list('grupoDuplicado_id', flat=True).first()
+    )
+
+
+@receiver(post_delete, sender=Reporte)
+def revisar_grupo_reporte_eliminado(sender, instance, **kwargs):
+    """ Revisa el grupo del que formaba parte un reporte eliminado """
+    grupo_id = getattr(instance, '_grupo_eliminado', instance.grupoDuplicado_id)
+    if grupo_id:
+        DetectorDuplicados.revisar_grupo(grupo_id)
+
+
+def _sumar_evidencias_grupo(evidencia, cantidad):
+    grupo_id = Reporte.objects.filter(id=evidencia.reporte_id).values_list('grupoDuplicado_id', flat=True).first()
+    if grupo_id:
+        GrupoDuplicado.objects.filter(
+            id=grupo_id,
+            total_evidencias__gte=-cantidad
+        ).update(total_evidencias=F('total_evidencias') + cantidad)
+
+
+@receiver(post_save, sender=Evidencia)
+def detectar_duplicados_por_foto(sender, instance, created, raw=False, **kwargs):
+    """ Encola el reporte para compararlo por imagen cuando recibe una foto de ciudadano """
+    if created and not raw and instance.tipo_evidencia == 'foto' and not instance.es_evidencia_reparacion:
+        DetectorDuplicados.encolar_o_detectar(instance.reporte)
+
+
+@receiver(post_save, sender=Evidencia)
+def contar_evidencia_nueva(sender, instance, created, raw=False, **kwargs):
+    """ Suma la evidencia nueva al total de su grupo de duplicados """
+    if created and not raw:
+        _sumar_evidencias_grupo(instance, 1)
+
+
+@receiver(post_delete, sender=Evidencia)
+def descontar_evidencia_eliminada(sender, instance, **kwargs):
+    """ Resta la evidencia eliminada del total de su grupo de duplicados """
+    _sumar_evidencias_grupo(instance, -1)
@@ -0,0 +1,171 @@
+"""
+Utilidades espaciales para reportes
+Malla fija de celdas usada para indexar reportes por proximidad
+"""
+
+from math import cos, radians, floor, ceil
+
+
+# Tamaño de la celda en grados (0.0005° ≈ 55 m en latitud)
+TAMANO_CELDA_GRADOS = 0.0005
+
+# Desplazamiento para que los índices de celda siempre sean positivos
+_DESPLAZAMIENTO = 1_000_000
+_MULTIPLICADOR = 10_000_000
+
+KM_POR_GRADO = 111.0
+
+
+def indices_celda(latitud, longitud):
+    """ Devuelve los índices (fila, columna) de la celda de un punto """
+    fila = floor(float(latitud) / TAMANO_CELDA_GRADOS)
+    columna = floor(float(longitud) / TAMANO_CELDA_GRADOS)
+    return fila, columna
+
+
+def clave_celda(fila, columna):
+    """ Codifica los índices de una celda en un solo entero """
+    return (fila + _DESPLAZAMIENTO) * _MULTIPLICADOR + (columna + _DESPLAZAMIENTO)
+
+
+def calcular_celda(latitud, longitud):
+    """ Clave de celda de un punto, o None si no tiene coordenadas """
+    if latitud is None or longitud is None:
+        return None
+    return clave_celda(*indices_celda(latitud, longitud))
+
+
+def celdas_vecinas(latitud, longitud, radio_km):
+    """
+    Claves de todas las celdas que pueden contener puntos a menos de
+    radio_km del punto dado. Con el radio por defecto (50 m) son las
+    9 celdas alrededor de la celda del punto.
+    """
+    fila, columna = indices_celda(latitud, longitud)
+
+    tamano_lat_km = TAMANO_CELDA_GRADOS * KM_POR_GRADO
+    tamano_lon_km = tamano_lat_km * cos(radians(float(latitud)))
+
+    anillo_filas = max(1, ceil(radio_km / tamano_lat_km))
+    anillo_columnas = max(1, ceil(radio_km / tamano_lon_km))
+
+    return [
+        clave_celda(fila + df, columna + dc)
+        for df in range(-anillo_filas, anillo_filas + 1)
+        for dc in range(-anillo_columnas, anillo_columnas + 1)
+    ]
+
+
+# ============================================
+# ÍNDICE R*TREE (SQLite)
+# ============================================
+
+# Tabla virtual creada por la migración 0010 y mantenida por triggers
+TABLA_RTREE = 'reportes_reporte_rtree'
+
+
+def rtree_disponible(using='default'):
+    """
+    True si la base es SQLite y ya tiene la tabla R*Tree. El resultado
+    se recuerda por conexión y archivo de base de datos.
+    """
+    from django.db import connections
+
+    conexion = connections[using]
+    if conexion.vendor != 'sqlite':
+        return False
+
+    clave = str(conexion.settings_dict['NAME'])
+    disponibles = conexion.__dict__.setdefault('_rtree_disponible', {})
+    if not disponibles.get(clave):
+        with conexion.cursor() as cursor:
+            disponibles[clave] = TABLA_RTREE in conexion.introspection.table_names(cursor)
+    return disponibles[clave]
+
+
+def leer_bbox(valor):
+    """
+    Convierte 'oeste,sur,este,norte' (el formato de Leaflet toBBoxString)
+    en cuatro floats, o devuelve None si el texto no es un recuadro válido.
+    """
+    try:
+        oeste, sur, este, norte = (float(parte) for parte in valor.split(','))
+    except ValueError:
+        return None
+    if not (-180 <= oeste <= este <= 180 and -90 <= sur <= norte <= 90):
+        return None
+    return oeste, sur, este, norte
+
+
+def leer_coordenadas(latitud, longitud):
+    """
+    Convierte latitud y longitud (texto o números) en dos floats, o devuelve
+    None si no son un punto válido: vacías, NaN, infinitas o fuera de rango.
+    """
+    try:
+        latitud, longitud = float(latitud), float(longitud)
+    except (TypeError, ValueError):
+        return None
+    # Las comparaciones con NaN son falsas, así que también lo descartan
+    if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+        return None
+    return latitud, longitud
+
+
+def recuadro_radio(latitud, longitud, radio_km):
+    """ Recuadro (sur, oeste, norte, este) que contiene el círculo de radio_km """
+    latitud, longitud = float(latitud), float(longitud)
+    delta_lat = radio_km / KM_POR_GRADO
+    delta_lon = radio_km / (KM_POR_GRADO * cos(radians(latitud)))
+    return latitud - delta_lat, longitud - delta_lon, latitud + delta_lat, longitud + delta_lon
+
+
+def filtro_recuadro(sur, oeste, norte, este, using='default'):
+    """
+    Q de los reportes dentro del recuadro. Con SQLite la búsqueda pasa por
+    el R*Tree; el rango exacto sobre las columnas se conserva porque el
+    R*Tree guarda flotantes de 32 bits (redondeados hacia afuera). En otros
+    motores queda solo el rango, que usa el índice (latitud, longitud).
+    """
+    from django.db.models import Q
+    from django.db.models.expressions import RawSQL
+
+    rango = Q(latitud__gte=sur, latitud__lte=norte, longitud__gte=oeste, longitud__lte=este)
+    if not rtree_disponible(using):
+        return rango
+
+    return Q(id__in=RawSQL(
+        f'SELECT id FROM {TABLA_RTREE} '
+        'WHERE max_lat >= %s AND min_lat <= %s AND max_lon >= %s AND min_lon <= %s',
+        (float(sur), float(norte), float(oeste), float(este))
+    )) & rango
+
+
+def ids_en_recuadro(sur, oeste, norte, este, using='default'):
+    """ Ids de los reportes dentro del recuadro (sur, oeste, norte, este) """
+    from apps.reportes.models import Reporte
+
+    return list(
+        Reporte.objects.using(using)
+        .filter(filtro_recuadro(sur, oeste, norte, este, using))
+        .order_by()
+        .values_list('id', flat=True)
+    )
+
+
+def ids_en_radio(latitud, longitud, radio_km, using='default'):
+    """ Ids de los reportes a menos de radio_km del punto (distancia haversine) """
+    from apps.reportes.models import Reporte
+    from apps.reportes.duplicate_detector import DetectorDuplicados
+
+    candidatos = (
+        Reporte.objects.using(using)
+        .filter(filtro_recuadro(*recuadro_radio(latitud, longitud, radio_km), using))
+        .order_by()
+        .values_list('id', 'latitud', 'longitud')
+    )
+    return [
+        reporte_id
+        for reporte_id, lat, lon in candidatos
+        if DetectorDuplicados.calcular_distancia_haversine(latitud, longitud, lat, lon) <= radio_km
+    ]
@@ -55,6 +55,18 @@ class ReporteForm(forms.ModelForm):
             'direccion': 'Dirección',
         }
 
+    def clean(self):
+        datos = super().clean()
+        # Sin dirección escrita, se propone la del punto GPS. Solo con el
+        # gazetteer local: el formulario no espera a ningún servicio externo
+        if not datos.get('direccion') and datos.get('latitud') is not None and datos.get('longitud') is not None:
+            from .gazetteer import obtener_gazetteer
+
+            gazetteer = obtener_gazetteer()
+            if gazetteer is not None:
+                datos['direccion'] = gazetteer.direccion(float(datos['latitud']), float(datos['longitud'])) or ''
+        return datos
+
 
 class EvidenciaForm(forms.ModelForm):
     """Formulario para subir evidencias (fotos/videos)"""
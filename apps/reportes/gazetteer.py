@@ -0,0 +1,435 @@
+"""
+Geocodificador inverso local
+Calles, barrios y lugares de un extracto de OpenStreetMap guardados en un
+.npz compacto (metros sobre un plano local) con una malla uniforme como
+índice de los tramos de calle. Responde sin red en decenas de microsegundos.
+"""
+
+import logging
+import os
+import threading
+from math import cos, radians
+
+import numpy as np
+from django.conf import settings
+
+from .espacial import KM_POR_GRADO
+from .geocodificacion import ErrorGeocodificacion, obtener_ajustes, obtener_respaldo
+
+
+logger = logging.getLogger(__name__)
+
+# Lado de las celdas del índice de tramos, en metros
+TAMANO_CELDA_INDICE = 250
+
+# Más lejos que esto de cualquier calle no se propone dirección
+DISTANCIA_MAXIMA_CALLE = 300
+
+# Una segunda calle a menos de esto se nombra como cruce ("Calle 72 con Carrera 46")
+DISTANCIA_CRUCE = 25
+
+# Un lugar con nombre a menos de esto se menciona como referencia
+DISTANCIA_LUGAR = 40
+
+# Etiquetas de OSM que marcan un polígono como barrio
+LUGARES_BARRIO = ('neighbourhood', 'suburb', 'quarter')
+
+
+def _propiedades(feature):
+    """ Etiquetas del elemento; osmtogeojson las anida en properties.tags """
+    propiedades = feature.get('properties') or {}
+    return {**(propiedades.get('tags') or {}), **propiedades}
+
+
+def _nombre(propiedades):
+    return (propiedades.get('name') or propiedades.get('nombre') or propiedades.get('barrio') or '').strip()
+
+
+def _es_barrio(propiedades):
+    return (
+        'barrio' in propiedades
+        or propiedades.get('place') in LUGARES_BARRIO
+        or (propiedades.get('boundary') == 'administrative' and str(propiedades.get('admin_level')) in ('9', '10'))
+    )
+
+
+def _partes(geometria, tipo_simple, tipo_multiple):
+    if geometria['type'] == tipo_simple:
+        return [geometria['coordinates']]
+    if geometria['type'] == tipo_multiple:
+        return geometria['coordinates']
+    return []
+
+
+class Gazetteer:
+    """
+    Arreglos del gazetteer y sus consultas. Las coordenadas se guardan en
+    metros (x al oriente, y al norte) respecto a origen, en float32.
+    """
+
+    def __init__(self, datos):
+        self.origen = datos['origen']
+        self.nombres = datos['nombres']
+        self.tramos_a = datos['tramos_a']
+        self.tramos_b = datos['tramos_b']
+        self.tramos_nombre = datos['tramos_nombre']
+        self.indice_caja = datos['indice_caja']
+        self.indice_inicio = datos['indice_inicio']
+        self.indice_tramos = datos['indice_tramos']
+        self.vertices = datos['vertices']
+        self.anillos_inicio = datos['anillos_inicio']
+        self.anillos_barrio = datos['anillos_barrio']
+        self.barrios_nombre = datos['barrios_nombre']
+        self.barrios_caja = datos['barrios_caja']
+        self.lugares = datos['lugares']
+        self.lugares_nombre = datos['lugares_nombre']
+
+        self._metros_lat = KM_POR_GRADO * 1000
+        self._metros_lon = KM_POR_GRADO * 1000 * cos(radians(float(self.origen[0])))
+        # Columnas y filas de la malla del índice
+        self._columnas = int(np.ceil((self.indice_caja[2] - self.indice_caja[0]) / TAMANO_CELDA_INDICE)) or 1
+        self._filas = int(np.ceil((self.indice_caja[3] - self.indice_caja[1]) / TAMANO_CELDA_INDICE)) or 1
+
+    # ============================================
+    # CONSTRUCCIÓN
+    # ============================================
+
+    @classmethod
+    def desde_geojson(cls, coleccion):
+        """ Construye el gazetteer desde una FeatureCollection de OSM """
+        nombres = {}
+        tramos, tramos_nombre = [], []
+        anillos, anillos_barrio, barrios_nombre = [], [], []
+        lugares, lugares_nombre = [], []
+
+        def codigo(nombre):
+            return nombres.setdefault(nombre, len(nombres))
+
+        for feature in coleccion.get('features', []):
+            geometria = feature.get('geometry')
+            propiedades = _propiedades(feature)
+            nombre = _nombre(propiedades)
+            if not geometria or not nombre:
+                continue
+
+            poligonos = _partes(geometria, 'Polygon', 'MultiPolygon')
+            if 'highway' in propiedades:
+                for linea in _partes(geometria, 'LineString', 'MultiLineString'):
+                    for (lon_a, lat_a), (lon_b, lat_b) in zip(linea[:-1], linea[1:]):
+                        tramos.append((lat_a, lon_a, lat_b, lon_b))
+                        tramos_nombre.append(codigo(nombre))
+            elif poligonos and _es_barrio(propiedades):
+                barrio = len(barrios_nombre)
+                barrios_nombre.append(codigo(nombre))
+                for poligono in poligonos:
+                    for anillo in poligono:
+                        anillos.append([(lat, lon) for lon, lat, *_ in anillo])
+                        anillos_barrio.append(barrio)
+            elif geometria['type'] == 'Point':
+                lon, lat = geometria['coordinates'][:2]
+                lugares.append((lat, lon))
+                lugares_nombre.append(codigo(nombre))
+            elif poligonos:
+                # Un edificio o parque con nombre cuenta como lugar en su centro
+                exterior = np.array(poligonos[0][0], dtype=np.float64)
+                lugares.append((exterior[:, 1].mean(), exterior[:, 0].mean()))
+                lugares_nombre.append(codigo(nombre))
+
+        if not tramos:
+            raise ValueError('El archivo no trae calles (LineString con highway y name)')
+
+        tramos = np.array(tramos, dtype=np.float64)
+        origen = np.array([
+            (tramos[:, 0].min() + tramos[:, 0].max()) / 2,
+            (tramos[:, 1].min() + tramos[:, 1].max()) / 2,
+        ])
+        proyectar = cls._proyector(origen)
+
+        tramos_a = proyectar(tramos[:, 0], tramos[:, 1])
+        tramos_b = proyectar(tramos[:, 2], tramos[:, 3])
+
+        vertices = np.zeros((0, 2), dtype=np.float32)
+        anillos_inicio = np.zeros(1, dtype=np.int32)
+        barrios_caja = np.zeros((0, 4), dtype=np.float32)
+        if anillos:
+            todos = np.array([punto for anillo in anillos for punto in anillo], dtype=np.float64)
+            vertices = proyectar(todos[:, 0], todos[:, 1])
+            anillos_inicio = np.concatenate([[0], np.cumsum([len(anillo) for anillo in anillos])]).astype(np.int32)
+            cajas_anillo = np.array([
+                np.concatenate([
+                    vertices[anillos_inicio[i]:anillos_inicio[i + 1]].min(axis=0),
+                    vertices[anillos_inicio[i]:anillos_inicio[i + 1]].max(axis=0),
+                ])
+                for i in range(len(anillos))
+            ])
+            # Caja por barrio: la unión de las de sus anillos
+            de_barrio = np.array(anillos_barrio)
+            barrios_caja = np.array([
+                np.concatenate([
+                    cajas_anillo[de_barrio == barrio, :2].min(axis=0),
+                    cajas_anillo[de_barrio == barrio, 2:].max(axis=0),
+                ])
+                for barrio in range(len(barrios_nombre))
+            ], dtype=np.float32)
+
+        lugares = np.array(lugares, dtype=np.float64).reshape(-1, 2)
+        lugares = proyectar(lugares[:, 0], lugares[:, 1])
+
+        datos = {
+            'origen': origen,
+            'nombres': np.array(sorted(nombres, key=nombres.get) or [''], dtype=str),
+            'tramos_a': tramos_a,
+            'tramos_b': tramos_b,
+            'tramos_nombre': np.array(tramos_nombre, dtype=np.int32),
+            'vertices': vertices,
+            'anillos_inicio': anillos_inicio,
+            'anillos_barrio': np.array(anillos_barrio, dtype=np.int32),
+            'barrios_nombre': np.array(barrios_nombre, dtype=np.int32),
+            'barrios_caja': barrios_caja,
+            'lugares': lugares,
+            'lugares_nombre': np.array(lugares_nombre, dtype=np.int32),
+        }
+        datos.update(cls._indexar_tramos(tramos_a, tramos_b))
+        return cls(datos)
+
+    @staticmethod
+    def _proyector(origen):
+        metros_lat = KM_POR_GRADO * 1000
+        metros_lon = KM_POR_GRADO * 1000 * cos(radians(float(origen[0])))
+
+        def proyectar(latitudes, longitudes):
+            return np.stack([
+                (np.asarray(longitudes) - origen[1]) * metros_lon,
+                (np.asarray(latitudes) - origen[0]) * metros_lat,
+            ], axis=1).astype(np.float32)
+
+        return proyectar
+
+    @staticmethod
+    def _indexar_tramos(tramos_a, tramos_b):
+        """
+        Malla uniforme en formato CSR: los tramos de la celda k son
+        indice_tramos[indice_inicio[k]:indice_inicio[k + 1]]. Cada tramo
+        se anota en todas las celdas que toca su caja.
+        """
+        minimos = np.minimum(tramos_a, tramos_b)
+        maximos = np.maximum(tramos_a, tramos_b)
+        caja = np.concatenate([minimos.min(axis=0), maximos.max(axis=0)]).astype(np.float32)
+        columnas = int(np.ceil((caja[2] - caja[0]) / TAMANO_CELDA_INDICE)) or 1
+        filas = int(np.ceil((caja[3] - caja[1]) / TAMANO_CELDA_INDICE)) or 1
+
+        desde = np.floor((minimos - caja[:2]) / TAMANO_CELDA_INDICE).astype(np.int64)
+        hasta = np.floor((maximos - caja[:2]) / TAMANO_CELDA_INDICE).astype(np.int64)
+        desde = np.minimum(desde, [columnas - 1, filas - 1])
+        hasta = np.minimum(hasta, [columnas - 1, filas - 1])
+
+        celdas, ids = [], []
+        for tramo, ((c0, f0), (c1, f1)) in enumerate(zip(desde.tolist(), hasta.tolist())):
+            for fila in range(f0, f1 + 1):
+                for columna in range(c0, c1 + 1):
+                    celdas.append(fila * columnas + columna)
+                    ids.append(tramo)
+        celdas = np.array(celdas, dtype=np.int64)
+        orden = np.argsort(celdas, kind='stable')
+        inicio = np.searchsorted(celdas[orden], np.arange(filas * columnas + 1))
+        return {
+            'indice_caja': caja,
+            'indice_inicio': inicio.astype(np.int32),
+            'indice_tramos': np.array(ids, dtype=np.int32)[orden],
+        }
+
+    def guardar(self, ruta):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        temporal = f'{ruta}.tmp.npz'
+        np.savez_compressed(temporal, **{
+            nombre: getattr(self, nombre) for nombre in (
+                'origen', 'nombres', 'tramos_a', 'tramos_b', 'tramos_nombre',
+                'indice_caja', 'indice_inicio', 'indice_tramos',
+                'vertices', 'anillos_inicio', 'anillos_barrio', 'barrios_nombre', 'barrios_caja',
+                'lugares', 'lugares_nombre',
+            )
+        })
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        with np.load(ruta, allow_pickle=False) as archivo:
+            return cls({nombre: archivo[nombre] for nombre in archivo.files})
+
+    # ============================================
+    # CONSULTA
+    # ============================================
+
+    def _a_metros(self, latitud, longitud):
+        return np.array([
+            (float(longitud) - self.origen[1]) * self._metros_lon,
+            (float(latitud) - self.origen[0]) * self._metros_lat,
+        ])
+
+    def _tramos_cercanos(self, punto, distancia):
+        """ Ids de los tramos anotados en las celdas a menos de distancia del punto """
+        c0, f0 = np.floor((punto - distancia - self.indice_caja[:2]) / TAMANO_CELDA_INDICE).astype(int)
+        c1, f1 = np.floor((punto + distancia - self.indice_caja[:2]) / TAMANO_CELDA_INDICE).astype(int)
+        c0, f0 = max(c0, 0), max(f0, 0)
+        c1, f1 = min(c1, self._columnas - 1), min(f1, self._filas - 1)
+        if c0 > c1 or f0 > f1:
+            return np.zeros(0, dtype=np.int32)
+        partes = [
+            self.indice_tramos[self.indice_inicio[fila * self._columnas + c0]:self.indice_inicio[fila * self._columnas + c1 + 1]]
+            for fila in range(f0, f1 + 1)
+        ]
+        return np.unique(np.concatenate(partes))
+
+    def calles_cercanas(self, latitud, longitud):
+        """
+        (calle, distancia en m, cruce o None) de la calle más cercana, o None
+        si no hay ninguna a menos de DISTANCIA_MAXIMA_CALLE.
+        """
+        punto = self._a_metros(latitud, longitud)
+        ids = self._tramos_cercanos(punto, DISTANCIA_MAXIMA_CALLE)
+        if not len(ids):
+            return None
+
+        # Distancia del punto a cada tramo (proyección acotada al segmento)
+        a = self.tramos_a[ids].astype(np.float64)
+        direccion = self.tramos_b[ids] - a
+        largo = np.einsum('ij,ij->i', direccion, direccion)
+        t = np.clip(np.einsum('ij,ij->i', punto - a, direccion) / np.where(largo > 0, largo, 1), 0, 1)
+        distancias = np.hypot(*(a + t[:, None] * direccion - punto).T)
+
+        mas_cercano = int(np.argmin(distancias))
+        if distancias[mas_cercano] > DISTANCIA_MAXIMA_CALLE:
+            return None
+        calle = self.tramos_nombre[ids[mas_cercano]]
+
+        otras = (self.tramos_nombre[ids] != calle) & (distancias <= DISTANCIA_CRUCE)
+        cruce = None
+        if otras.any():
+            cruce = str(self.nombres[self.tramos_nombre[ids[otras][np.argmin(distancias[otras])]]])
+        return str(self.nombres[calle]), float(distancias[mas_cercano]), cruce
+
+    def barrio_de(self, latitud, longitud):
+        """ Nombre del barrio que contiene el punto (regla par-impar, así los huecos cuentan) """
+        if not len(self.barrios_nombre):
+            return None
+        x, y = self._a_metros(latitud, longitud)
+        caja = self.barrios_caja
+        for barrio in np.flatnonzero((caja[:, 0] <= x) & (x <= caja[:, 2]) & (caja[:, 1] <= y) & (y <= caja[:, 3])):
+            cruces = 0
+            for anillo in np.flatnonzero(self.anillos_barrio == barrio):
+                puntos = self.vertices[self.anillos_inicio[anillo]:self.anillos_inicio[anillo + 1]].astype(np.float64)
+                x1, y1 = puntos[:, 0], puntos[:, 1]
+                x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+                cortan = (y1 > y) != (y2 > y)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    x_corte = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+                cruces += int(np.count_nonzero(cortan & (x < x_corte)))
+            if cruces % 2:
+                return str(self.nombres[self.barrios_nombre[barrio]])
+        return None
+
+    def lugar_cercano(self, latitud, longitud):
+        if not len(self.lugares):
+            return None
+        distancias = np.hypot(*(self.lugares - self._a_metros(latitud, longitud)).T)
+        cercano = int(np.argmin(distancias))
+        if distancias[cercano] > DISTANCIA_LUGAR:
+            return None
+        return str(self.nombres[self.lugares_nombre[cercano]])
+
+    def direccion(self, latitud, longitud):
+        """ "Calle 72 con Carrera 46 (Parque Washington), El Prado", o None lejos de toda calle """
+        calles = self.calles_cercanas(latitud, longitud)
+        if calles is None:
+            return None
+        calle, _, cruce = calles
+        texto = f'{calle} con {cruce}' if cruce else calle
+
+        lugar = self.lugar_cercano(latitud, longitud)
+        if lugar and lugar not in (calle, cruce):
+            texto += f' ({lugar})'
+        barrio = self.barrio_de(latitud, longitud)
+        if barrio:
+            texto += f', {barrio}'
+        return texto
+
+
+# ============================================
+# PROVEEDOR
+# ============================================
+
+def ruta_gazetteer():
+    return obtener_ajustes().get('GAZETTEER') or os.path.join(settings.BASE_DIR, 'datos', 'gazetteer.npz')
+
+
+_cargado = {}
+_candado_carga = threading.Lock()
+
+
+def obtener_gazetteer():
+    """
+    Gazetteer del archivo configurado, cargado una vez por proceso y
+    recargado si importar_gazetteer lo reemplaza. None si no existe.
+    """
+    ruta = ruta_gazetteer()
+    try:
+        modificado = os.stat(ruta).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    clave = (str(ruta), modificado)
+    if _cargado.get('clave') != clave:
+        with _candado_carga:
+            if _cargado.get('clave') != clave:
+                _cargado['gazetteer'] = Gazetteer.cargar(ruta)
+                _cargado['clave'] = clave
+    return _cargado['gazetteer']
+
+
+class ProveedorGazetteer:
+    """
+    Proveedor de geocodificacion.py que responde desde el gazetteer local, sin
+    red. Mientras no exista el archivo responde GEOCODIFICACION['RESPALDO'];
+    con RESPALDO = None (por defecto) la consulta falla.
+    """
+
+    @property
+    def nombre(self):
+        """ El de quien responde, que es lo que se guarda con la dirección """
+        respaldo = obtener_respaldo()
+        if respaldo is not None and obtener_gazetteer() is None:
+            return getattr(respaldo, 'nombre', '')
+        return 'gazetteer'
+
+    def __call__(self, latitud, longitud):
+        gazetteer = obtener_gazetteer()
+        if gazetteer is not None:
+            return gazetteer.direccion(latitud, longitud)
+
+        respaldo = obtener_respaldo()
+        if respaldo is None:
+            raise ErrorGeocodificacion(f'No existe {ruta_gazetteer()}; ejecute importar_gazetteer')
+        if not _cargado.get('avisado'):
+            _cargado['avisado'] = True
+            logger.warning(
+                'No existe %s; las direcciones se piden a %s hasta ejecutar importar_gazetteer',
+                ruta_gazetteer(), getattr(respaldo, 'nombre', type(respaldo).__name__)
+            )
+        return respaldo(latitud, longitud)
+
+
+def revisar_gazetteer(app_configs, **kwargs):
+    """ Verificación del sistema: avisa si el proveedor es el gazetteer y falta su archivo """
+    from django.core.checks import Warning
+
+    if obtener_ajustes()['PROVEEDOR'] != f'{__name__}.ProveedorGazetteer' or os.path.exists(ruta_gazetteer()):
+        return []
+    respaldo = obtener_ajustes()['RESPALDO']
+    return [Warning(
+        f'No existe el gazetteer {ruta_gazetteer()}',
+        hint=(
+            f'Ejecute importar_gazetteer; mientras tanto las direcciones se piden a {respaldo}'
+            if respaldo else 'Ejecute importar_gazetteer; mientras tanto los reportes no tendrán dirección'
+        ),
+        id='reportes.W001',
+    )]
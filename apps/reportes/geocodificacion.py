@@ -0,0 +1,276 @@
+"""
+Geocodificación inversa (coordenadas → dirección) con caché
+La clave es una celda cuantizada de unos metros: primero una LRU en
+memoria, después la tabla DireccionGeocodificada y por último el proveedor
+configurado en settings.GEOCODIFICACION
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+from http.client import HTTPException
+from math import floor
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .espacial import KM_POR_GRADO, leer_coordenadas
+
+
+logger = logging.getLogger(__name__)
+
+AJUSTES_POR_DEFECTO = {
+    'PROVEEDOR': 'apps.reportes.gazetteer.ProveedorGazetteer',
+    'RESPALDO': None,
+    'GAZETTEER': None,
+    'MALLA_VIAL': None,
+    'TAMANO_CELDA_M': 15,
+    'DIAS_VIGENCIA': 180,
+    'SEGUNDOS_NEGATIVO': 3600,
+    'TAMANO_LRU': 4096,
+    'TIEMPO_ESPERA': 5,
+}
+
+
+class ErrorGeocodificacion(Exception):
+    """ El proveedor no respondió (red, tiempo de espera, límite de consultas) """
+
+
+@lru_cache(maxsize=None)
+def obtener_ajustes():
+    """ settings.GEOCODIFICACION completado con los valores por defecto """
+    return {**AJUSTES_POR_DEFECTO, **getattr(settings, 'GEOCODIFICACION', {})}
+
+
+# ============================================
+# PROVEEDORES
+# ============================================
+
+# Un proveedor es un invocable (latitud, longitud) -> dirección o None, con
+# un atributo nombre. Si falla debe lanzar ErrorGeocodificacion.
+
+class ProveedorNominatim:
+    """ Nominatim de OpenStreetMap; su política pide un User-Agent propio """
+
+    nombre = 'nominatim'
+    URL = 'https://nominatim.openstreetmap.org/reverse'
+
+    def __call__(self, latitud, longitud):
+        parametros = urlencode({'format': 'json', 'lat': f'{latitud:.6f}', 'lon': f'{longitud:.6f}'})
+        peticion = Request(f'{self.URL}?{parametros}', headers={'User-Agent': 'MonitoreoCallesBAQ/1.0'})
+        try:
+            with urlopen(peticion, timeout=obtener_ajustes()['TIEMPO_ESPERA']) as respuesta:
+                datos = json.load(respuesta)
+        except (OSError, HTTPException, ValueError) as error:
+            # OSError cubre URLError, tiempos de espera y conexiones cortadas;
+            # HTTPException, respuestas incompletas al leer el cuerpo
+            raise ErrorGeocodificacion(str(error)) from error
+        # Sin resultado Nominatim responde {"error": "Unable to geocode"}
+        return datos.get('display_name') or None
+
+
+class ProveedorAproximado:
+    """
+    Nomenclatura aproximada de Barranquilla calculada sin red
+    (sinteticos.direccion_aproximada). Para desarrollo y pruebas.
+    """
+
+    nombre = 'aproximado'
+
+    def __call__(self, latitud, longitud):
+        from .sinteticos import direccion_aproximada
+
+        return direccion_aproximada(latitud, longitud)
+
+
+def _instanciar(ruta):
+    proveedor = import_string(ruta)
+    return proveedor() if isinstance(proveedor, type) else proveedor
+
+
+@lru_cache(maxsize=None)
+def obtener_proveedor():
+    return _instanciar(obtener_ajustes()['PROVEEDOR'])
+
+
+@lru_cache(maxsize=None)
+def obtener_respaldo():
+    """ Proveedor para cuando el gazetteer local no existe, o None """
+    ruta = obtener_ajustes()['RESPALDO']
+    return _instanciar(ruta) if ruta else None
+
+
+# ============================================
+# CACHÉ EN MEMORIA
+# ============================================
+
+class CacheLRU:
+    """ LRU con vencimiento por entrada, compartida por los hilos del proceso """
+
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self._entradas = OrderedDict()
+        self._candado = threading.Lock()
+
+    def obtener(self, clave):
+        """ (encontrada, valor); None es un valor válido (respuesta negativa) """
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return False, None
+            valor, vence = entrada
+            if vence <= time.monotonic():
+                del self._entradas[clave]
+                return False, None
+            self._entradas.move_to_end(clave)
+            return True, valor
+
+    def guardar(self, clave, valor, segundos):
+        with self._candado:
+            self._entradas[clave] = (valor, time.monotonic() + segundos)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.tamano:
+                self._entradas.popitem(last=False)
+
+    def vaciar(self):
+        with self._candado:
+            self._entradas.clear()
+
+
+class _Vuelo:
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+
+
+class UnSoloVuelo:
+    """
+    Agrupa las consultas simultáneas de una misma clave: la primera hace
+    el trabajo y las demás esperan su resultado en vez de repetirlo.
+    """
+
+    def __init__(self):
+        self._vuelos = {}
+        self._candado = threading.Lock()
+
+    def hacer(self, clave, funcion, espera=None):
+        with self._candado:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+
+        if not lider:
+            vuelo.terminado.wait(espera)
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = funcion()
+        finally:
+            with self._candado:
+                del self._vuelos[clave]
+            vuelo.terminado.set()
+        return vuelo.resultado
+
+
+_cache = CacheLRU(obtener_ajustes()['TAMANO_LRU'])
+_vuelos = UnSoloVuelo()
+
+
+@receiver(setting_changed)
+def limpiar_geocodificacion(setting, **kwargs):
+    """ Descarta ajustes, proveedor y LRU cuando las pruebas cambian settings """
+    if setting == 'GEOCODIFICACION':
+        obtener_ajustes.cache_clear()
+        obtener_proveedor.cache_clear()
+        obtener_respaldo.cache_clear()
+        _cache.tamano = obtener_ajustes()['TAMANO_LRU']
+        _cache.vaciar()
+
+
+# ============================================
+# CONSULTA
+# ============================================
+
+def celda_geocodificacion(latitud, longitud, tamano_m):
+    """ Índices enteros de la celda de tamano_m metros que contiene al punto """
+    paso = tamano_m / (KM_POR_GRADO * 1000)
+    return floor(latitud / paso), floor(longitud / paso)
+
+
+def _resolver(tamano, celda_lat, celda_lon):
+    """ Dirección de la celda desde la base o, si no está vigente, desde el proveedor """
+    from apps.reportes.models import DireccionGeocodificada
+
+    ajustes = obtener_ajustes()
+    clave = (tamano, celda_lat, celda_lon)
+    ahora = timezone.now()
+
+    guardada = DireccionGeocodificada.objects.filter(
+        tamano_celda=tamano, celda_latitud=celda_lat, celda_longitud=celda_lon
+    ).first()
+    if guardada is not None:
+        vigencia = (
+            timedelta(days=ajustes['DIAS_VIGENCIA']) if guardada.direccion
+            else timedelta(seconds=ajustes['SEGUNDOS_NEGATIVO'])
+        )
+        restante = (guardada.consultado_en + vigencia - ahora).total_seconds()
+        if restante > 0:
+            _cache.guardar(clave, guardada.direccion or None, restante)
+            return guardada.direccion or None
+
+    # Se consulta el centro de la celda: toda la celda comparte la respuesta
+    paso = tamano / (KM_POR_GRADO * 1000)
+    proveedor = obtener_proveedor()
+    try:
+        direccion = proveedor((celda_lat + 0.5) * paso, (celda_lon + 0.5) * paso)
+    except ErrorGeocodificacion as error:
+        # No se guarda en la base: el lugar puede tener dirección, pero por
+        # un rato no se insiste para no agravar un límite de consultas
+        logger.warning('Geocodificación fallida en la celda %s: %s', clave, error)
+        _cache.guardar(clave, None, ajustes['SEGUNDOS_NEGATIVO'])
+        return None
+
+    direccion = (direccion or '')[:255]
+    DireccionGeocodificada.objects.update_or_create(
+        tamano_celda=tamano, celda_latitud=celda_lat, celda_longitud=celda_lon,
+        defaults={'direccion': direccion, 'proveedor': getattr(proveedor, 'nombre', ''), 'consultado_en': ahora}
+    )
+    _cache.guardar(
+        clave, direccion or None,
+        ajustes['DIAS_VIGENCIA'] * 86400 if direccion else ajustes['SEGUNDOS_NEGATIVO']
+    )
+    return direccion or None
+
+
+def direccion_para(latitud, longitud):
+    """
+    Dirección aproximada de unas coordenadas, o None si no son válidas, no
+    se conoce o el proveedor no responde. Los puntos de una misma celda
+    comparten resultado.
+    """
+    coordenadas = leer_coordenadas(latitud, longitud)
+    if coordenadas is None:
+        return None
+    latitud, longitud = coordenadas
+
+    ajustes = obtener_ajustes()
+    tamano = ajustes['TAMANO_CELDA_M']
+    celda_lat, celda_lon = celda_geocodificacion(latitud, longitud, tamano)
+    clave = (tamano, celda_lat, celda_lon)
+
+    encontrada, direccion = _cache.obtener(clave)
+    if encontrada:
+        return direccion
+    return _vuelos.hacer(
+        clave, lambda: _resolver(tamano, celda_lat, celda_lon), espera=ajustes['TIEMPO_ESPERA'] + 1
+    )
@@ -0,0 +1,175 @@
+"""
+Huellas perceptuales de las fotografías de evidencia
+dHash de 64 bits e índice BK-tree para buscar fotos parecidas
+"""
+
+import threading
+
+from PIL import Image, UnidentifiedImageError
+
+
+BITS_HASH = 64
+_MASCARA = (1 << BITS_HASH) - 1
+
+
+def calcular_dhash(archivo):
+    """
+    dHash de 64 bits de una imagen: se reduce a 9x8 en escala de grises y
+    cada bit indica si un píxel es más claro que su vecino de la derecha.
+    Resiste recompresión, cambios de tamaño y pequeños recortes.
+
+    Devuelve el hash como entero con signo (cabe en un BigIntegerField)
+    o None si el archivo no es una imagen.
+    """
+    try:
+        with Image.open(archivo) as imagen:
+            imagen.draft('L', (64, 64))
+            pixeles = list(imagen.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    valor = 0
+    for fila in range(8):
+        for columna in range(8):
+            izquierda = pixeles[fila * 9 + columna]
+            derecha = pixeles[fila * 9 + columna + 1]
+            valor = (valor << 1) | (izquierda > derecha)
+
+    if valor >= 1 << (BITS_HASH - 1):
+        valor -= 1 << BITS_HASH
+    return valor
+
+
+def distancia_hamming(a, b):
+    """ Bits distintos entre dos hashes """
+    return ((a ^ b) & _MASCARA).bit_count()
+
+
+class ArbolBK:
+    """
+    BK-tree sobre la distancia de Hamming. Cada hijo cuelga de la arista
+    con su distancia al padre; por la desigualdad triangular, una búsqueda
+    con tolerancia k solo baja por las aristas entre d - k y d + k.
+    """
+
+    def __init__(self):
+        self.raiz = None
+        self.total = 0
+
+    def agregar(self, valor, dato):
+        self.total += 1
+        if self.raiz is None:
+            self.raiz = [valor, [dato], {}]
+            return
+
+        nodo = self.raiz
+        while True:
+            distancia = distancia_hamming(valor, nodo[0])
+            if distancia == 0:
+                nodo[1].append(dato)
+                return
+            hijo = nodo[2].get(distancia)
+            if hijo is None:
+                nodo[2][distancia] = [valor, [dato], {}]
+                return
+            nodo = hijo
+
+    def buscar(self, valor, tolerancia):
+        """ Lista de (dato, distancia) con distancia <= tolerancia """
+        if self.raiz is None:
+            return []
+
+        encontrados = []
+        pendientes = [self.raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            distancia = distancia_hamming(valor, nodo[0])
+            if distancia <= tolerancia:
+                encontrados.extend((dato, distancia) for dato in nodo[1])
+            for arista, hijo in nodo[2].items():
+                if distancia - tolerancia <= arista <= distancia + tolerancia:
+                    pendientes.append(hijo)
+        return encontrados
+
+
+class IndiceImagenes:
+    """
+    Índice en memoria de los hashes de las fotos de ciudadanos.
+
+    Se sincroniza con la base por id: carga las evidencias posteriores a la
+    última vista y vuelve a consultar las que aún esperan su hash. Las que
+    no se pudieron leer (hash_fallido) o se borraron dejan de consultarse.
+    Las evidencias borradas quedan en el árbol, pero quien consulta
+    resuelve los ids contra la base y las descarta.
+    """
+
+    def __init__(self):
+        self.arbol = ArbolBK()
+        self.ultimo_id = 0
+        self.sin_hash = set()
+        self._candado = threading.Lock()
+
+    def sincronizar(self):
+        from apps.reportes.models import Evidencia
+
+        with self._candado:
+            fotos = Evidencia.objects.filter(tipo_evidencia='foto', es_evidencia_reparacion=False)
+
+            nuevas = list(
+                fotos.filter(id__gt=self.ultimo_id)
+                .order_by('id')
+                .values_list('id', 'hash_perceptual', 'hash_fallido')
+            )
+            revisadas = []
+            pendientes = sorted(self.sin_hash)
+            self.sin_hash.clear()
+            # Por bloques para no exceder el límite de parámetros SQL
+            for inicio in range(0, len(pendientes), 500):
+                revisadas += fotos.filter(id__in=pendientes[inicio:inicio + 500]).values_list(
+                    'id', 'hash_perceptual', 'hash_fallido'
+                )
+
+            for evidencia_id, valor, fallido in revisadas + nuevas:
+                if valor is not None:
+                    self.arbol.agregar(valor, evidencia_id)
+                elif not fallido:
+                    self.sin_hash.add(evidencia_id)
+
+            if nuevas:
+                self.ultimo_id = nuevas[-1][0]
+
+    def buscar(self, valor, tolerancia):
+        """ Ids de evidencias con hash a lo sumo a tolerancia bits """
+        self.sincronizar()
+        with self._candado:
+            return [evidencia_id for evidencia_id, _ in self.arbol.buscar(valor, tolerancia)]
+
+
+indice_imagenes = IndiceImagenes()
+
+
+def actualizar_hashes(evidencias):
+    """
+    Calcula el hash de las fotos de ciudadanos que aún no lo tienen. Las
+    que no se pueden leer quedan marcadas con hash_fallido y no se
+    reintentan. Devuelve {id de evidencia: hash} de las fotos que tienen hash.
+    """
+    from apps.reportes.models import Evidencia
+
+    hashes = {}
+    calculadas = []
+    for evidencia in evidencias.filter(tipo_evidencia='foto', es_evidencia_reparacion=False, hash_fallido=False):
+        if evidencia.hash_perceptual is None:
+            try:
+                if evidencia.archivo:
+                    with evidencia.archivo.open('rb') as archivo:
+                        evidencia.hash_perceptual = calcular_dhash(archivo)
+            except OSError:
+                pass
+            evidencia.hash_fallido = evidencia.hash_perceptual is None
+            calculadas.append(evidencia)
+        if evidencia.hash_perceptual is not None:
+            hashes[evidencia.id] = evidencia.hash_perceptual
+
+    Evidencia.objects.bulk_update(calculadas, ['hash_perceptual', 'hash_fallido'], batch_size=1000)
+    return hashes
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from apps.reportes.models import Reporte
+from apps.reportes.zonas import asignar_zonas
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula la localidad y el barrio de todos los reportes con el índice de '
+        'zonas. importar_zonas ya lo hace salvo con --sin-asignar; a mano se ejecuta '
+        'después de editar polígonos en el administrador o de cargar reportes sin '
+        'Reporte.save().'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=20000,
+            help='Reportes ubicados por lote (default: 20000)'
+        )
+
+    def handle(self, *args, **options):
+        total = Reporte.objects.filter(latitud__isnull=False, longitud__isnull=False).count()
+        self.stdout.write(f'Ubicando {total} reportes...')
+
+        inicio = time.perf_counter()
+        cambiados = asignar_zonas(tamano_lote=options['tamano_lote'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ Proceso completado: {cambiados} reportes cambiaron de zona '
+                f'en {time.perf_counter() - inicio:.1f} s'
+            )
+        )
@@ -0,0 +1,282 @@
+import json
+import platform
+import random
+import sqlite3
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.reportes.models import Reporte, GrupoDuplicado
+from apps.reportes.duplicate_detector import DetectorDuplicados
+from apps.reportes.sinteticos import crear_reportes
+
+
+# Margen absoluto para que el ruido de mediciones muy cortas no cuente como regresión
+HOLGURA_MS = 1.0
+HOLGURA_SEGUNDOS = 0.5
+
+
+def _percentil(valores, porcentaje):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    posicion = (len(ordenados) - 1) * porcentaje / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+def _medir(funcion):
+    """
+    Ejecuta funcion y devuelve (resultado, milisegundos, consultas). Las
+    consultas se cuentan con execute_wrapper: CaptureQueriesContext solo
+    guarda las últimas 9000 y daría un conteo falso en las corridas grandes.
+    """
+    consultas = 0
+
+    def contar(ejecutar, sql, params, many, context):
+        nonlocal consultas
+        consultas += 1
+        return ejecutar(sql, params, many, context)
+
+    with connection.execute_wrapper(contar):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        milisegundos = (time.perf_counter() - inicio) * 1000
+    return resultado, milisegundos, consultas
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el detector de duplicados sobre reportes sintéticos de Barranquilla '
+        'y falla si empeora respecto a la línea base guardada. Los datos se crean '
+        'dentro de una transacción que se revierte al terminar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanos',
+            default='10000,100000',
+            help=(
+                'Cantidades de reportes sintéticos separadas por comas (default: 10000,100000). '
+                'La línea base también tiene 1000000 (unos 8 minutos)'
+            )
+        )
+
+        parser.add_argument(
+            '--muestras',
+            type=int,
+            default=200,
+            help='Llamadas medidas por función en cada tamaño (default: 200)'
+        )
+
+        parser.add_argument(
+            '--semilla',
+            type=int,
+            default=2025,
+            help='Semilla de los datos sintéticos (default: 2025)'
+        )
+
+        parser.add_argument(
+            '--baseline',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'duplicados.json'),
+            help='Archivo JSON con la línea base (default: benchmarks/duplicados.json)'
+        )
+
+        parser.add_argument(
+            '--guardar-baseline',
+            action='store_true',
+            help='Guarda los resultados como nueva línea base en vez de compararlos'
+        )
+
+        parser.add_argument(
+            '--tolerancia',
+            type=float,
+            default=0.3,
+            help='Aumento relativo de tiempo permitido antes de fallar (default: 0.3 = 30%%)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tamanos = [int(valor) for valor in options['tamanos'].split(',') if valor.strip()]
+        except ValueError:
+            raise CommandError('--tamanos debe ser una lista de enteros separados por comas')
+
+        # Sin línea base no hay con qué comparar: se falla antes de medir
+        base = None
+        if not options['guardar_baseline']:
+            base = self.leer_baseline(options['baseline'], tamanos)
+
+        resultados = {}
+        for tamano in tamanos:
+            self.stdout.write(f'\n=== {tamano} reportes ===')
+            resultados[str(tamano)] = self.medir_tamano(tamano, options['muestras'], options['semilla'])
+
+        if options['guardar_baseline']:
+            self.guardar_baseline(options['baseline'], options['semilla'], resultados)
+            return
+
+        regresiones = self.comparar(base, resultados, options['tolerancia'])
+        if regresiones:
+            for regresion in regresiones:
+                self.stdout.write(self.style.ERROR(f'  ✗ {regresion}'))
+            raise CommandError(f'{len(regresiones)} regresiones respecto a la línea base')
+
+    def medir_tamano(self, tamano, muestras, semilla):
+        from apps.usuarios.models import Rol, Usuario
+
+        with transaction.atomic():
+            try:
+                rol, _ = Rol.objects.get_or_create(nombre='Ciudadano')
+                usuario = Usuario.objects.create(username=f'benchmark_{semilla}_{tamano}', rol=rol)
+
+                inicio = time.perf_counter()
+                fallas = crear_reportes(tamano, usuario, semilla=semilla)
+                siembra = time.perf_counter() - inicio
+                self.stdout.write(f'Siembra: {siembra:.1f} s')
+
+                ids = sorted(fallas)
+                elegidos = random.Random(semilla).sample(ids, min(muestras, len(ids)))
+                por_id = Reporte.objects.in_bulk(elegidos)
+                reportes = [por_id[reporte_id] for reporte_id in elegidos]
+
+                medicion = {
+                    'siembra_segundos': round(siembra, 2),
+                    'buscar_reportes_cercanos': self.medir_busqueda(reportes),
+                    'detectar_y_marcar_duplicado': self.medir_deteccion(reportes),
+                    'detectar_duplicados': self.medir_comando(),
+                }
+            finally:
+                # Nada de lo sembrado o agrupado queda en la base
+                transaction.set_rollback(True)
+
+        return medicion
+
+    def medir_busqueda(self, reportes):
+        tiempos, consultas, candidatos = [], [], 0
+        for reporte in reportes:
+            encontrados, milisegundos, cantidad = _medir(
+                lambda: list(DetectorDuplicados.buscar_reportes_cercanos(reporte).values_list('id', flat=True))
+            )
+            tiempos.append(milisegundos)
+            consultas.append(cantidad)
+            candidatos += len(encontrados)
+
+        return self.resumir('buscar_reportes_cercanos', tiempos, consultas, candidatos=candidatos)
+
+    def medir_deteccion(self, reportes):
+        tiempos, consultas, duplicados = [], [], 0
+        for reporte in reportes:
+            # Cada llamada se revierte para que todas partan del mismo estado
+            with transaction.atomic():
+                (es_duplicado, _), milisegundos, cantidad = _medir(
+                    lambda: DetectorDuplicados.detectar_y_marcar_duplicado(reporte)
+                )
+                transaction.set_rollback(True)
+            tiempos.append(milisegundos)
+            consultas.append(cantidad)
+            duplicados += es_duplicado
+
+        return self.resumir('detectar_y_marcar_duplicado', tiempos, consultas, duplicados=duplicados)
+
+    def medir_comando(self):
+        _, milisegundos, consultas = _medir(
+            lambda: call_command('detectar_duplicados', '--lote', stdout=StringIO())
+        )
+        grupos = GrupoDuplicado.objects.count()
+        self.stdout.write(
+            f'  detectar_duplicados --lote: {milisegundos / 1000:.2f} s, '
+            f'{consultas} consultas, {grupos} grupos'
+        )
+        return {
+            'segundos': round(milisegundos / 1000, 3),
+            'consultas': consultas,
+            'grupos': grupos,
+        }
+
+    def resumir(self, nombre, tiempos, consultas, **conteos):
+        resumen = {
+            'p50_ms': round(_percentil(tiempos, 50), 3),
+            'p95_ms': round(_percentil(tiempos, 95), 3),
+            'consultas': max(consultas, default=0),
+            **conteos,
+        }
+        self.stdout.write(
+            f'  {nombre}: p50 {resumen["p50_ms"]:.2f} ms, p95 {resumen["p95_ms"]:.2f} ms, '
+            f'{resumen["consultas"]} consultas máx. por llamada'
+        )
+        return resumen
+
+    def guardar_baseline(self, ruta, semilla, resultados):
+        """ Guarda los tamaños medidos y conserva los demás de la misma semilla """
+        from pathlib import Path
+
+        ruta = Path(ruta)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            anterior = json.loads(ruta.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            anterior = {}
+        if anterior.get('semilla') == semilla:
+            resultados = {**anterior.get('resultados', {}), **resultados}
+        datos = {
+            'semilla': semilla,
+            'entorno': {
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'maquina': platform.machine(),
+            },
+            'resultados': resultados,
+        }
+        ruta.write_text(json.dumps(datos, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f'\n✅ Línea base guardada en {ruta}'))
+
+    def leer_baseline(self, ruta, tamanos):
+        """ Resultados de la línea base para los tamaños pedidos """
+        from pathlib import Path
+
+        ruta = Path(ruta)
+        try:
+            base = json.loads(ruta.read_text(encoding='utf-8'))['resultados']
+        except FileNotFoundError:
+            raise CommandError(f'No hay línea base en {ruta}; ejecute con --guardar-baseline para crearla')
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'No se pudo leer la línea base {ruta}: {error}')
+
+        faltantes = [str(tamano) for tamano in tamanos if str(tamano) not in base]
+        if faltantes:
+            raise CommandError(
+                f'La línea base {ruta} no tiene {", ".join(faltantes)} reportes; '
+                'ejecute con --guardar-baseline para medirlos'
+            )
+        return base
+
+    def comparar(self, base, resultados, tolerancia):
+        regresiones = []
+        for tamano, medicion in resultados.items():
+            for nombre, metricas in medicion.items():
+                if not isinstance(metricas, dict):
+                    continue
+                anterior = base[tamano].get(nombre, {})
+                for clave, valor in metricas.items():
+                    if clave not in anterior:
+                        continue
+                    previo = anterior[clave]
+                    if clave.endswith('_ms') or clave == 'segundos':
+                        holgura = HOLGURA_MS if clave.endswith('_ms') else HOLGURA_SEGUNDOS
+                        if valor > previo * (1 + tolerancia) + holgura:
+                            regresiones.append(f'{tamano} · {nombre}.{clave}: {valor} (antes {previo})')
+                    elif clave == 'consultas':
+                        if valor > previo:
+                            regresiones.append(f'{tamano} · {nombre}.{clave}: {valor} (antes {previo})')
+                    elif valor != previo:
+                        # Con la misma semilla el agrupamiento debe ser idéntico
+                        regresiones.append(f'{tamano} · {nombre}.{clave}: resultado {valor} distinto de {previo}')
+
+        if not regresiones:
+            self.stdout.write(self.style.SUCCESS('\n✅ Sin regresiones respecto a la línea base'))
+        return regresiones
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from apps.reportes.mapa import construir_agregados, ZOOM_MAXIMO_AGREGADO
+from apps.reportes.teselas import vaciar_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula desde cero los grupos de marcadores del mapa (AgregadoMapa) y vacía '
+        'la caché de teselas vectoriales. Se ejecuta después de loaddata o de una '
+        'importación de reportes sin señales, y al cambiar PIXELES_CELDA o '
+        'ZOOM_MAXIMO_AGREGADO en mapa.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=5000,
+            help='Filas insertadas por lote (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Agrupando reportes para los zooms 0 a {ZOOM_MAXIMO_AGREGADO}...')
+
+        inicio = time.perf_counter()
+        creados = construir_agregados(tamano_lote=options['tamano_lote'])
+        vaciar_cache()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ Proceso completado: {creados} celdas en {time.perf_counter() - inicio:.1f} s, '
+                f'caché de teselas vaciada'
+            )
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from apps.reportes.densidad import construir_densidad, COLUMNAS, FILAS
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula desde cero las capas del mapa de calor (CeldaDensidad) por tipo '
+        'de falla y mes y sube la versión de todas, lo que renueva las imágenes en '
+        'caché. Se ejecuta al cambiar RECUADRO_DENSIDAD o TAMANO_CELDA en '
+        'densidad.py o si el mapa de calor no coincide con los reportes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=5000,
+            help='Filas insertadas por lote (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Contando reportes en la malla de {FILAS} × {COLUMNAS} celdas...')
+
+        inicio = time.perf_counter()
+        creados = construir_densidad(tamano_lote=options['tamano_lote'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ Proceso completado: {creados} celdas en {time.perf_counter() - inicio:.1f} s'
+            )
+        )
@@ -1,6 +1,8 @@
-from django.core.management.base import BaseCommand
-from apps.reportes.models import Reporte
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from apps.reportes.models import Reporte, PuntoControlDeteccion
 from apps.reportes.duplicate_detector import DetectorDuplicados
+from apps.reportes.configuracion import obtener_configuracion
 
 
 class Command(BaseCommand):
@@ -10,28 +12,101 @@ class Command(BaseCommand):
         parser.add_argument(
             '--radio',
             type=float,
-            default=0.05,
-            help='Radio de búsqueda en kilómetros (default: 0.05 = 50 metros)'
+            default=None,
+            help='Radio de búsqueda en kilómetros para todos los tipos (default: settings.DETECCION_DUPLICADOS)'
         )
         
         parser.add_argument(
             '--dias',
             type=int,
-            default=7,
-            help='Ventana temporal en días (default: 7)'
+            default=None,
+            help='Ventana temporal en días para todos los tipos (default: settings.DETECCION_DUPLICADOS)'
+        )
+
+        parser.add_argument(
+            '--lote',
+            action='store_true',
+            help='Procesa todos los reportes en una sola pasada vectorizada (requiere NumPy)'
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Procesos para calcular vecindarios en paralelo por tipo y tesela (implica --lote)'
+        )
+
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Solo procesa reportes posteriores al último punto de control (implica --lote)'
+        )
+
+        parser.add_argument(
+            '--reiniciar',
+            action='store_true',
+            help='Borra el punto de control antes de una ejecución incremental'
+        )
+
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=5000,
+            help='Reportes nuevos por lote en modo incremental (default: 5000)'
         )
     
     def handle(self, *args, **options):
         from apps.reportes.models import Reporte
         
-        radio = options['radio']
-        dias = options['dias']
-        
-        # Actualizar configuración temporal
-        DetectorDuplicados.RADIO_BUSQUEDA_KM = radio
-        DetectorDuplicados.VENTANA_TEMPORAL_DIAS = dias
+        # Configuración propia de esta ejecución; no afecta a las demás
+        try:
+            config = obtener_configuracion().ajustada(
+                radio_km=options['radio'],
+                ventana_dias=options['dias']
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
         
-        self.stdout.write(f'Buscando duplicados con radio de {radio*1000}m y ventana de {dias} días...')
+        self.stdout.write(f'Buscando duplicados con radio de {config.radio_km*1000}m y ventana de {config.ventana_dias} días...')
+        for tipo, radio, dias in config.por_tipo:
+            self.stdout.write(f'  {tipo}: radio de {config.radio_para(tipo)*1000}m y ventana de {config.ventana_para(tipo)} días')
+
+        if options['incremental']:
+            if options['reiniciar']:
+                PuntoControlDeteccion.objects.filter(nombre='detectar_duplicados').delete()
+
+            total_nuevos = 0
+            total_marcados = 0
+            for nuevos, marcados, punto in DetectorDuplicados.detectar_incremental(
+                config=config,
+                trabajadores=options['workers'],
+                tamano_lote=options['tamano_lote']
+            ):
+                total_nuevos += nuevos
+                total_marcados += marcados
+                self.stdout.write(
+                    f'Lote: {nuevos} reportes nuevos, {marcados} duplicados '
+                    f'(punto de control: #{punto.ultimo_id} del {timezone.localtime(punto.ultimo_reportado_en):%d/%m/%Y %H:%M})'
+                )
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'\n✅ Proceso completado: {total_marcados} duplicados marcados de {total_nuevos} reportes nuevos'
+                )
+            )
+            return
+
+        if options['lote'] or options['workers'] > 1:
+            marcados, grupos_creados = DetectorDuplicados.detectar_en_lote(
+                config=config,
+                trabajadores=options['workers']
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'\n✅ Proceso completado: {marcados} duplicados marcados en {grupos_creados} grupos nuevos'
+                )
+            )
+            return
         
         # Obtener reportes con coordenadas que no estén marcados
         reportes = Reporte.objects.filter(
@@ -45,7 +120,7 @@ class Command(BaseCommand):
         duplicados_encontrados = 0
         
         for reporte in reportes:
-            es_duplicado, grupo = DetectorDuplicados.detectar_y_marcar_duplicado(reporte)
+            es_duplicado, grupo = DetectorDuplicados.detectar_y_marcar_duplicado(reporte, config)
             procesados += 1
             
             if es_duplicado:
@@ -0,0 +1,167 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.reportes.geocodificacion import obtener_ajustes
+from apps.reportes.models import HistorialReporte, Reporte
+from apps.reportes.nomenclatura import MallaVial, geocodificar_lote, leer_puntos_control
+
+
+class Command(BaseCommand):
+    help = (
+        'Completa las coordenadas de los reportes que solo tienen dirección '
+        '("Calle 72 # 43-85", "Carrera 46 con Calle 72") con un modelo local de '
+        'la malla vial, sin servicios externos. El modelo se ajusta con --ajustar '
+        'y/o --con-reportes y se guarda en settings.GEOCODIFICACION["MALLA_VIAL"].'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ajustar',
+            metavar='ARCHIVO',
+            help='JSON con puntos de control: [{"direccion" o "calle" y "carrera", "latitud", "longitud"}, ...]'
+        )
+        parser.add_argument(
+            '--con-reportes',
+            action='store_true',
+            help='Usar también como puntos de control los reportes con coordenadas y dirección legible'
+        )
+        parser.add_argument(
+            '--confianza-minima',
+            type=float,
+            default=0.6,
+            help='Confianza mínima para guardar coordenadas (default: 0.6)'
+        )
+        parser.add_argument(
+            '--procesos',
+            type=int,
+            default=1,
+            help='Procesos que leen y ubican direcciones en paralelo (default: 1)'
+        )
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=2000,
+            help='Direcciones por lote (default: 2000)'
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Solo informar lo que se haría, sin guardar'
+        )
+
+    def handle(self, *args, **options):
+        ruta = obtener_ajustes()['MALLA_VIAL'] or os.path.join(settings.BASE_DIR, 'datos', 'malla_vial.json')
+
+        if options['ajustar'] or options['con_reportes']:
+            malla = self._ajustar(options)
+            if not options['simular']:
+                malla.guardar(ruta)
+        else:
+            try:
+                malla = MallaVial.cargar(ruta)
+            except (OSError, ValueError, TypeError) as error:
+                raise CommandError(f'No hay modelo de la malla vial en {ruta} ({error}); use --ajustar')
+
+        pendientes = list(
+            Reporte.objects.filter(latitud__isnull=True).exclude(direccion='')
+            .order_by('id').values_list('id', 'direccion')
+        )
+        self.stdout.write(f'Reportes sin coordenadas con dirección: {len(pendientes)}')
+
+        tamano = options['tamano_lote']
+        lotes = [(pendientes[i:i + tamano], malla) for i in range(0, len(pendientes), tamano)]
+        minima = options['confianza_minima']
+        leidas = guardadas = 0
+        segundos_geocodificacion = 0.0
+
+        inicio = time.perf_counter()
+        if options['procesos'] > 1 and len(lotes) > 1:
+            ejecutor = ProcessPoolExecutor(max_workers=options['procesos'])
+            resultados = ejecutor.map(geocodificar_lote, lotes)
+        else:
+            ejecutor = None
+            resultados = map(geocodificar_lote, lotes)
+
+        try:
+            marca = time.perf_counter()
+            for lote in resultados:
+                segundos_geocodificacion += time.perf_counter() - marca
+                leidas += sum(1 for _, resultado in lote if resultado is not None)
+                aceptados = [
+                    (reporte_id, resultado) for reporte_id, resultado in lote
+                    if resultado is not None and resultado[2] >= minima
+                ]
+                guardadas += len(aceptados)
+                if not options['simular']:
+                    self._guardar(aceptados)
+                marca = time.perf_counter()
+        finally:
+            if ejecutor is not None:
+                ejecutor.shutdown()
+
+        total = time.perf_counter() - inicio
+        por_segundo = len(pendientes) / segundos_geocodificacion if segundos_geocodificacion else 0
+        self.stdout.write(
+            f'Direcciones legibles: {leidas}/{len(pendientes)}, '
+            f'con confianza >= {minima}: {guardadas} ({por_segundo:,.0f} direcciones/s)'
+        )
+        accion = 'se ubicarían' if options['simular'] else 'ubicados'
+        self.stdout.write(
+            self.style.SUCCESS(f'\n✅ Proceso completado: {guardadas} reportes {accion} en {total:.1f} s')
+        )
+
+    def _ajustar(self, options):
+        filas = []
+        if options['ajustar']:
+            try:
+                with open(options['ajustar'], encoding='utf-8') as archivo:
+                    filas.extend(json.load(archivo))
+            except (OSError, ValueError) as error:
+                raise CommandError(f'No se pudo leer {options["ajustar"]}: {error}')
+        if options['con_reportes']:
+            filas.extend(
+                Reporte.objects.filter(latitud__isnull=False, longitud__isnull=False, confianza_ubicacion__isnull=True)
+                .exclude(direccion='').values('direccion', 'latitud', 'longitud')
+            )
+
+        try:
+            malla = MallaVial.ajustar(leer_puntos_control(filas))
+        except (KeyError, ValueError) as error:
+            raise CommandError(f'No se pudo ajustar la malla vial: {error}')
+
+        self.stdout.write(
+            f'Malla vial de grado {malla.grado} con {malla.puntos} puntos de control: '
+            f'error medio {malla.error_m:.0f} m, calles {malla.rango_calle[0]:g}-{malla.rango_calle[1]:g}, '
+            f'carreras {malla.rango_carrera[0]:g}-{malla.rango_carrera[1]:g}'
+        )
+        return malla
+
+    def _guardar(self, aceptados):
+        """
+        Guarda las coordenadas con save() para que las señales reagrupen los
+        reportes y actualicen el mapa, las teselas y el mapa de calor
+        """
+        with transaction.atomic():
+            reportes = Reporte.objects.in_bulk([reporte_id for reporte_id, _ in aceptados])
+            historial = []
+            for reporte_id, (latitud, longitud, confianza) in aceptados:
+                reporte = reportes.get(reporte_id)
+                if reporte is None or reporte.latitud is not None:
+                    continue  # Borrado o ubicado mientras tanto
+                reporte.latitud = Decimal(f'{latitud:.7f}')
+                reporte.longitud = Decimal(f'{longitud:.7f}')
+                reporte.confianza_ubicacion = confianza
+                reporte.save(update_fields=['latitud', 'longitud', 'confianza_ubicacion', 'actualizado_en'])
+                historial.append(HistorialReporte(
+                    reporte=reporte,
+                    usuario=None,
+                    accion='Ubicación estimada desde la dirección',
+                    detalles=f'{reporte.direccion} → {latitud:.6f}, {longitud:.6f} (confianza {confianza:.2f})'
+                ))
+            HistorialReporte.objects.bulk_create(historial)
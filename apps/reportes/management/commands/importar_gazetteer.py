@@ -0,0 +1,44 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.reportes.gazetteer import Gazetteer, ruta_gazetteer
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa un extracto de OpenStreetMap de Barranquilla en GeoJSON (por ejemplo '
+        'de Overpass con osmtogeojson, o de ogr2ogr) al gazetteer local que usa la '
+        'geocodificación inversa: calles con nombre (highway), barrios '
+        '(place=neighbourhood/suburb o admin_level 9-10) y lugares con nombre.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='FeatureCollection GeoJSON')
+        parser.add_argument(
+            '--salida',
+            help='Archivo .npz de destino (default: settings.GEOCODIFICACION["GAZETTEER"])'
+        )
+
+    def handle(self, *args, **options):
+        salida = options['salida'] or ruta_gazetteer()
+        inicio = time.perf_counter()
+
+        try:
+            with open(options['archivo'], encoding='utf-8') as archivo:
+                coleccion = json.load(archivo)
+            gazetteer = Gazetteer.desde_geojson(coleccion)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'No se pudo importar {options["archivo"]}: {error}')
+
+        gazetteer.guardar(salida)
+
+        self.stdout.write(
+            f'Calles: {len(set(gazetteer.tramos_nombre.tolist()))} ({len(gazetteer.tramos_nombre)} tramos), '
+            f'barrios: {len(gazetteer.barrios_nombre)}, lugares: {len(gazetteer.lugares_nombre)}'
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ Gazetteer guardado en {salida} en {time.perf_counter() - inicio:.1f} s'
+            )
+        )
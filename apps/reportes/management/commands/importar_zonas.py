@@ -0,0 +1,50 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.reportes.zonas import asignar_zonas, importar_zonas
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa localidades y barrios desde un GeoJSON (polígonos con nombre; el '
+        'nivel sale de la propiedad "nivel", de admin_level o de place=neighbourhood) '
+        'y vuelve a asignar la zona de todos los reportes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='FeatureCollection GeoJSON')
+        parser.add_argument(
+            '--nivel',
+            choices=['localidad', 'barrio'],
+            help='Nivel de todos los polígonos del archivo'
+        )
+        parser.add_argument(
+            '--reemplazar',
+            action='store_true',
+            help='Borrar las zonas que no están en el archivo'
+        )
+        parser.add_argument(
+            '--sin-asignar',
+            action='store_true',
+            help='No recalcular la zona de los reportes (se hace después con asignar_zonas)'
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with open(options['archivo'], encoding='utf-8') as archivo:
+                coleccion = json.load(archivo)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'No se pudo leer {options["archivo"]}: {error}')
+
+        localidades, barrios = importar_zonas(coleccion, nivel=options['nivel'], reemplazar=options['reemplazar'])
+        self.stdout.write(f'Localidades: {localidades}, barrios: {barrios}')
+
+        if not options['sin_asignar']:
+            cambiados = asignar_zonas()
+            self.stdout.write(f'Reportes con zona actualizada: {cambiados}')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'\n✅ Zonas importadas en {time.perf_counter() - inicio:.1f} s')
+        )
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from apps.reportes.models import Evidencia, DeteccionPendiente
+from apps.reportes.imagenes import actualizar_hashes
+
+
+class Command(BaseCommand):
+    help = 'Calcula el hash perceptual de las fotos que aún no lo tienen y encola sus reportes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=500,
+            help='Fotos procesadas por lote (default: 500)'
+        )
+
+        parser.add_argument(
+            '--sin-encolar',
+            action='store_true',
+            help='Solo calcula los hashes, sin encolar la detección de duplicados'
+        )
+
+        parser.add_argument(
+            '--reintentar-fallidas',
+            action='store_true',
+            help='Vuelve a intentar las fotos que antes no se pudieron leer (por ejemplo, tras restaurar archivos)'
+        )
+
+    def handle(self, *args, **options):
+        tamano_lote = options['tamano_lote']
+        if options['reintentar_fallidas']:
+            Evidencia.objects.filter(hash_fallido=True).update(hash_fallido=False)
+        pendientes = Evidencia.objects.filter(
+            tipo_evidencia='foto',
+            es_evidencia_reparacion=False,
+            hash_perceptual__isnull=True,
+            hash_fallido=False
+        ).order_by('id')
+
+        total = pendientes.count()
+        self.stdout.write(f'Calculando hashes de {total} fotos...')
+
+        ultimo_id = 0
+        calculados = 0
+        while True:
+            lote = list(pendientes.filter(id__gt=ultimo_id).values_list('id', flat=True)[:tamano_lote])
+            if not lote:
+                break
+            ultimo_id = lote[-1]
+
+            hashes = actualizar_hashes(Evidencia.objects.filter(id__in=lote))
+            calculados += len(hashes)
+
+            if hashes and not options['sin_encolar']:
+                reportes = set(
+                    Evidencia.objects.filter(id__in=list(hashes)).values_list('reporte_id', flat=True)
+                )
+                DeteccionPendiente.objects.bulk_create(
+                    [DeteccionPendiente(reporte_id=reporte_id) for reporte_id in reportes],
+                    ignore_conflicts=True
+                )
+
+            self.stdout.write(f'{calculados}/{total} fotos indexadas')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ Proceso completado: {calculados} hashes calculados, '
+                f'{total - calculados} archivos sin imagen legible'
+            )
+        )
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from apps.reportes.models import Reporte
+from apps.reportes.duplicate_detector import DetectorDuplicados
+from apps.reportes.texto import indexar_textos
+
+
+class Command(BaseCommand):
+    help = 'Calcula las firmas MinHash y bandas LSH del texto de los reportes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos',
+            action='store_true',
+            help='Recalcula también los reportes que ya tienen firma'
+        )
+
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=500,
+            help='Reportes procesados por lote (default: 500)'
+        )
+
+        parser.add_argument(
+            '--detectar',
+            action='store_true',
+            help='Al terminar, agrupa los reportes sin coordenadas con texto similar'
+        )
+
+    def handle(self, *args, **options):
+        tamano_lote = options['tamano_lote']
+
+        reportes = Reporte.objects.order_by('id').only('id', 'titulo', 'descripcion', 'direccion')
+        if not options['todos']:
+            reportes = reportes.filter(firma_texto__isnull=True)
+
+        total = reportes.count()
+        self.stdout.write(f'Indexando el texto de {total} reportes...')
+
+        ultimo_id = 0
+        indexados = 0
+        while True:
+            lote = list(reportes.filter(id__gt=ultimo_id)[:tamano_lote])
+            if not lote:
+                break
+            ultimo_id = lote[-1].id
+
+            indexar_textos(lote)
+            indexados += len(lote)
+            self.stdout.write(f'{indexados}/{total} reportes indexados')
+
+        if options['detectar']:
+            marcados, grupos_creados = DetectorDuplicados.detectar_por_texto_en_lote()
+            self.stdout.write(f'Texto similar: {marcados} duplicados marcados en {grupos_creados} grupos nuevos')
+
+        self.stdout.write(self.style.SUCCESS(f'\n✅ Proceso completado: {indexados} reportes indexados'))
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from apps.reportes.duplicate_detector import DetectorDuplicados
+
+
+class Command(BaseCommand):
+    help = 'Procesa por lotes la cola de detección de duplicados'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos de espera cuando la cola está vacía (default: 5)'
+        )
+
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=200,
+            help='Máximo de reportes por lote (default: 200)'
+        )
+
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Vacía la cola una vez y termina'
+        )
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo']
+        lote = options['lote']
+
+        self.stdout.write(f'Procesando detecciones en lotes de {lote} reportes...')
+
+        try:
+            while True:
+                procesados, marcados = DetectorDuplicados.procesar_pendientes(limite=lote)
+
+                if procesados:
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f'Lote procesado: {procesados} reportes, {marcados} duplicados marcados'
+                        )
+                    )
+
+                # Con un lote completo probablemente queda más trabajo en la cola
+                if procesados == lote:
+                    continue
+
+                if options['una_vez']:
+                    break
+
+                time.sleep(intervalo)
+        except KeyboardInterrupt:
+            self.stdout.write('\nDetenido por el usuario')
@@ -0,0 +1,317 @@
+import csv
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.reportes.configuracion import obtener_configuracion
+from apps.reportes.duplicate_detector import DetectorDuplicados
+from apps.reportes.models import Reporte
+from apps.reportes.sinteticos import generar_reportes, datos_reporte
+
+
+# Mismo tamaño de lote que usa procesar_detecciones por defecto
+LOTE_COLA = 200
+
+
+def _percentiles(valores):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return {50: 0.0, 95: 0.0, 99: 0.0, 100: 0.0}
+    return {
+        porcentaje: ordenados[min(len(ordenados) - 1, int(len(ordenados) * porcentaje / 100))]
+        for porcentaje in (50, 95, 99, 100)
+    }
+
+
+def _pares(tamanos):
+    return sum(n * (n - 1) // 2 for n in tamanos)
+
+
+def precision_recall_pares(grupo_por_reporte, falla_por_reporte):
+    """
+    Precisión y exhaustividad sobre pares de reportes: un par es positivo
+    si ambos quedaron en el mismo grupo y correcto si son la misma falla.
+    Los reportes sin grupo cuentan como grupos de uno.
+    """
+    grupos = Counter(grupo for grupo in grupo_por_reporte.values() if grupo)
+    fallas = Counter(falla_por_reporte.values())
+    coincidencias = Counter(
+        (grupo, falla_por_reporte[reporte_id])
+        for reporte_id, grupo in grupo_por_reporte.items() if grupo
+    )
+
+    predichos = _pares(grupos.values())
+    reales = _pares(fallas.values())
+    correctos = _pares(coincidencias.values())
+
+    precision = correctos / predichos if predichos else 1.0
+    exhaustividad = correctos / reales if reales else 1.0
+    return precision, exhaustividad
+
+
+class Command(BaseCommand):
+    help = (
+        'Reproduce en tiempo acelerado un flujo de reportes (sintético o desde un CSV) '
+        'por el camino real de creación y señales, y mide la latencia de detección, '
+        'las escrituras y la calidad del agrupamiento. Todo se revierte al terminar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cantidad',
+            type=int,
+            default=2000,
+            help='Reportes sintéticos a reproducir (default: 2000)'
+        )
+
+        parser.add_argument(
+            '--semilla',
+            type=int,
+            default=2025,
+            help='Semilla de los reportes sintéticos (default: 2025)'
+        )
+
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=30,
+            help='Días que abarca el flujo sintético (default: 30)'
+        )
+
+        parser.add_argument(
+            '--sin-coordenadas',
+            type=float,
+            default=0.0,
+            help='Fracción de reportes sintéticos sin GPS (default: 0)'
+        )
+
+        parser.add_argument(
+            '--archivo',
+            help='CSV con columnas reportado_en, latitud, longitud, tipo, titulo, descripcion, '
+                 'direccion y, opcionalmente, falla (etiqueta de referencia)'
+        )
+
+        parser.add_argument(
+            '--modo',
+            choices=['sincrono', 'cola'],
+            default='cola',
+            help='Detección en la misma petición o con la cola de procesar_detecciones (default: cola)'
+        )
+
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos simulados entre pasadas del procesador de la cola (default: 5)'
+        )
+
+        parser.add_argument(
+            '--aceleracion',
+            type=float,
+            default=0,
+            help='Factor de aceleración del reloj; 0 reproduce sin esperas (default: 0)'
+        )
+
+        parser.add_argument(
+            '--radio',
+            type=float,
+            help='Radio de búsqueda en km para esta simulación'
+        )
+
+        parser.add_argument(
+            '--ventana',
+            type=float,
+            help='Ventana temporal en días para esta simulación'
+        )
+
+        parser.add_argument(
+            '--conservar',
+            action='store_true',
+            help='Conserva en la base los reportes y grupos creados'
+        )
+
+    def handle(self, *args, **options):
+        eventos = self.cargar_eventos(options)
+        if not eventos:
+            raise CommandError('No hay reportes para reproducir')
+        eventos.sort(key=lambda evento: evento['reportado_en'])
+
+        # Configuración propia de esta simulación; no afecta a las demás detecciones
+        try:
+            config = obtener_configuracion().ajustada(radio_km=options['radio'], ventana_dias=options['ventana'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(
+            f'Reproduciendo {len(eventos)} reportes en modo {options["modo"]} '
+            f'(radio {config.radio_km * 1000:g} m, ventana {config.ventana_dias:g} días)...'
+        )
+        with transaction.atomic():
+            try:
+                self.reproducir(eventos, config, options)
+            finally:
+                if not options['conservar']:
+                    transaction.set_rollback(True)
+
+    def cargar_eventos(self, options):
+        if options['archivo']:
+            try:
+                with open(options['archivo'], newline='', encoding='utf-8') as archivo:
+                    return self.leer_eventos(csv.DictReader(archivo))
+            except (OSError, UnicodeDecodeError, csv.Error) as error:
+                raise CommandError(f'No se pudo leer {options["archivo"]}: {error}')
+
+        azar = random.Random(options['semilla'])
+        return [
+            {
+                'falla': falla,
+                'reportado_en': fecha,
+                'campos': datos_reporte(azar, latitud, longitud, tipo, direccion),
+            }
+            for falla, latitud, longitud, tipo, fecha, direccion in generar_reportes(
+                options['cantidad'],
+                semilla=options['semilla'],
+                dias=options['dias'],
+                fraccion_sin_coordenadas=options['sin_coordenadas']
+            )
+        ]
+
+    def leer_eventos(self, lector):
+        faltantes = {'reportado_en', 'tipo'} - set(lector.fieldnames or ())
+        if faltantes:
+            raise CommandError(f'Faltan columnas en el CSV: {", ".join(sorted(faltantes))}')
+
+        eventos = []
+        for fila in lector:
+            fecha = parse_datetime(fila['reportado_en'])
+            if fecha is None:
+                raise CommandError(f'Fecha inválida: {fila["reportado_en"]}')
+            if timezone.is_naive(fecha):
+                fecha = timezone.make_aware(fecha)
+            eventos.append({
+                'falla': fila.get('falla') or None,
+                'reportado_en': fecha,
+                'campos': {
+                    'titulo': fila.get('titulo', ''),
+                    'descripcion': fila.get('descripcion', ''),
+                    'direccion': fila.get('direccion', ''),
+                    'tipo': fila['tipo'],
+                    'latitud': fila.get('latitud') or None,
+                    'longitud': fila.get('longitud') or None,
+                },
+            })
+        return eventos
+
+    def reproducir(self, eventos, config, options):
+        from apps.usuarios.models import Rol, Usuario
+
+        rol, _ = Rol.objects.get_or_create(nombre='Ciudadano')
+        usuario, _ = Usuario.objects.get_or_create(username='simulador', defaults={'rol': rol})
+
+        escrituras = Counter()
+
+        def contar_escrituras(ejecutar, sql, params, many, context):
+            verbo = sql.lstrip().split(None, 1)[0].upper()
+            if verbo in ('INSERT', 'UPDATE', 'DELETE'):
+                escrituras[verbo] += 1
+            return ejecutar(sql, params, many, context)
+
+        asincrona = options['modo'] == 'cola'
+        reloj = eventos[0]['reportado_en']
+        en_cola = []
+        latencias_insercion = []
+        latencias_lote = []
+        esperas_cola = []
+        falla_por_reporte = {}
+        intervalo = timedelta(seconds=options['intervalo'])
+        proxima_pasada = reloj + intervalo
+
+        def procesar_cola(ahora):
+            inicio = time.perf_counter()
+            while True:
+                procesados, _ = DetectorDuplicados.procesar_pendientes(limite=LOTE_COLA, config=config)
+                if procesados < LOTE_COLA:
+                    break
+            latencias_lote.append((time.perf_counter() - inicio) * 1000)
+            esperas_cola.extend((ahora - fecha).total_seconds() for fecha in en_cola)
+            en_cola.clear()
+
+        with connection.execute_wrapper(contar_escrituras):
+            for evento in eventos:
+                if asincrona:
+                    while evento['reportado_en'] >= proxima_pasada:
+                        if en_cola:
+                            procesar_cola(proxima_pasada)
+                        proxima_pasada += intervalo
+
+                if options['aceleracion']:
+                    espera = (evento['reportado_en'] - reloj).total_seconds() / options['aceleracion']
+                    if espera > 0:
+                        time.sleep(espera)
+                reloj = evento['reportado_en']
+
+                # El reloj simulado llega como reportado_en y la detección usa la
+                # configuración y el modo de la simulación
+                reporte = Reporte(usuario=usuario, reportado_en=reloj, **evento['campos'])
+                reporte._configuracion_deteccion = config
+                reporte._deteccion_asincrona = asincrona
+                inicio = time.perf_counter()
+                reporte.save()
+                latencias_insercion.append((time.perf_counter() - inicio) * 1000)
+
+                en_cola.append(evento['reportado_en'])
+                if evento['falla'] is not None:
+                    falla_por_reporte[reporte.id] = evento['falla']
+
+            if asincrona and en_cola:
+                procesar_cola(proxima_pasada)
+
+        self.informar(latencias_insercion, latencias_lote, esperas_cola, escrituras, len(eventos), options['modo'])
+
+        if falla_por_reporte:
+            grupo_por_reporte = {
+                reporte_id: grupo_id
+                for reporte_id, grupo_id in Reporte.objects.filter(usuario=usuario).values_list('id', 'grupoDuplicado_id')
+                if reporte_id in falla_por_reporte
+            }
+            precision, exhaustividad = precision_recall_pares(grupo_por_reporte, falla_por_reporte)
+            f1 = 2 * precision * exhaustividad / (precision + exhaustividad) if precision + exhaustividad else 0.0
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'\nCalidad (pares de reportes): precisión {precision:.3f}, '
+                    f'exhaustividad {exhaustividad:.3f}, F1 {f1:.3f}'
+                )
+            )
+
+    def informar(self, latencias_insercion, latencias_lote, esperas_cola, escrituras, total, modo):
+        p = _percentiles(latencias_insercion)
+        self.stdout.write(
+            f'\nInserción ({"con detección" if modo == "sincrono" else "solo encolar"}): '
+            f'p50 {p[50]:.2f} ms, p95 {p[95]:.2f} ms, p99 {p[99]:.2f} ms, máx {p[100]:.2f} ms'
+        )
+
+        if modo == 'cola':
+            p = _percentiles(latencias_lote)
+            self.stdout.write(
+                f'Pasadas de la cola ({len(latencias_lote)}): '
+                f'p50 {p[50]:.2f} ms, p95 {p[95]:.2f} ms, máx {p[100]:.2f} ms'
+            )
+            p = _percentiles(esperas_cola)
+            self.stdout.write(
+                f'Espera en cola (tiempo simulado): p50 {p[50]:.1f} s, p95 {p[95]:.1f} s, máx {p[100]:.1f} s'
+            )
+
+        # El mapa, las teselas y el mapa de calor se actualizan al confirmar la
+        # transacción, y la simulación nunca confirma: esas escrituras no se cuentan
+        total_escrituras = sum(escrituras.values())
+        self.stdout.write(
+            f'Escrituras sin el mantenimiento del mapa: {total_escrituras} sentencias '
+            f'({total_escrituras / total:.1f} por reporte) · '
+            + ', '.join(f'{verbo} {cantidad}' for verbo, cantidad in sorted(escrituras.items()))
+        )
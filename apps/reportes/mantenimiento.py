@@ -0,0 +1,112 @@
+"""
+Mantenimiento incremental de las tablas derivadas de los reportes
+Contadores del mapa, de las teselas y del mapa de calor
+"""
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+
+def sumar_contadores(modelo, claves, columnas, filas, borrar_vacias=None):
+    """
+    Suma las filas (valores de claves..., valores de columnas...) a la tabla
+    del modelo con un solo INSERT ... ON CONFLICT (claves) DO UPDATE, que es
+    atómico aunque otros procesos sumen a las mismas filas. claves debe ser
+    una restricción única del modelo.
+
+    Las filas con la misma clave se suman antes de escribir (un upsert no
+    puede tocar dos veces la misma fila) y las que suman cero se omiten.
+    Si borrar_vacias nombra una columna, las filas que restaron y quedaron
+    con esa columna en cero o menos se borran.
+    """
+    totales = {}
+    for fila in filas:
+        clave = tuple(fila[:len(claves)])
+        sumas = totales.setdefault(clave, [0] * len(columnas))
+        for k, valor in enumerate(fila[len(claves):]):
+            sumas[k] += valor
+    totales = {clave: sumas for clave, sumas in totales.items() if any(sumas)}
+    if not totales:
+        return
+
+    campos = [modelo._meta.get_field(nombre) for nombre in (*claves, *columnas)]
+    nombre = connection.ops.quote_name
+    tabla = nombre(modelo._meta.db_table)
+    nombres = [nombre(campo.column) for campo in campos]
+    asignaciones = ', '.join(
+        f'{columna} = {tabla}.{columna} + excluded.{columna}' for columna in nombres[len(claves):]
+    )
+    marcador = f'({", ".join(["%s"] * len(campos))})'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tabla} ({", ".join(nombres)}) '
+            f'VALUES {", ".join([marcador] * len(totales))} '
+            f'ON CONFLICT ({", ".join(nombres[:len(claves)])}) DO UPDATE SET {asignaciones}',
+            [
+                campo.get_db_prep_save(valor, connection)
+                for clave, sumas in totales.items()
+                for campo, valor in zip(campos, (*clave, *sumas))
+            ]
+        )
+
+    if borrar_vacias is not None:
+        posicion = columnas.index(borrar_vacias)
+        vacias = Q()
+        for clave, sumas in totales.items():
+            if sumas[posicion] < 0:
+                vacias |= Q(**dict(zip(claves, clave)))
+        if vacias:
+            modelo.objects.filter(vacias, **{f'{borrar_vacias}__lte': 0}).delete()
+
+
+# ============================================
+# SEÑALES
+# ============================================
+
+def _aplicar(agregados, puntos, densidad):
+    """ Escribe en una transacción los cambios de un reporte en el mapa, las teselas y el mapa de calor """
+    from .densidad import sumar_densidad
+    from .mapa import sumar_agregados
+    from .teselas import invalidar_teselas
+
+    with transaction.atomic():
+        sumar_agregados(agregados)
+        invalidar_teselas(puntos)
+        sumar_densidad(densidad)
+
+
+def _programar(agregados, puntos, densidad):
+    """
+    Deja los cambios para cuando se confirme la transacción del reporte:
+    la petición no bloquea las filas compartidas de los contadores y, si
+    la transacción se revierte, no hay nada que deshacer
+    """
+    if agregados or puntos or densidad:
+        transaction.on_commit(lambda: _aplicar(agregados, puntos, densidad))
+
+
+@receiver(post_save, sender='reportes.Reporte')
+def mantener_reporte_guardado(sender, instance, created, raw=False, **kwargs):
+    """ Los valores anteriores del reporte solo se conocen ahora: los cambios se calculan al guardar """
+    from . import densidad, mapa, teselas
+
+    if raw:
+        return
+    _programar(
+        mapa.filas_guardado(instance, created),
+        teselas.puntos_guardado(instance, created),
+        densidad.filas_guardado(instance, created)
+    )
+
+
+@receiver(post_delete, sender='reportes.Reporte')
+def mantener_reporte_eliminado(sender, instance, **kwargs):
+    from . import densidad, mapa, teselas
+
+    _programar(
+        mapa.filas_borrado(instance),
+        teselas.puntos_borrado(instance),
+        densidad.filas_borrado(instance)
+    )
@@ -0,0 +1,379 @@
+"""
+Agrupamiento de marcadores del mapa en el servidor
+Malla jerárquica sobre la proyección web Mercator: cada celda de un zoom
+contiene exactamente cuatro celdas del zoom siguiente, como las teselas
+"""
+
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+
+
+# Hasta este zoom el mapa recibe grupos; desde el siguiente, marcadores
+ZOOM_MAXIMO_AGREGADO = 15
+
+# Lado de la celda en píxeles de pantalla: unas 200 celdas llenan la vista
+PIXELES_CELDA = 64
+
+_LATITUD_MAXIMA = 85.05112878
+
+# Campos de Reporte.CAMPOS_MAPA que cambian la celda o la fila de AgregadoMapa
+CAMPOS_AGREGADO = ('latitud', 'longitud', 'tipo', 'estado_id')
+
+
+def _celdas_maximo_zoom(latitudes, longitudes):
+    """ Índices (cx, cy) de las celdas en ZOOM_MAXIMO_AGREGADO; acepta escalares o arreglos """
+    latitudes = np.clip(np.asarray(latitudes, dtype=np.float64), -_LATITUD_MAXIMA, _LATITUD_MAXIMA)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    tamano_mundo = 256 * 2 ** ZOOM_MAXIMO_AGREGADO
+    x = (longitudes + 180) / 360 * tamano_mundo
+    seno = np.sin(np.radians(latitudes))
+    y = (0.5 - np.log((1 + seno) / (1 - seno)) / (4 * np.pi)) * tamano_mundo
+
+    ultima = tamano_mundo // PIXELES_CELDA - 1
+    cx = np.clip(np.floor(x / PIXELES_CELDA), 0, ultima).astype(np.int64)
+    cy = np.clip(np.floor(y / PIXELES_CELDA), 0, ultima).astype(np.int64)
+    return cx, cy
+
+
+def celda_mapa(latitud, longitud, zoom):
+    """ Celda (cx, cy) de un punto en el zoom indicado """
+    cx, cy = _celdas_maximo_zoom(float(latitud), float(longitud))
+    desplazamiento = ZOOM_MAXIMO_AGREGADO - zoom
+    return int(cx) >> desplazamiento, int(cy) >> desplazamiento
+
+
+# ============================================
+# ACTUALIZACIÓN INCREMENTAL
+# ============================================
+
+def _filas_reporte(valores, signo):
+    """ Filas (zoom, cx, cy, estado, tipo, cantidad, suma_lat, suma_lon) de un reporte """
+    if valores.get('latitud') is None or valores.get('longitud') is None:
+        return []
+    latitud, longitud = float(valores['latitud']), float(valores['longitud'])
+    cx, cy = _celdas_maximo_zoom(latitud, longitud)
+    cx, cy = int(cx), int(cy)
+    return [
+        (
+            zoom, cx >> (ZOOM_MAXIMO_AGREGADO - zoom), cy >> (ZOOM_MAXIMO_AGREGADO - zoom),
+            valores.get('estado_id') or 0, valores['tipo'],
+            signo, signo * latitud, signo * longitud,
+        )
+        for zoom in range(ZOOM_MAXIMO_AGREGADO + 1)
+    ]
+
+
+def sumar_agregados(filas):
+    """ Suma las filas a AgregadoMapa; las celdas que quedan sin reportes se borran """
+    from apps.reportes.models import AgregadoMapa
+    from .mantenimiento import sumar_contadores
+
+    sumar_contadores(
+        AgregadoMapa,
+        ('zoom', 'cx', 'cy', 'estado', 'tipo'),
+        ('cantidad', 'suma_latitud', 'suma_longitud'),
+        filas,
+        borrar_vacias='cantidad'
+    )
+
+
+def filas_guardado(instance, created):
+    """ Filas que suman el reporte nuevo o lo mueven de celda si cambió de lugar, tipo o estado """
+    actuales = instance._valores_campos(instance.CAMPOS_MAPA)
+    if created:
+        return _filas_reporte(actuales, 1)
+
+    anteriores = getattr(instance, '_valores_mapa_anteriores', None)
+    campos = set(instance.CAMPOS_MAPA)
+    if anteriores is None or set(anteriores) != campos or set(actuales) != campos:
+        return []  # No se sabe dónde estaba (campos diferidos); construir_agregados_mapa lo corrige
+    if all(anteriores[campo] == actuales[campo] for campo in CAMPOS_AGREGADO):
+        return []
+
+    return _filas_reporte(anteriores, -1) + _filas_reporte(actuales, 1)
+
+
+def filas_borrado(instance):
+    """ Filas que descuentan el reporte eliminado """
+    return _filas_reporte(instance._valores_campos(instance.CAMPOS_MAPA), -1)
+
+
+# ============================================
+# CONSTRUCCIÓN EN LOTE
+# ============================================
+
+def construir_agregados(tamano_lote=5000):
+    """
+    Recalcula AgregadoMapa desde cero con NumPy: cuenta los reportes
+    ubicados por celda, estado y tipo en cada zoom y reemplaza la tabla en
+    una transacción. Corrige los conteos después de loaddata o de
+    importaciones que no pasan por save(), y hace falta al cambiar
+    PIXELES_CELDA o ZOOM_MAXIMO_AGREGADO. Devuelve la cantidad de filas creadas.
+    """
+    from apps.reportes.models import Reporte, AgregadoMapa
+
+    filas = np.array(
+        list(
+            Reporte.objects.filter(latitud__isnull=False, longitud__isnull=False)
+            .order_by()
+            .values_list('latitud', 'longitud', 'estado_id', 'tipo')
+        ),
+        dtype=object
+    ).reshape(-1, 4)
+
+    with transaction.atomic():
+        AgregadoMapa.objects.all().delete()
+        if not len(filas):
+            return 0
+
+        latitudes = filas[:, 0].astype(np.float64)
+        longitudes = filas[:, 1].astype(np.float64)
+        estados = np.array([estado or 0 for estado in filas[:, 2]], dtype=np.int64)
+        tipos, codigos_tipo = np.unique(filas[:, 3].astype(str), return_inverse=True)
+        cx_max, cy_max = _celdas_maximo_zoom(latitudes, longitudes)
+
+        creados = 0
+        lote = []
+        for zoom in range(ZOOM_MAXIMO_AGREGADO + 1):
+            desplazamiento = ZOOM_MAXIMO_AGREGADO - zoom
+            claves = np.stack([cx_max >> desplazamiento, cy_max >> desplazamiento, estados, codigos_tipo], axis=1)
+            unicas, grupo = np.unique(claves, axis=0, return_inverse=True)
+            grupo = grupo.ravel()
+            cantidades = np.bincount(grupo)
+            sumas_lat = np.bincount(grupo, weights=latitudes)
+            sumas_lon = np.bincount(grupo, weights=longitudes)
+
+            for (cx, cy, estado, tipo), cantidad, suma_lat, suma_lon in zip(
+                unicas.tolist(), cantidades.tolist(), sumas_lat.tolist(), sumas_lon.tolist()
+            ):
+                lote.append(AgregadoMapa(
+                    zoom=zoom, cx=cx, cy=cy, estado=estado, tipo=str(tipos[tipo]),
+                    cantidad=cantidad, suma_latitud=suma_lat, suma_longitud=suma_lon
+                ))
+                if len(lote) >= tamano_lote:
+                    AgregadoMapa.objects.bulk_create(lote)
+                    creados += len(lote)
+                    lote = []
+
+        AgregadoMapa.objects.bulk_create(lote)
+        creados += len(lote)
+    return creados
+
+
+# ============================================
+# CONSULTA
+# ============================================
+
+def _rango_celdas(oeste, sur, este, norte, zoom):
+    cx_min, cy_min = celda_mapa(norte, oeste, zoom)
+    cx_max, cy_max = celda_mapa(sur, este, zoom)
+    return cx_min, cx_max, cy_min, cy_max
+
+
+def _resumir(celdas, nombres_estado):
+    """ Un grupo por celda: total, centro ponderado y estado y tipo más frecuentes """
+    grupos = []
+    for (cx, cy), datos in celdas.items():
+        cantidad = datos['cantidad']
+        if cantidad <= 0:
+            continue
+        estado = datos['estados'].most_common(1)[0][0]
+        grupos.append({
+            'cx': cx,
+            'cy': cy,
+            'cantidad': cantidad,
+            'latitud': datos['suma_latitud'] / cantidad,
+            'longitud': datos['suma_longitud'] / cantidad,
+            'estado': nombres_estado.get(estado, 'Sin estado'),
+            'tipo': datos['tipos'].most_common(1)[0][0],
+        })
+    return grupos
+
+
+def _celda_vacia():
+    return {'cantidad': 0, 'suma_latitud': 0.0, 'suma_longitud': 0.0, 'estados': Counter(), 'tipos': Counter()}
+
+
+def grupos_en_recuadro(oeste, sur, este, norte, zoom, estados=None, tipo=None):
+    """
+    Grupos de marcadores del recuadro leídos de AgregadoMapa.
+    estados es una lista de ids de EstadoReporte (0 = sin estado).
+    """
+    from apps.reportes.models import AgregadoMapa, EstadoReporte
+
+    cx_min, cx_max, cy_min, cy_max = _rango_celdas(oeste, sur, este, norte, zoom)
+    agregados = AgregadoMapa.objects.filter(
+        zoom=zoom, cx__gte=cx_min, cx__lte=cx_max, cy__gte=cy_min, cy__lte=cy_max, cantidad__gt=0
+    )
+    if estados is not None:
+        agregados = agregados.filter(estado__in=estados)
+    if tipo:
+        agregados = agregados.filter(tipo=tipo)
+
+    celdas = defaultdict(_celda_vacia)
+    for cx, cy, estado, tipo_fila, cantidad, suma_lat, suma_lon in agregados.values_list(
+        'cx', 'cy', 'estado', 'tipo', 'cantidad', 'suma_latitud', 'suma_longitud'
+    ):
+        datos = celdas[(cx, cy)]
+        datos['cantidad'] += cantidad
+        datos['suma_latitud'] += suma_lat
+        datos['suma_longitud'] += suma_lon
+        datos['estados'][estado] += cantidad
+        datos['tipos'][tipo_fila] += cantidad
+
+    return _resumir(celdas, dict(EstadoReporte.objects.values_list('id', 'nombre')))
+
+
+def agrupar_reportes(reportes, zoom):
+    """
+    Agrupa en el momento un queryset de reportes con la misma malla.
+    Para filtros que AgregadoMapa no guarda (prioridad, fechas).
+    """
+    from apps.reportes.models import EstadoReporte
+
+    filas = list(reportes.order_by().values_list('latitud', 'longitud', 'estado_id', 'tipo'))
+    celdas = defaultdict(_celda_vacia)
+    if filas:
+        latitudes = np.array([float(fila[0]) for fila in filas])
+        longitudes = np.array([float(fila[1]) for fila in filas])
+        cx, cy = _celdas_maximo_zoom(latitudes, longitudes)
+        desplazamiento = ZOOM_MAXIMO_AGREGADO - zoom
+        for (_, _, estado, tipo), x, y, latitud, longitud in zip(
+            filas, (cx >> desplazamiento).tolist(), (cy >> desplazamiento).tolist(),
+            latitudes.tolist(), longitudes.tolist()
+        ):
+            datos = celdas[(x, y)]
+            datos['cantidad'] += 1
+            datos['suma_latitud'] += latitud
+            datos['suma_longitud'] += longitud
+            datos['estados'][estado or 0] += 1
+            datos['tipos'][tipo] += 1
+
+    return _resumir(celdas, dict(EstadoReporte.objects.values_list('id', 'nombre')))
+
+
+def marcadores_reportes(reportes, limite):
+    """
+    Marcadores de un queryset de reportes como filas (id, latitud, longitud,
+    estado, tipo, prioridad, duplicados): uno por reporte suelto y uno por
+    GrupoDuplicado, con los datos de su reporte principal si pasa los
+    filtros (si no, del más antiguo de los filtrados con coordenadas) y cuántos de sus reportes pasan los
+    filtros. Van primero los grupos más grandes y
+    después los reportes más recientes. Devuelve (filas, truncado).
+    """
+    from apps.reportes.models import GrupoDuplicado
+
+    campos = ('id', 'latitud', 'longitud', 'estado__nombre', 'tipo', 'prioridad__nombre')
+
+    grupos = list(
+        reportes.filter(grupoDuplicado__isnull=False).order_by()
+        .values('grupoDuplicado').annotate(cantidad=Count('id'))
+        .order_by('-cantidad', 'grupoDuplicado').values_list('grupoDuplicado', 'cantidad')
+        [:limite + 1]
+    )
+    truncado = len(grupos) > limite
+    cantidades = dict(grupos[:limite])
+
+    # El reporte principal representa al grupo si también pasa los filtros
+    principales = dict(
+        GrupoDuplicado.objects.filter(id__in=cantidades, reporte_principal__isnull=False)
+        .values_list('reporte_principal_id', 'id')
+    )
+    representantes = {
+        principales[fila[0]]: fila
+        for fila in reportes.filter(id__in=principales, latitud__isnull=False, longitud__isnull=False)
+        .order_by().values_list(*campos)
+    }
+    # Si aún no tiene principal, o el principal no pasa los filtros o no tiene
+    # coordenadas (el grupo se formó por foto o por texto), el más antiguo de
+    # los filtrados que sí tenga
+    faltantes = [grupo for grupo in cantidades if grupo not in representantes]
+    if faltantes:
+        for fila in (
+            reportes.filter(grupoDuplicado__in=faltantes, latitud__isnull=False, longitud__isnull=False)
+            .order_by('grupoDuplicado', 'reportado_en', 'id').values_list(*campos, 'grupoDuplicado_id')
+        ):
+            representantes.setdefault(fila[-1], fila[:-1])
+    filas = sorted(
+        ((*fila, cantidades[grupo]) for grupo, fila in representantes.items()),
+        key=lambda fila: (-fila[-1], fila[0])
+    )
+
+    restantes = limite - len(filas)
+    sueltos = list(
+        reportes.filter(grupoDuplicado__isnull=True).order_by('-reportado_en').values_list(*campos)[:restantes + 1]
+    )
+    truncado = truncado or len(sueltos) > restantes
+    filas += [(*fila, 1) for fila in sueltos[:restantes]]
+
+    return [
+        (reporte_id, latitud, longitud, estado or 'Sin estado', tipo, prioridad or 'Sin prioridad', duplicados)
+        for reporte_id, latitud, longitud, estado, tipo, prioridad, duplicados in filas
+    ], truncado
+
+
+# ============================================
+# FORMATO BINARIO
+# ============================================
+
+# Marcadores en columnas, little-endian, que el navegador lee con DataView y
+# arreglos tipados sin pasar por JSON:
+#   'MRB2', uint8 banderas (1 = truncado), 3 bytes de relleno, uint32 n
+#   tres diccionarios (estados, tipos, prioridades): uint8 cantidad y por
+#   cada texto uint8 longitud + UTF-8; relleno hasta múltiplo de 4
+#   uint32 ids[n], float32 latitudes[n], float32 longitudes[n]
+#   uint16 duplicados[n] (reportes del grupo; 1 = reporte suelto)
+#   uint8 estados[n], uint8 tipos[n], uint8 prioridades[n]
+MAGIA_BINARIO = b'MRB2'
+TIPO_BINARIO = 'application/octet-stream'
+TRUNCADO_BINARIO = 1
+
+
+def _diccionario(textos):
+    """ Códigos uint8 de cada texto y la tabla codificada; None si no caben """
+    unicos = sorted(set(textos))
+    if len(unicos) > 255:
+        return None, None
+    codigos = {texto: codigo for codigo, texto in enumerate(unicos)}
+    tabla = bytearray([len(unicos)])
+    for texto in unicos:
+        datos = texto.encode('utf-8')[:255]
+        tabla.append(len(datos))
+        tabla += datos
+    return np.array([codigos[texto] for texto in textos], dtype=np.uint8), bytes(tabla)
+
+
+def empaquetar_marcadores(filas, truncado=False):
+    """
+    Empaqueta filas (id, latitud, longitud, estado, tipo, prioridad,
+    duplicados) en el formato binario. Devuelve None si algún catálogo pasa de 255 valores;
+    en ese caso se responde en GeoJSON.
+    """
+    columnas = list(zip(*filas)) or [()] * 7
+    ids, latitudes, longitudes, estados, tipos, prioridades, duplicados = columnas
+
+    encabezado = bytearray(MAGIA_BINARIO)
+    encabezado += bytes([TRUNCADO_BINARIO if truncado else 0, 0, 0, 0])
+    encabezado += np.array([len(filas)], dtype='<u4').tobytes()
+
+    codigos = []
+    for textos in (estados, tipos, prioridades):
+        codigo, tabla = _diccionario(textos)
+        if codigo is None:
+            return None
+        codigos.append(codigo)
+        encabezado += tabla
+    encabezado += bytes(-len(encabezado) % 4)
+
+    return b''.join([
+        bytes(encabezado),
+        np.array(ids, dtype='<u4').tobytes(),
+        np.array(latitudes, dtype=np.float64).astype('<f4').tobytes(),
+        np.array(longitudes, dtype=np.float64).astype('<f4').tobytes(),
+        np.minimum(np.array(duplicados, dtype=np.int64), 0xFFFF).astype('<u2').tobytes(),
+        *(codigo.tobytes() for codigo in codigos),
+    ])
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+from apps.reportes.espacial import calcular_celda
+
+
+def calcular_celdas_existentes(apps, schema_editor):
+    Reporte = apps.get_model('reportes', 'Reporte')
+    reportes = Reporte.objects.filter(
+        latitud__isnull=False,
+        longitud__isnull=False
+    ).only('id', 'latitud', 'longitud')
+
+    lote = []
+    for reporte in reportes.iterator(chunk_size=2000):
+        reporte.celda = calcular_celda(reporte.latitud, reporte.longitud)
+        lote.append(reporte)
+        if len(lote) >= 2000:
+            Reporte.objects.bulk_update(lote, ['celda'])
+            lote = []
+    if lote:
+        Reporte.objects.bulk_update(lote, ['celda'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0002_evidencia_es_evidencia_reparacion_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reporte',
+            name='celda',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(calcular_celdas_existentes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reporte',
+            index=models.Index(fields=['celda', 'tipo', 'reportado_en'], name='reportes_re_celda_75f361_idx'),
+        ),
+    ]
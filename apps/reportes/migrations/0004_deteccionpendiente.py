@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0003_reporte_celda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeteccionPendiente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('encolado_en', models.DateTimeField(auto_now_add=True)),
+                ('reporte', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='deteccion_pendiente', to='reportes.reporte')),
+            ],
+            options={
+                'verbose_name': 'Detección Pendiente',
+                'verbose_name_plural': 'Detecciones Pendientes',
+                'ordering': ['encolado_en'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0004_deteccionpendiente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuntoControlDeteccion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('ultimo_reportado_en', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Punto de Control de Detección',
+                'verbose_name_plural': 'Puntos de Control de Detección',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reporte',
+            index=models.Index(fields=['reportado_en', 'id'], name='reportes_re_reporta_c37dd4_idx'),
+        ),
+    ]
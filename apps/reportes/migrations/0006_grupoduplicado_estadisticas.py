@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def calcular_estadisticas_grupos(apps, schema_editor):
+    from django.db.models import Count, Min, Max
+
+    GrupoDuplicado = apps.get_model('reportes', 'GrupoDuplicado')
+    Evidencia = apps.get_model('reportes', 'Evidencia')
+
+    for grupo in GrupoDuplicado.objects.all().iterator():
+        reportes = grupo.reportes.order_by('reportado_en', 'id')
+        datos = reportes.aggregate(
+            total=Count('id'),
+            usuarios=Count('usuario', distinct=True),
+            primero=Min('reportado_en'),
+            ultimo=Max('reportado_en'),
+        )
+        grupo.reporte_principal = reportes.first()
+        grupo.total_reportes = datos['total']
+        grupo.total_usuarios = datos['usuarios']
+        grupo.fecha_primer_reporte = datos['primero']
+        grupo.fecha_ultimo_reporte = datos['ultimo']
+        grupo.total_evidencias = Evidencia.objects.filter(reporte__grupoDuplicado=grupo).count()
+        grupo.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0005_puntocontroldeteccion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grupoduplicado',
+            name='fecha_primer_reporte',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='grupoduplicado',
+            name='fecha_ultimo_reporte',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='grupoduplicado',
+            name='reporte_principal',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='reportes.reporte'),
+        ),
+        migrations.AddField(
+            model_name='grupoduplicado',
+            name='total_evidencias',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='grupoduplicado',
+            name='total_reportes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='grupoduplicado',
+            name='total_usuarios',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(calcular_estadisticas_grupos, migrations.RunPython.noop),
+    ]
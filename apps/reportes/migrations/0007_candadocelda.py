@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0006_grupoduplicado_estadisticas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandadoCelda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('celda', models.BigIntegerField(unique=True)),
+            ],
+            options={
+                'verbose_name': 'Candado de Celda',
+                'verbose_name_plural': 'Candados de Celdas',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0007_candadocelda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidencia',
+            name='hash_perceptual',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0008_evidencia_hash_perceptual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reporte',
+            name='firma_texto',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='BandaTexto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('banda', models.PositiveSmallIntegerField()),
+                ('cubeta', models.BigIntegerField()),
+                ('reporte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bandas_texto', to='reportes.reporte')),
+            ],
+            options={
+                'verbose_name': 'Banda de Texto',
+                'verbose_name_plural': 'Bandas de Texto',
+                'indexes': [models.Index(fields=['banda', 'cubeta'], name='reportes_ba_banda_f766c8_idx')],
+                'constraints': [models.UniqueConstraint(fields=('reporte', 'banda'), name='banda_texto_unica_por_reporte')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-17 11:05
+
+from django.db import migrations
+
+from apps.reportes.espacial import TABLA_RTREE
+
+
+# Los triggers mantienen el R*Tree al día también con bulk_create,
+# bulk_update y QuerySet.update, que no disparan señales
+SQL_CREAR = [
+    f'''
+    CREATE VIRTUAL TABLE {TABLA_RTREE} USING rtree(
+        id, min_lat, max_lat, min_lon, max_lon
+    )
+    ''',
+    f'''
+    INSERT INTO {TABLA_RTREE}
+    SELECT id, latitud, latitud, longitud, longitud
+    FROM reportes_reporte
+    WHERE latitud IS NOT NULL AND longitud IS NOT NULL
+    ''',
+    f'''
+    CREATE TRIGGER reportes_reporte_rtree_insertar
+    AFTER INSERT ON reportes_reporte
+    WHEN NEW.latitud IS NOT NULL AND NEW.longitud IS NOT NULL
+    BEGIN
+        INSERT INTO {TABLA_RTREE} VALUES (NEW.id, NEW.latitud, NEW.latitud, NEW.longitud, NEW.longitud);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER reportes_reporte_rtree_actualizar
+    AFTER UPDATE OF latitud, longitud ON reportes_reporte
+    BEGIN
+        DELETE FROM {TABLA_RTREE} WHERE id = OLD.id;
+        INSERT INTO {TABLA_RTREE}
+        SELECT NEW.id, NEW.latitud, NEW.latitud, NEW.longitud, NEW.longitud
+        WHERE NEW.latitud IS NOT NULL AND NEW.longitud IS NOT NULL;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER reportes_reporte_rtree_borrar
+    AFTER DELETE ON reportes_reporte
+    BEGIN
+        DELETE FROM {TABLA_RTREE} WHERE id = OLD.id;
+    END
+    ''',
+]
+
+SQL_ELIMINAR = [
+    'DROP TRIGGER IF EXISTS reportes_reporte_rtree_insertar',
+    'DROP TRIGGER IF EXISTS reportes_reporte_rtree_actualizar',
+    'DROP TRIGGER IF EXISTS reportes_reporte_rtree_borrar',
+    f'DROP TABLE IF EXISTS {TABLA_RTREE}',
+]
+
+
+def crear_rtree(apps, schema_editor):
+    # Solo SQLite trae el módulo R*Tree; en otros motores se usa el índice (latitud, longitud)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQL_CREAR:
+        schema_editor.execute(sql)
+
+
+def eliminar_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQL_ELIMINAR:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0009_textos_lsh'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_rtree, eliminar_rtree),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0010_reporte_rtree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgregadoMapa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('cx', models.IntegerField()),
+                ('cy', models.IntegerField()),
+                ('estado', models.PositiveIntegerField(default=0)),
+                ('tipo', models.CharField(max_length=30)),
+                ('cantidad', models.IntegerField(default=0)),
+                ('suma_latitud', models.FloatField(default=0)),
+                ('suma_longitud', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Agregado del Mapa',
+                'verbose_name_plural': 'Agregados del Mapa',
+                'constraints': [models.UniqueConstraint(fields=('zoom', 'cx', 'cy', 'estado', 'tipo'), name='agregado_mapa_unico')],
+            },
+        ),
+    ]
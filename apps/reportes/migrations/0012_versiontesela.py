@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0011_agregadomapa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionTesela',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('z', models.PositiveSmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Versión de Tesela',
+                'verbose_name_plural': 'Versiones de Teselas',
+                'constraints': [models.UniqueConstraint(fields=('z', 'x', 'y'), name='version_tesela_unica')],
+            },
+        ),
+    ]
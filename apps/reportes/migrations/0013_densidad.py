@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0012_versiontesela'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapaDensidad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('mes', models.DateField()),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Capa de Densidad',
+                'verbose_name_plural': 'Capas de Densidad',
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'mes'), name='capa_densidad_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CeldaDensidad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('mes', models.DateField()),
+                ('fila', models.PositiveSmallIntegerField()),
+                ('columna', models.PositiveSmallIntegerField()),
+                ('cantidad', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Celda de Densidad',
+                'verbose_name_plural': 'Celdas de Densidad',
+                'indexes': [models.Index(fields=['mes'], name='reportes_ce_mes_7d10ad_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'mes', 'fila', 'columna'), name='celda_densidad_unica')],
+            },
+        ),
+    ]
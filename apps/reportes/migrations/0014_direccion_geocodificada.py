@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0013_densidad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DireccionGeocodificada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tamano_celda', models.PositiveSmallIntegerField(help_text='Lado de la celda en metros')),
+                ('celda_latitud', models.IntegerField()),
+                ('celda_longitud', models.IntegerField()),
+                ('direccion', models.CharField(blank=True, max_length=255)),
+                ('proveedor', models.CharField(max_length=50)),
+                ('consultado_en', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Dirección Geocodificada',
+                'verbose_name_plural': 'Direcciones Geocodificadas',
+                'constraints': [models.UniqueConstraint(fields=('tamano_celda', 'celda_latitud', 'celda_longitud'), name='direccion_geocodificada_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0014_direccion_geocodificada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reporte',
+            name='confianza_ubicacion',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
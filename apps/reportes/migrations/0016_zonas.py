@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-17 11:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0015_reporte_confianza_ubicacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Zona',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=150)),
+                ('nivel', models.CharField(choices=[('localidad', 'Localidad'), ('barrio', 'Barrio')], max_length=10)),
+                ('poligonos', models.JSONField()),
+                ('oeste', models.FloatField()),
+                ('sur', models.FloatField()),
+                ('este', models.FloatField()),
+                ('norte', models.FloatField()),
+                ('actualizada_en', models.DateTimeField(auto_now=True)),
+                ('padre', models.ForeignKey(blank=True, help_text='Localidad de un barrio', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='barrios', to='reportes.zona')),
+            ],
+            options={
+                'verbose_name': 'Zona',
+                'verbose_name_plural': 'Zonas',
+                'ordering': ['nivel', 'nombre'],
+            },
+        ),
+        migrations.AddField(
+            model_name='reporte',
+            name='barrio',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reportes_barrio', to='reportes.zona'),
+        ),
+        migrations.AddField(
+            model_name='reporte',
+            name='localidad',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reportes_localidad', to='reportes.zona'),
+        ),
+        migrations.AddConstraint(
+            model_name='zona',
+            constraint=models.UniqueConstraint(fields=('nivel', 'nombre'), name='zona_unica'),
+        ),
+    ]
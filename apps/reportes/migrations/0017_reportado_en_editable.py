@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 11:34
+
+import importlib
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# En SQLite AlterField recrea la tabla de reportes y se pierden los
+# triggers del R*Tree: se vuelven a crear, con el índice completo
+rtree = importlib.import_module('apps.reportes.migrations.0010_reporte_rtree')
+
+
+def recrear_rtree(apps, schema_editor):
+    rtree.eliminar_rtree(apps, schema_editor)
+    rtree.crear_rtree(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0016_zonas'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, recrear_rtree),
+        migrations.AlterField(
+            model_name='reporte',
+            name='reportado_en',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(recrear_rtree, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0017_reportado_en_editable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidencia',
+            name='hash_fallido',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,5 +1,8 @@
+from decimal import Decimal
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+from .espacial import calcular_celda
 
 
 # ============================================
@@ -34,10 +37,27 @@ class EstadoReporte(models.Model):
 
 
 class GrupoDuplicado(models.Model):
-    """Agrupa reportes duplicados"""
+    """
+    Agrupa reportes duplicados.
+    Las estadísticas se guardan desnormalizadas y las mantiene DetectorDuplicados.
+    """
     fechaDeteccion = models.DateTimeField(auto_now_add=True)
     razon = models.TextField()
 
+    # Estadísticas del grupo
+    reporte_principal = models.ForeignKey(
+        'Reporte',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    total_reportes = models.PositiveIntegerField(default=0)
+    total_usuarios = models.PositiveIntegerField(default=0)
+    total_evidencias = models.PositiveIntegerField(default=0)
+    fecha_primer_reporte = models.DateTimeField(null=True, blank=True)
+    fecha_ultimo_reporte = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         verbose_name = "Grupo Duplicado"
         verbose_name_plural = "Grupos Duplicados"
@@ -116,11 +136,39 @@ class Reporte(models.Model):
     )
     direccion = models.CharField(max_length=255, blank=True)
 
+    # Confianza (0 a 1) de coordenadas estimadas desde la dirección; None si vienen del GPS o del mapa
+    confianza_ubicacion = models.FloatField(null=True, blank=True, editable=False)
+
+    # Celda de la malla espacial (se calcula al guardar)
+    celda = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    # Zonas que contienen el punto (se calculan al guardar; ver zonas.py)
+    localidad = models.ForeignKey(
+        'Zona',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='reportes_localidad'
+    )
+    barrio = models.ForeignKey(
+        'Zona',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='reportes_barrio'
+    )
+
+    # Firma MinHash de título, descripción y dirección (ver texto.py)
+    firma_texto = models.BinaryField(null=True, blank=True, editable=False)
+
     # Control de duplicados
     duplicado = models.BooleanField(default=False)
 
     # Timestamps
-    reportado_en = models.DateTimeField(auto_now_add=True)
+    # Por defecto la hora de creación; las cargas históricas y el simulador la indican
+    reportado_en = models.DateTimeField(default=timezone.now, editable=False)
     actualizado_en = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -130,11 +178,76 @@ class Reporte(models.Model):
         indexes = [
             models.Index(fields=['estado', 'prioridad']),
             models.Index(fields=['latitud', 'longitud']),
+            models.Index(fields=['celda', 'tipo', 'reportado_en']),
+            models.Index(fields=['reportado_en', 'id']),
         ]
 
+    # Campos que determinan con qué reportes se agrupa un reporte
+    CAMPOS_AGRUPAMIENTO = ('latitud', 'longitud', 'tipo')
+
+    # Campos que determinan cómo se dibuja un reporte en el mapa (AgregadoMapa y teselas)
+    CAMPOS_MAPA = ('latitud', 'longitud', 'tipo', 'estado_id', 'prioridad_id')
+
     def __str__(self):
         return f"#{self.id} - {self.titulo}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._valores_originales = instancia._valores_agrupamiento()
+        instancia._valores_mapa = instancia._valores_campos(cls.CAMPOS_MAPA)
+        return instancia
+
+    def _valores_agrupamiento(self):
+        return self._valores_campos(self.CAMPOS_AGRUPAMIENTO)
+
+    def _valores_campos(self, campos):
+        valores = {}
+        for campo in campos:
+            if campo not in self.__dict__:
+                continue  # Campo diferido, no se cargó
+            valor = self.__dict__[campo]
+            if campo in ('latitud', 'longitud') and valor is not None:
+                valor = Decimal(str(valor))
+            valores[campo] = valor
+        return valores
+
+    def campos_agrupamiento_modificados(self):
+        """ Campos de CAMPOS_AGRUPAMIENTO que cambiaron desde que se cargó el reporte """
+        originales = getattr(self, '_valores_originales', {})
+        actuales = self._valores_agrupamiento()
+        return {
+            campo for campo, valor in originales.items()
+            if campo in actuales and actuales[campo] != valor
+        }
+
+    def save(self, *args, **kwargs):
+        modificados = self.campos_agrupamiento_modificados() if self.pk else set()
+
+        # Mantener la celda espacial sincronizada con las coordenadas
+        self.celda = calcular_celda(self.latitud, self.longitud)
+
+        # Localidad y barrio: solo al crear el reporte o cambiar sus coordenadas
+        if self.pk is None or {'latitud', 'longitud'} & modificados:
+            from .zonas import zonas_de
+            self.localidad_id, self.barrio_id = zonas_de(self.latitud, self.longitud)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitud', 'longitud'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'celda', 'localidad', 'barrio'}
+
+        # Las señales post_save usan esto para reagrupar el reporte y moverlo en el mapa.
+        # El grupo se lee de la base: la cola pudo agrupar el reporte después de cargarlo
+        self._campos_modificados = modificados
+        self._grupo_anterior = (
+            Reporte.objects.filter(pk=self.pk).values_list('grupoDuplicado_id', flat=True).first()
+            if modificados else self.grupoDuplicado_id
+        )
+        self._valores_mapa_anteriores = getattr(self, '_valores_mapa', None) if self.pk else None
+        super().save(*args, **kwargs)
+        self._valores_originales = self._valores_agrupamiento()
+        self._valores_mapa = self._valores_campos(self.CAMPOS_MAPA)
+
     def crear(self):
         """Método del diagrama de clases"""
         self.save()
@@ -198,6 +311,11 @@ class Evidencia(models.Model):
         related_name='evidencias_subidas'
     )
     es_evidencia_reparacion = models.BooleanField(default=False)
+
+    # dHash de 64 bits de las fotos, calculado al procesar la detección
+    hash_perceptual = models.BigIntegerField(null=True, blank=True, editable=False)
+    # El archivo falta o no es una imagen legible: no se vuelve a intentar
+    hash_fallido = models.BooleanField(default=False, editable=False)
     
     fechaSubida = models.DateTimeField(auto_now_add=True)
 
@@ -291,6 +409,296 @@ class HistorialReporte(models.Model):
         return f"{self.accion} - {self.fecha_accion.strftime('%d/%m/%Y %H:%M')}"
 
 
+# ============================================
+# DETECCIÓN DE DUPLICADOS
+# ============================================
+
+class DeteccionPendiente(models.Model):
+    """
+    Cola de reportes en espera de detección de duplicados.
+    La vacía el comando procesar_detecciones por lotes.
+    """
+
+    reporte = models.OneToOneField(
+        Reporte,
+        on_delete=models.CASCADE,
+        related_name='deteccion_pendiente'
+    )
+    encolado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Detección Pendiente"
+        verbose_name_plural = "Detecciones Pendientes"
+        ordering = ['encolado_en']
+
+    def __str__(self):
+        return f"Reporte #{self.reporte_id} (encolado {self.encolado_en.strftime('%d/%m/%Y %H:%M')})"
+
+
+class PuntoControlDeteccion(models.Model):
+    """
+    Marca de agua de las ejecuciones incrementales de detectar_duplicados:
+    último reporte (reportado_en, id) ya procesado.
+    """
+
+    nombre = models.CharField(max_length=100, unique=True)
+    ultimo_reportado_en = models.DateTimeField(null=True, blank=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Punto de Control de Detección"
+        verbose_name_plural = "Puntos de Control de Detección"
+
+    def __str__(self):
+        return f"{self.nombre} → #{self.ultimo_id}"
+
+
+class CandadoCelda(models.Model):
+    """
+    Fila de bloqueo por celda de la malla espacial. La detección bloquea
+    las celdas vecinas de un reporte antes de buscar candidatos, así que
+    dos reportes cercanos se agrupan uno después del otro mientras que los
+    de zonas distintas de la ciudad se procesan en paralelo. En SQLite, sin
+    bloqueo de filas, todas las detecciones se serializan.
+    """
+
+    celda = models.BigIntegerField(unique=True)
+
+    class Meta:
+        verbose_name = "Candado de Celda"
+        verbose_name_plural = "Candados de Celdas"
+
+    def __str__(self):
+        return f"Celda {self.celda}"
+
+
+class BandaTexto(models.Model):
+    """
+    Bandas LSH de la firma de texto de un reporte. Dos reportes que
+    comparten (banda, cubeta) son candidatos a tener texto parecido.
+    """
+
+    reporte = models.ForeignKey(
+        Reporte,
+        on_delete=models.CASCADE,
+        related_name='bandas_texto'
+    )
+    banda = models.PositiveSmallIntegerField()
+    cubeta = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = "Banda de Texto"
+        verbose_name_plural = "Bandas de Texto"
+        constraints = [
+            models.UniqueConstraint(fields=['reporte', 'banda'], name='banda_texto_unica_por_reporte'),
+        ]
+        indexes = [
+            models.Index(fields=['banda', 'cubeta']),
+        ]
+
+    def __str__(self):
+        return f"Reporte #{self.reporte_id} banda {self.banda}"
+
+
+# ============================================
+# MAPA
+# ============================================
+
+class AgregadoMapa(models.Model):
+    """
+    Conteo de reportes por celda de la malla del mapa (ver mapa.py), por
+    nivel de zoom, estado y tipo. Con las sumas de coordenadas se ubica el
+    centro de cada grupo de marcadores sin leer los reportes.
+    """
+
+    zoom = models.PositiveSmallIntegerField()
+    cx = models.IntegerField()
+    cy = models.IntegerField()
+    # Id de EstadoReporte, 0 si el reporte no tiene estado (un NULL no
+    # chocaría con la restricción única y rompería el upsert)
+    estado = models.PositiveIntegerField(default=0)
+    tipo = models.CharField(max_length=30)
+
+    cantidad = models.IntegerField(default=0)
+    suma_latitud = models.FloatField(default=0)
+    suma_longitud = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Agregado del Mapa"
+        verbose_name_plural = "Agregados del Mapa"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['zoom', 'cx', 'cy', 'estado', 'tipo'],
+                name='agregado_mapa_unico'
+            ),
+        ]
+
+    def __str__(self):
+        return f"z{self.zoom} ({self.cx}, {self.cy}) {self.tipo}: {self.cantidad}"
+
+
+class VersionTesela(models.Model):
+    """
+    Versión de los datos de una tesela vectorial (ver teselas.py). Crear,
+    mover o cambiar un reporte sube la versión solo de las teselas donde
+    aparece; la caché en disco y el ETag usan la versión como clave.
+    Las teselas sin fila están en la versión 0.
+    """
+
+    z = models.PositiveSmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Versión de Tesela"
+        verbose_name_plural = "Versiones de Teselas"
+        constraints = [
+            models.UniqueConstraint(fields=['z', 'x', 'y'], name='version_tesela_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.z}/{self.x}/{self.y} v{self.version}"
+
+
+class CeldaDensidad(models.Model):
+    """
+    Reportes por celda de la malla fija de la ciudad (ver densidad.py),
+    por tipo de falla y mes. Es la capa del mapa de calor guardada como
+    arreglo disperso: solo existen las celdas con reportes.
+    """
+
+    tipo = models.CharField(max_length=30)
+    # Primer día del mes en que se reportó (hora de Colombia)
+    mes = models.DateField()
+    fila = models.PositiveSmallIntegerField()
+    columna = models.PositiveSmallIntegerField()
+    cantidad = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Celda de Densidad"
+        verbose_name_plural = "Celdas de Densidad"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tipo', 'mes', 'fila', 'columna'],
+                name='celda_densidad_unica'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['mes']),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} {self.mes:%Y-%m} ({self.fila}, {self.columna}): {self.cantidad}"
+
+
+class CapaDensidad(models.Model):
+    """
+    Versión de una capa (tipo, mes) del mapa de calor. Sube con cada
+    cambio en sus celdas y nunca se borra, así que la lista de versiones
+    de las capas elegidas identifica la imagen que se guarda en caché.
+    """
+
+    tipo = models.CharField(max_length=30)
+    mes = models.DateField()
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Capa de Densidad"
+        verbose_name_plural = "Capas de Densidad"
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'mes'], name='capa_densidad_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} {self.mes:%Y-%m} v{self.version}"
+
+
+# ============================================
+# GEOCODIFICACIÓN
+# ============================================
+
+class DireccionGeocodificada(models.Model):
+    """
+    Dirección de una celda de unos metros de lado (ver geocodificacion.py).
+    Todos los puntos de la celda comparten la dirección de su centro, así
+    que los reportes cercanos no vuelven a consultar al proveedor.
+    Una dirección vacía es una respuesta negativa (el proveedor no conoce
+    el lugar) y vence antes que las positivas.
+    """
+
+    tamano_celda = models.PositiveSmallIntegerField(help_text="Lado de la celda en metros")
+    celda_latitud = models.IntegerField()
+    celda_longitud = models.IntegerField()
+
+    direccion = models.CharField(max_length=255, blank=True)
+    proveedor = models.CharField(max_length=50)
+    consultado_en = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Dirección Geocodificada"
+        verbose_name_plural = "Direcciones Geocodificadas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tamano_celda', 'celda_latitud', 'celda_longitud'],
+                name='direccion_geocodificada_unica'
+            ),
+        ]
+
+    def __str__(self):
+        return f"({self.celda_latitud}, {self.celda_longitud}) {self.direccion or '(sin dirección)'}"
+
+
+# ============================================
+# ZONAS
+# ============================================
+
+class Zona(models.Model):
+    """
+    Localidad o barrio de la ciudad, importado desde GeoJSON con el comando
+    importar_zonas. Cada reporte guarda la localidad y el barrio que lo
+    contienen (ver zonas.py), así que filtrar y contar por zona no requiere
+    geometría en la consulta.
+    """
+
+    NIVELES = (
+        ('localidad', 'Localidad'),
+        ('barrio', 'Barrio'),
+    )
+
+    nombre = models.CharField(max_length=150)
+    nivel = models.CharField(max_length=10, choices=NIVELES)
+    padre = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='barrios',
+        help_text="Localidad de un barrio"
+    )
+
+    # Coordenadas de un MultiPolygon GeoJSON (lon, lat) y su recuadro
+    poligonos = models.JSONField()
+    oeste = models.FloatField()
+    sur = models.FloatField()
+    este = models.FloatField()
+    norte = models.FloatField()
+
+    actualizada_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Zona"
+        verbose_name_plural = "Zonas"
+        ordering = ['nivel', 'nombre']
+        constraints = [
+            models.UniqueConstraint(fields=['nivel', 'nombre'], name='zona_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_nivel_display()} {self.nombre}"
+
+
 # ============================================
 # NOTIFICACIONES
 # ============================================
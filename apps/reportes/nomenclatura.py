@@ -0,0 +1,251 @@
+"""
+Geocodificación directa de direcciones colombianas
+Lee la nomenclatura urbana (Calle 72 # 43-85, Carrera 46 con Calle 72,
+Diagonal, Transversal) y la ubica con un modelo de la malla vial ajustado
+con puntos de control. No usa Django, así que corre en procesos aparte.
+"""
+
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+
+
+# Metros entre dos vías consecutivas; la placa "-85" está a 85 m de la esquina
+LARGO_CUADRA_M = 100
+
+# Las vías de cada tipo corren en el sentido de una calle o de una carrera
+TIPOS_VIA = {
+    'CALLE': 'calle', 'CALL': 'calle', 'CLLE': 'calle', 'CLL': 'calle', 'CL': 'calle',
+    'CARRERA': 'carrera', 'CARR': 'carrera', 'CRA': 'carrera', 'KRA': 'carrera', 'CRR': 'carrera',
+    'CR': 'carrera', 'KR': 'carrera', 'K': 'carrera',
+    'DIAGONAL': 'diagonal', 'DIAG': 'diagonal', 'DG': 'diagonal',
+    'TRANSVERSAL': 'transversal', 'TRANSV': 'transversal', 'TRANS': 'transversal', 'TV': 'transversal',
+    'TR': 'transversal',
+}
+SENTIDO = {'calle': 'calle', 'diagonal': 'calle', 'carrera': 'carrera', 'transversal': 'carrera'}
+
+_TIPO = r'\b(?:AV(?:ENIDA)?\.?\s+)?(?P<{0}>' + '|'.join(sorted(TIPOS_VIA, key=len, reverse=True)) + r')\.?'
+_NUMERO = r'(?P<{0}>\d{{1,3}})\s*(?P<{0}_letra>[A-H](?![A-Z]))?\s*(?P<{0}_bis>BIS)?'
+_PLACA = (
+    _TIPO.format('via') + r'\s*' + _NUMERO.format('numero') + r'(?:\s*(?P<cuadrante>SUR|NORTE|ESTE)\b)?'
+    r'\s*(?:#|NO\.?|N\.?|NRO\.?|NUM(?:ERO)?\.?)?\s*'
+    + _NUMERO.format('cruce') + r'(?:\s*[-–]\s*(?P<placa>\d{1,3}))?\b'
+)
+_ESQUINA = (
+    _TIPO.format('via') + r'\s*' + _NUMERO.format('numero')
+    + r'\s*(?:CON|Y|X|&)\s*' + _TIPO.format('via_cruce') + r'\s*' + _NUMERO.format('cruce') + r'\b'
+)
+EXPRESION_PLACA = re.compile(_PLACA)
+EXPRESION_ESQUINA = re.compile(_ESQUINA)
+
+
+@dataclass(frozen=True)
+class DireccionColombiana:
+    """
+    Dirección leída. numero es la vía donde queda el predio y cruce la
+    vía transversal de referencia, ya como números de la malla (la letra
+    B suma media cuadra); placa son los metros desde la esquina, None en
+    una esquina.
+    """
+
+    via: str
+    numero: float
+    cruce: float
+    placa: int = None
+    con_letra: bool = False
+
+
+def _normalizar(texto):
+    texto = texto.replace('Nº', '#').replace('N°', '#').replace('No.', '#')
+    sin_tildes = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'\s+', ' ', sin_tildes.upper()).strip()
+
+
+def _numero(coincidencia, grupo):
+    """ 72 → 72; 72B → 72.5 (A, B, C... reparten la cuadra); 72 BIS → 72.1 """
+    valor = float(coincidencia.group(grupo))
+    letra = coincidencia.group(f'{grupo}_letra')
+    if letra:
+        valor += (ord(letra) - ord('A') + 1) * 0.25
+    if coincidencia.group(f'{grupo}_bis'):
+        valor += 0.1
+    return min(valor, float(coincidencia.group(grupo)) + 0.9)
+
+
+def leer_direccion(texto):
+    """
+    DireccionColombiana de un texto libre, o None si no sigue la nomenclatura
+    o es de otro cuadrante (Calle 72 Sur): la malla vial solo numera hacia un lado
+    """
+    if not texto:
+        return None
+    normalizado = _normalizar(texto)
+
+    esquina = EXPRESION_ESQUINA.search(normalizado)
+    if esquina:
+        via = TIPOS_VIA[esquina.group('via')]
+        cruce = TIPOS_VIA[esquina.group('via_cruce')]
+        if SENTIDO[via] == SENTIDO[cruce]:
+            return None  # Dos vías paralelas no se cruzan
+        return DireccionColombiana(
+            via=via, numero=_numero(esquina, 'numero'), cruce=_numero(esquina, 'cruce'),
+            con_letra=bool(esquina.group('numero_letra') or esquina.group('cruce_letra')),
+        )
+
+    placa = EXPRESION_PLACA.search(normalizado)
+    if placa and not placa.group('cuadrante'):
+        return DireccionColombiana(
+            via=TIPOS_VIA[placa.group('via')],
+            numero=_numero(placa, 'numero'),
+            cruce=_numero(placa, 'cruce'),
+            placa=int(placa.group('placa')) if placa.group('placa') else None,
+            con_letra=bool(placa.group('numero_letra') or placa.group('cruce_letra')),
+        )
+    return None
+
+
+def numeros_malla(direccion):
+    """ (calle, carrera) del predio en números de la malla, con la placa interpolada """
+    avance = min(direccion.placa, LARGO_CUADRA_M - 1) / LARGO_CUADRA_M if direccion.placa else 0
+    if SENTIDO[direccion.via] == 'calle':
+        return direccion.numero, direccion.cruce + avance
+    return direccion.cruce + avance, direccion.numero
+
+
+# ============================================
+# MODELO DE LA MALLA VIAL
+# ============================================
+
+def _terminos(calle, carrera, grado):
+    if grado == 1:
+        return [1.0, calle, carrera]
+    return [1.0, calle, carrera, calle * calle, calle * carrera, carrera * carrera]
+
+
+@dataclass(frozen=True)
+class MallaVial:
+    """
+    Polinomio (grado 1 o 2) de (calle, carrera) a (latitud, longitud).
+    error_m es el error cuadrático medio en los puntos de control y los
+    rangos son los números de calle y carrera que cubren.
+    """
+
+    grado: int
+    coeficientes_latitud: tuple
+    coeficientes_longitud: tuple
+    error_m: float
+    rango_calle: tuple
+    rango_carrera: tuple
+    puntos: int
+
+    def ubicar(self, calle, carrera):
+        terminos = _terminos(calle, carrera, self.grado)
+        return (
+            sum(c * t for c, t in zip(self.coeficientes_latitud, terminos)),
+            sum(c * t for c, t in zip(self.coeficientes_longitud, terminos)),
+        )
+
+    def cubre(self, calle, carrera, margen=5):
+        return (
+            self.rango_calle[0] - margen <= calle <= self.rango_calle[1] + margen
+            and self.rango_carrera[0] - margen <= carrera <= self.rango_carrera[1] + margen
+        )
+
+    @classmethod
+    def ajustar(cls, puntos):
+        """
+        Ajusta el modelo por mínimos cuadrados. puntos es una lista de
+        (calle, carrera, latitud, longitud); con 20 o más se usa grado 2,
+        que sigue mejor el giro de la malla entre el centro y el norte.
+        """
+        import numpy as np
+
+        if len(puntos) < 3:
+            raise ValueError('Se necesitan al menos 3 puntos de control')
+        datos = np.array(puntos, dtype=np.float64)
+        grado = 2 if len(puntos) >= 20 else 1
+        matriz = np.array([_terminos(calle, carrera, grado) for calle, carrera in datos[:, :2]])
+        latitud, *_ = np.linalg.lstsq(matriz, datos[:, 2], rcond=None)
+        longitud, *_ = np.linalg.lstsq(matriz, datos[:, 3], rcond=None)
+
+        # Error en metros (111 km por grado; la longitud se acorta con el coseno)
+        error_lat = (matriz @ latitud - datos[:, 2]) * 111000
+        error_lon = (matriz @ longitud - datos[:, 3]) * 111000 * np.cos(np.radians(datos[:, 2]))
+        return cls(
+            grado=grado,
+            coeficientes_latitud=tuple(latitud.tolist()),
+            coeficientes_longitud=tuple(longitud.tolist()),
+            error_m=float(np.sqrt(np.mean(error_lat ** 2 + error_lon ** 2))),
+            rango_calle=(float(datos[:, 0].min()), float(datos[:, 0].max())),
+            rango_carrera=(float(datos[:, 1].min()), float(datos[:, 1].max())),
+            puntos=len(puntos),
+        )
+
+    def guardar(self, ruta):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump(self.__dict__, archivo, indent=2)
+
+    @classmethod
+    def cargar(cls, ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            datos = json.load(archivo)
+        return cls(**{clave: tuple(valor) if isinstance(valor, list) else valor for clave, valor in datos.items()})
+
+
+def leer_puntos_control(filas):
+    """
+    Puntos (calle, carrera, latitud, longitud) desde filas con latitud,
+    longitud y "direccion" o los números "calle" y "carrera". Las
+    direcciones que no se pueden leer se descartan.
+    """
+    puntos = []
+    for fila in filas:
+        if 'calle' in fila and 'carrera' in fila:
+            calle, carrera = float(fila['calle']), float(fila['carrera'])
+        else:
+            direccion = leer_direccion(fila.get('direccion', ''))
+            if direccion is None:
+                continue
+            calle, carrera = numeros_malla(direccion)
+        puntos.append((calle, carrera, float(fila['latitud']), float(fila['longitud'])))
+    return puntos
+
+
+# ============================================
+# GEOCODIFICACIÓN
+# ============================================
+
+def geocodificar(texto, malla):
+    """
+    (latitud, longitud, confianza) de una dirección, o None si no sigue la
+    nomenclatura. La confianza (0 a 1) baja sin placa, en diagonales y
+    transversales (se desvían de la malla), con letras, fuera del área de
+    los puntos de control y con el error del modelo.
+    """
+    direccion = leer_direccion(texto)
+    if direccion is None:
+        return None
+
+    calle, carrera = numeros_malla(direccion)
+    latitud, longitud = malla.ubicar(calle, carrera)
+
+    confianza = 1.0
+    if direccion.placa is None:
+        confianza *= 0.85
+    if direccion.via in ('diagonal', 'transversal'):
+        confianza *= 0.8
+    if direccion.con_letra:
+        confianza *= 0.9
+    if not malla.cubre(calle, carrera):
+        confianza *= 0.5
+    confianza *= max(0.3, 1 - malla.error_m / 200)
+    return round(latitud, 6), round(longitud, 6), round(confianza, 2)
+
+
+def geocodificar_lote(argumentos):
+    """ Para un pool de procesos: ([(id, direccion), ...], malla) -> [(id, resultado o None), ...] """
+    filas, malla = argumentos
+    return [(reporte_id, geocodificar(texto, malla)) for reporte_id, texto in filas]
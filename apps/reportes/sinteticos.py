@@ -0,0 +1,182 @@
+"""
+Reportes sintéticos con la forma de Barranquilla
+Usados por los comandos de benchmark y de simulación
+"""
+
+import random
+from datetime import timedelta
+from decimal import Decimal
+from math import cos, radians
+
+from django.utils import timezone
+
+from .espacial import calcular_celda, KM_POR_GRADO
+
+
+# Límites aproximados del área urbana
+LAT_MIN, LAT_MAX = 10.905, 11.035
+LON_MIN, LON_MAX = -74.865, -74.770
+
+# Corredores viales (inicio, fin) donde se concentra la mayoría de las fallas
+CORREDORES = [
+    ((10.9890, -74.7790), (11.0290, -74.8230)),  # Vía 40
+    ((10.9640, -74.7930), (11.0150, -74.8230)),  # Carrera 46 (Olaya Herrera)
+    ((10.9610, -74.7820), (10.9350, -74.8200)),  # Calle 45 (Murillo)
+    ((10.9980, -74.8200), (11.0080, -74.7990)),  # Calle 72
+    ((10.9230, -74.8080), (11.0250, -74.8500)),  # Circunvalar
+    ((10.9700, -74.7760), (10.9880, -74.8080)),  # Calle 30 - Carrera 38
+]
+
+# Proporción aproximada de cada tipo de falla
+PESOS_TIPO = {
+    'bache': 45,
+    'fisura': 15,
+    'hundimiento': 8,
+    'desprendimiento': 10,
+    'inundacion': 12,
+    'obstruccion': 6,
+    'otro': 4,
+}
+
+# Frases con que los ciudadanos suelen describir cada tipo de falla
+FRASES_TIPO = {
+    'bache': ['Hueco grande', 'Bache profundo', 'Hueco peligroso', 'Bache que daña los carros'],
+    'fisura': ['Grieta en el pavimento', 'Fisura larga', 'Pavimento agrietado'],
+    'hundimiento': ['Hundimiento de la vía', 'La calle se está hundiendo', 'Hundimiento peligroso'],
+    'desprendimiento': ['Se levantó el asfalto', 'Desprendimiento de la capa asfáltica', 'Asfalto suelto'],
+    'inundacion': ['Calle inundada', 'Encharcamiento permanente', 'Arroyo que no deja pasar'],
+    'obstruccion': ['Escombros en la calzada', 'Obstrucción en la vía', 'Árbol caído sobre la calle'],
+    'otro': ['Daño en la vía', 'Problema en la calle', 'Falla en la calzada'],
+}
+
+# Dispersión de los reportes de una misma falla alrededor de ella
+DISPERSION_KM = 0.012
+DISPERSION_CORREDOR_KM = 0.08
+
+
+def _desplazar(latitud, longitud, dx_km, dy_km):
+    return (
+        latitud + dy_km / KM_POR_GRADO,
+        longitud + dx_km / (KM_POR_GRADO * cos(radians(latitud)))
+    )
+
+
+def direccion_aproximada(latitud, longitud):
+    """
+    Nomenclatura aproximada: las calles crecen hacia el norte y las
+    carreras hacia el occidente, unas 110 m entre una y otra.
+    """
+    calle = max(1, int((latitud - 10.900) / 0.001) + 1)
+    carrera = max(1, int((-74.760 - longitud) / 0.001) + 1)
+    return f'Calle {calle} con Carrera {carrera}'
+
+
+def _ubicacion_falla(azar):
+    """ 65 % de las fallas sobre un corredor, el resto en cualquier calle """
+    if azar.random() < 0.65:
+        (lat_a, lon_a), (lat_b, lon_b) = azar.choice(CORREDORES)
+        t = azar.random()
+        latitud = lat_a + (lat_b - lat_a) * t
+        longitud = lon_a + (lon_b - lon_a) * t
+        return _desplazar(
+            latitud, longitud,
+            azar.gauss(0, DISPERSION_CORREDOR_KM),
+            azar.gauss(0, DISPERSION_CORREDOR_KM)
+        )
+    return azar.uniform(LAT_MIN, LAT_MAX), azar.uniform(LON_MIN, LON_MAX)
+
+
+def _reportes_por_falla(azar):
+    """ La mayoría de las fallas se reportan una vez; algunas, muchas veces """
+    if azar.random() < 0.7:
+        return 1
+    cantidad = 2
+    while cantidad < 12 and azar.random() < 0.45:
+        cantidad += 1
+    return cantidad
+
+
+def generar_reportes(cantidad, semilla=2025, inicio=None, dias=365,
+                     fraccion_sin_coordenadas=0.0):
+    """
+    Genera cantidad tuplas (falla, latitud, longitud, tipo, reportado_en,
+    direccion). Los reportes de una misma falla quedan a pocos metros entre
+    sí y en los días siguientes a la primera vez que se reporta; falla es la
+    etiqueta de referencia para medir la calidad del agrupamiento.
+    Con la misma semilla siempre se obtienen los mismos reportes.
+    """
+    azar = random.Random(semilla)
+    inicio = inicio or timezone.now() - timedelta(days=dias)
+    tipos = list(PESOS_TIPO)
+    pesos = list(PESOS_TIPO.values())
+
+    generados = 0
+    falla = 0
+    while generados < cantidad:
+        falla += 1
+        lat_falla, lon_falla = _ubicacion_falla(azar)
+        tipo = azar.choices(tipos, pesos)[0]
+        primera_vez = inicio + timedelta(seconds=azar.uniform(0, dias * 24 * 3600))
+        direccion = direccion_aproximada(lat_falla, lon_falla)
+
+        for _ in range(min(_reportes_por_falla(azar), cantidad - generados)):
+            latitud, longitud = _desplazar(
+                lat_falla, lon_falla,
+                azar.gauss(0, DISPERSION_KM),
+                azar.gauss(0, DISPERSION_KM)
+            )
+            retraso = timedelta(days=min(azar.expovariate(1.0), 6))
+            if azar.random() < fraccion_sin_coordenadas:
+                latitud = longitud = None
+            yield falla, latitud, longitud, tipo, primera_vez + retraso, direccion
+            generados += 1
+
+
+def datos_reporte(azar, latitud, longitud, tipo, direccion):
+    """ Campos de un Reporte sintético con el texto que escribiría un ciudadano """
+    frase = azar.choice(FRASES_TIPO.get(tipo, FRASES_TIPO['otro']))
+    if latitud is not None:
+        latitud = Decimal(f'{latitud:.7f}')
+        longitud = Decimal(f'{longitud:.7f}')
+    return {
+        'titulo': f'{frase} en la {direccion}',
+        'descripcion': f'{frase} en la {direccion}. {azar.choice(["Urgente.", "Lleva varios días así.", "Por favor arreglar.", ""])}'.strip(),
+        'direccion': direccion,
+        'tipo': tipo,
+        'latitud': latitud,
+        'longitud': longitud,
+    }
+
+
+def crear_reportes(cantidad, usuario, semilla=2025, tamano_lote=10000, **opciones):
+    """
+    Inserta con bulk_create reportes sintéticos del usuario indicado (sin
+    disparar señales) y devuelve {id de reporte: falla}.
+    """
+    from apps.reportes.models import Reporte
+
+    fallas = {}
+    lote = []
+    etiquetas = []
+
+    def guardar():
+        creados = Reporte.objects.bulk_create(lote, batch_size=1000)
+        fallas.update(zip((reporte.id for reporte in creados), etiquetas))
+        lote.clear()
+        etiquetas.clear()
+
+    azar = random.Random(semilla)
+    for falla, latitud, longitud, tipo, fecha, direccion in generar_reportes(cantidad, semilla, **opciones):
+        lote.append(Reporte(
+            usuario=usuario,
+            celda=calcular_celda(latitud, longitud),
+            reportado_en=fecha,
+            **datos_reporte(azar, latitud, longitud, tipo, direccion)
+        ))
+        etiquetas.append(falla)
+        if len(lote) >= tamano_lote:
+            guardar()
+
+    if lote:
+        guardar()
+    return fallas
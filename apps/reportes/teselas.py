@@ -0,0 +1,294 @@
+"""
+Teselas vectoriales (Mapbox Vector Tile 2.1) de los reportes
+Codificador protobuf propio y caché en disco por versión de tesela
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from math import atan, degrees, floor, log, pi, radians, sin, sinh
+
+from django.conf import settings
+
+from .espacial import filtro_recuadro
+from .mapa import ZOOM_MAXIMO_AGREGADO, grupos_en_recuadro
+
+
+# Coordenadas enteras dentro de la tesela (valor por defecto de la especificación)
+EXTENSION = 4096
+
+# Margen alrededor de la tesela para que los símbolos del borde no se corten
+MARGEN = 64
+
+ZOOM_MAXIMO_TESELA = 18
+
+# Por debajo de este zoom la tesela trae la capa "grupos" (AgregadoMapa)
+# en vez de un punto por reporte
+ZOOM_MINIMO_PUNTOS = 14
+
+# Zooms de AgregadoMapa por encima del de la tesela: 16 × 16 celdas por tesela
+NIVELES_GRUPOS = 2
+
+TIPO_MVT = 'application/vnd.mapbox-vector-tile'
+
+_LATITUD_MAXIMA = 85.05112878
+
+
+# ============================================
+# PROYECCIÓN
+# ============================================
+
+def _mercator(latitud, longitud):
+    """ Posición normalizada (0..1, 0..1) en web Mercator, y hacia el sur """
+    latitud = max(-_LATITUD_MAXIMA, min(_LATITUD_MAXIMA, float(latitud)))
+    seno = sin(radians(latitud))
+    return (float(longitud) + 180) / 360, 0.5 - log((1 + seno) / (1 - seno)) / (4 * pi)
+
+
+def limites_tesela(z, x, y, margen=0):
+    """ (oeste, sur, este, norte) de la tesela, ampliada margen unidades de EXTENSION """
+    n = 2 ** z
+    ampliacion = margen / EXTENSION
+
+    def latitud(fila):
+        return degrees(atan(sinh(pi * (1 - 2 * fila / n))))
+
+    return (
+        (x - ampliacion) / n * 360 - 180,
+        latitud(y + 1 + ampliacion),
+        (x + 1 + ampliacion) / n * 360 - 180,
+        latitud(y - ampliacion),
+    )
+
+
+def teselas_de_punto(latitud, longitud):
+    """ Todas las (z, x, y) en cuyo dibujo (con margen) aparece el punto """
+    mx, my = _mercator(latitud, longitud)
+    ampliacion = MARGEN / EXTENSION
+    teselas = []
+    for z in range(ZOOM_MAXIMO_TESELA + 1):
+        n = 2 ** z
+        for x in range(max(0, floor(mx * n - ampliacion)), min(n - 1, floor(mx * n + ampliacion)) + 1):
+            for y in range(max(0, floor(my * n - ampliacion)), min(n - 1, floor(my * n + ampliacion)) + 1):
+                teselas.append((z, x, y))
+    return teselas
+
+
+# ============================================
+# CODIFICACIÓN PROTOBUF
+# ============================================
+
+def _varint(valor):
+    partes = bytearray()
+    while valor > 0x7F:
+        partes.append((valor & 0x7F) | 0x80)
+        valor >>= 7
+    partes.append(valor)
+    return bytes(partes)
+
+
+def _zigzag(valor):
+    return (valor << 1) ^ (valor >> 63)
+
+
+def _campo_varint(numero, valor):
+    return _varint(numero << 3) + _varint(valor)
+
+
+def _campo_bytes(numero, datos):
+    return _varint((numero << 3) | 2) + _varint(len(datos)) + datos
+
+
+def _campo_empaquetado(numero, valores):
+    return _campo_bytes(numero, b''.join(_varint(valor) for valor in valores))
+
+
+def _valor(valor):
+    """ Mensaje Value: enteros no negativos como uint_value, lo demás como texto """
+    if isinstance(valor, int) and not isinstance(valor, bool) and valor >= 0:
+        return _campo_varint(5, valor)
+    return _campo_bytes(1, str(valor).encode('utf-8'))
+
+
+def codificar_capa(nombre, puntos):
+    """
+    Capa MVT de puntos. puntos es una lista de (id o None, x, y, atributos),
+    con x, y en unidades de EXTENSION dentro de la tesela.
+    """
+    claves, valores = {}, {}
+    elementos = []
+    for identificador, x, y, atributos in puntos:
+        etiquetas = []
+        for clave, valor in atributos.items():
+            if valor is None:
+                continue
+            etiquetas.append(claves.setdefault(clave, len(claves)))
+            etiquetas.append(valores.setdefault(valor, len(valores)))
+
+        elemento = b''
+        if identificador is not None:
+            elemento += _campo_varint(1, identificador)
+        elemento += _campo_empaquetado(2, etiquetas)
+        elemento += _campo_varint(3, 1)  # POINT
+        # MoveTo (1) con un solo punto: (1 & 0x7) | (1 << 3) = 9
+        elemento += _campo_empaquetado(4, [9, _zigzag(x), _zigzag(y)])
+        elementos.append(_campo_bytes(2, elemento))
+
+    capa = _campo_varint(15, 2) + _campo_bytes(1, nombre.encode('utf-8'))
+    capa += b''.join(elementos)
+    capa += b''.join(_campo_bytes(3, clave.encode('utf-8')) for clave in claves)
+    capa += b''.join(_campo_bytes(4, _valor(valor)) for valor in valores)
+    capa += _campo_varint(5, EXTENSION)
+    return capa
+
+
+def codificar_tesela(capas):
+    return b''.join(_campo_bytes(3, capa) for capa in capas if capa)
+
+
+# ============================================
+# GENERACIÓN
+# ============================================
+
+def _en_tesela(z, x, y, latitud, longitud):
+    mx, my = _mercator(latitud, longitud)
+    n = 2 ** z
+    return round((mx * n - x) * EXTENSION), round((my * n - y) * EXTENSION)
+
+
+def generar_tesela(z, x, y):
+    """ Bytes MVT de la tesela: capa "reportes" o, en zooms bajos, "grupos" """
+    from apps.reportes.models import Reporte
+
+    oeste, sur, este, norte = limites_tesela(z, x, y, MARGEN)
+
+    if z < ZOOM_MINIMO_PUNTOS:
+        zoom_grupos = min(z + NIVELES_GRUPOS, ZOOM_MAXIMO_AGREGADO)
+        puntos = []
+        for grupo in grupos_en_recuadro(oeste, sur, este, norte, zoom_grupos):
+            px, py = _en_tesela(z, x, y, grupo['latitud'], grupo['longitud'])
+            if -MARGEN <= px <= EXTENSION + MARGEN and -MARGEN <= py <= EXTENSION + MARGEN:
+                puntos.append((None, px, py, {
+                    'cantidad': grupo['cantidad'],
+                    'estado': grupo['estado'],
+                    'tipo': grupo['tipo'],
+                }))
+        return codificar_tesela([codificar_capa('grupos', puntos)])
+
+    reportes = (
+        Reporte.objects.filter(filtro_recuadro(sur, oeste, norte, este))
+        .order_by()
+        .values_list('id', 'latitud', 'longitud', 'tipo', 'estado__nombre', 'prioridad__nombre')
+    )
+    puntos = [
+        (reporte_id, *_en_tesela(z, x, y, latitud, longitud), {
+            'id': reporte_id,
+            'estado': estado or 'Sin estado',
+            'tipo': tipo,
+            'prioridad': prioridad or 'Sin prioridad',
+        })
+        for reporte_id, latitud, longitud, tipo, estado, prioridad in reportes
+    ]
+    return codificar_tesela([codificar_capa('reportes', puntos)])
+
+
+# ============================================
+# VERSIONES Y CACHÉ EN DISCO
+# ============================================
+
+def directorio_cache():
+    return getattr(settings, 'TESELAS_DIR', settings.BASE_DIR / 'cache' / 'teselas')
+
+
+def generacion_cache():
+    """
+    Marca del vaciado completo más reciente. Forma parte del ETag para que
+    los navegadores no reutilicen teselas de antes de una carga masiva.
+    """
+    ruta = os.path.join(directorio_cache(), 'GENERACION')
+    try:
+        with open(ruta) as archivo:
+            return archivo.read().strip()
+    except FileNotFoundError:
+        os.makedirs(directorio_cache(), exist_ok=True)
+        generacion = str(time.time_ns())
+        with open(ruta, 'w') as archivo:
+            archivo.write(generacion)
+        return generacion
+
+
+def version_tesela(z, x, y):
+    from apps.reportes.models import VersionTesela
+
+    return VersionTesela.objects.filter(z=z, x=x, y=y).values_list('version', flat=True).first() or 0
+
+
+def obtener_tesela(z, x, y, version):
+    """
+    Bytes de la tesela en esa versión: del disco si ya se generó, si no se
+    genera y se guarda. Las versiones anteriores de la misma tesela se borran.
+    """
+    carpeta = os.path.join(directorio_cache(), str(z), str(x))
+    ruta = os.path.join(carpeta, f'{y}-{version}.mvt')
+    try:
+        with open(ruta, 'rb') as archivo:
+            return archivo.read()
+    except FileNotFoundError:
+        pass
+
+    contenido = generar_tesela(z, x, y)
+
+    os.makedirs(carpeta, exist_ok=True)
+    for nombre in os.listdir(carpeta):
+        if nombre.startswith(f'{y}-') and nombre != f'{y}-{version}.mvt':
+            try:
+                os.remove(os.path.join(carpeta, nombre))
+            except FileNotFoundError:
+                pass
+    # Escritura atómica: otro proceso nunca lee una tesela a medio escribir
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+    return contenido
+
+
+def invalidar_teselas(puntos):
+    """ Sube una versión las teselas donde aparece alguno de los puntos (latitud, longitud) """
+    from apps.reportes.models import VersionTesela
+    from .mantenimiento import sumar_contadores
+
+    teselas = sorted({
+        tesela
+        for latitud, longitud in puntos
+        if latitud is not None and longitud is not None
+        for tesela in teselas_de_punto(latitud, longitud)
+    })
+    sumar_contadores(VersionTesela, ('z', 'x', 'y'), ('version',), [(*tesela, 1) for tesela in teselas])
+
+
+def vaciar_cache():
+    """ Borra todas las teselas guardadas y cambia la generación del ETag """
+    shutil.rmtree(directorio_cache(), ignore_errors=True)
+    os.makedirs(directorio_cache(), exist_ok=True)
+    with open(os.path.join(directorio_cache(), 'GENERACION'), 'w') as archivo:
+        archivo.write(str(time.time_ns()))
+
+
+def puntos_guardado(instance, created):
+    """ Puntos cuyas teselas cambian al guardar el reporte: solo el lugar anterior y el nuevo """
+    actuales = instance._valores_campos(instance.CAMPOS_MAPA)
+    anteriores = None if created else getattr(instance, '_valores_mapa_anteriores', None)
+    if anteriores is not None and anteriores == actuales:
+        return []
+
+    puntos = [(actuales.get('latitud'), actuales.get('longitud'))]
+    if anteriores:
+        puntos.append((anteriores.get('latitud'), anteriores.get('longitud')))
+    return puntos
+
+
+def puntos_borrado(instance):
+    """ Punto cuyas teselas cambian al eliminar el reporte """
+    return [(instance.latitud, instance.longitud)]
@@ -1,3 +1,1579 @@
-from django.test import TestCase
+import json
+import struct
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+
+from apps.usuarios.models import Rol, Usuario
+from .models import Reporte, GrupoDuplicado
+
+
+def crear_ciudadano(username='ciudadano'):
+    """ Usuario con rol Ciudadano; el rol se comparte entre los usuarios de una prueba """
+    rol, _ = Rol.objects.get_or_create(nombre='Ciudadano')
+    return Usuario.objects.create_user(username=username, password='x', rol=rol)
+
+
+class ReportesTestCase(TestCase):
+    """ Pruebas con un ciudadano que crea reportes de una falla en la vía """
+
+    def setUp(self):
+        self.usuario = crear_ciudadano()
+
+    def _crear(self, latitud=None, longitud='-74.796500', tipo='bache', **campos):
+        """ Reporte del ciudadano; sin latitud queda sin coordenadas """
+        campos.setdefault('usuario', self.usuario)
+        campos.setdefault('titulo', 'Falla')
+        campos.setdefault('descripcion', 'Falla en la vía')
+        if latitud is not None:
+            campos.update(latitud=Decimal(latitud), longitud=Decimal(longitud))
+        return Reporte.objects.create(tipo=tipo, **campos)
+
+
+class CeldaEspacialTests(ReportesTestCase):
+    """ La celda de la malla sigue a las coordenadas y acota la búsqueda de cercanos """
+
+    def test_celda_sigue_las_coordenadas(self):
+        from .espacial import calcular_celda
+
+        reporte = self._crear('10.963200', '-74.796500')
+        self.assertEqual(reporte.celda, calcular_celda(Decimal('10.963200'), Decimal('-74.796500')))
+
+        reporte.latitud = Decimal('11.010500')
+        reporte.save(update_fields=['latitud'])
+        reporte.refresh_from_db()
+        self.assertEqual(reporte.celda, calcular_celda(Decimal('11.010500'), Decimal('-74.796500')))
+
+        reporte.latitud = reporte.longitud = None
+        reporte.save()
+        reporte.refresh_from_db()
+        self.assertIsNone(reporte.celda)
+
+    def test_celdas_vecinas_cubren_el_radio(self):
+        from .espacial import calcular_celda, celdas_vecinas
+
+        self.assertEqual(len(celdas_vecinas(10.9632, -74.7965, 0.05)), 9)
+        # Un radio mayor que la celda abre más anillos de vecinas
+        self.assertGreater(len(celdas_vecinas(10.9632, -74.7965, 0.15)), 9)
+        self.assertIn(calcular_celda(10.9636, -74.7969), celdas_vecinas(10.9632, -74.7965, 0.05))
+
+    def test_cercanos_a_ambos_lados_del_borde_de_celda(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        # 10.9635 es un borde de celda: los dos primeros quedan a 4 m en celdas distintas
+        centro = self._crear('10.963480', '-74.796500')
+        vecino = self._crear('10.963520', '-74.796500')
+        self._crear('10.963500', '-74.796500', tipo='fisura')
+        self._crear('10.964500', '-74.796500')  # A unos 110 m
+
+        self.assertNotEqual(centro.celda, vecino.celda)
+        self.assertEqual(
+            list(DetectorDuplicados.buscar_reportes_cercanos(centro).values_list('id', flat=True)),
+            [vecino.id]
+        )
+
+
+def particion_grupos():
+    """ Grupos de duplicados como conjunto de conjuntos de ids, sin depender de los ids de grupo """
+    grupos = {}
+    for reporte_id, grupo_id in Reporte.objects.filter(grupoDuplicado__isnull=False).values_list('id', 'grupoDuplicado_id'):
+        grupos.setdefault(grupo_id, set()).add(reporte_id)
+    return {frozenset(ids) for ids in grupos.values()}
+
+
+class DeteccionEnLoteTests(TestCase):
+    """ La pasada vectorizada agrupa igual que la detección reporte por reporte """
+
+    def setUp(self):
+        from .sinteticos import crear_reportes
+
+        crear_reportes(400, crear_ciudadano(), semilla=7, dias=20)
+
+    def test_lote_igual_a_reporte_por_reporte(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        for reporte_id in Reporte.objects.order_by('reportado_en', 'id').values_list('id', flat=True):
+            DetectorDuplicados.detectar_y_marcar_duplicado(Reporte.objects.get(id=reporte_id))
+        uno_a_uno = particion_grupos()
+        self.assertGreater(len(uno_a_uno), 10)
+
+        Reporte.objects.update(duplicado=False, grupoDuplicado=None)
+        GrupoDuplicado.objects.all().delete()
+
+        marcados, creados = DetectorDuplicados.detectar_en_lote()
+        self.assertEqual(particion_grupos(), uno_a_uno)
+        self.assertEqual(creados, len(uno_a_uno))
+        self.assertEqual(marcados, sum(len(grupo) for grupo in uno_a_uno))
+
+        # Una segunda pasada no encuentra nada nuevo
+        self.assertEqual(DetectorDuplicados.detectar_en_lote(), (0, 0))
+
+
+class FusionGruposTests(ReportesTestCase):
+    """ Un reporte cercano a dos grupos los fusiona en el más antiguo """
+
+    def test_conjunto_disjunto(self):
+        from .duplicate_detector import ConjuntoDisjunto
+
+        union = ConjuntoDisjunto()
+        union.unir(1, 2)
+        union.unir(3, 4)
+        self.assertNotEqual(union.buscar(1), union.buscar(4))
+        union.unir(2, 3)
+        self.assertEqual(len({union.buscar(elemento) for elemento in range(1, 5)}), 1)
+        self.assertEqual(union.buscar(5), 5)
+
+    def test_reporte_puente_fusiona_dos_grupos(self):
+        from .duplicate_detector import DetectorDuplicados
+        from .models import HistorialReporte
+
+        # Dos grupos a 78 m entre sí y un reporte a 39 m de cada uno
+        sur = [self._crear('10.963000'), self._crear('10.963100')]
+        norte = [self._crear('10.963800'), self._crear('10.963900')]
+        DetectorDuplicados.detectar_y_marcar_duplicado(sur[0])
+        DetectorDuplicados.detectar_y_marcar_duplicado(norte[0])
+        grupo_sur = Reporte.objects.get(id=sur[0].id).grupoDuplicado
+        grupo_norte = Reporte.objects.get(id=norte[0].id).grupoDuplicado
+        self.assertNotEqual(grupo_sur, grupo_norte)
+
+        puente = self._crear('10.963450')
+        es_duplicado, grupo = DetectorDuplicados.detectar_y_marcar_duplicado(puente)
+        self.assertTrue(es_duplicado)
+        self.assertEqual(grupo.id, min(grupo_sur.id, grupo_norte.id))
+        self.assertEqual(GrupoDuplicado.objects.count(), 1)
+        self.assertEqual(particion_grupos(), {frozenset(r.id for r in sur + norte + [puente])})
+
+        grupo.refresh_from_db()
+        self.assertEqual(grupo.total_reportes, 5)
+        self.assertEqual(
+            HistorialReporte.objects.filter(accion='Grupo de duplicados fusionado').count(), 2
+        )
+
+
+class ColaDeteccionTests(ReportesTestCase):
+    """ Los reportes nuevos solo se encolan; el procesador de la cola los agrupa por lotes """
+
+    def test_cola_se_vacia_por_lotes(self):
+        from .duplicate_detector import DetectorDuplicados
+        from .models import DeteccionPendiente
+
+        reportes = [self._crear(f'10.9632{k}0') for k in range(5)]
+        self.assertEqual(DeteccionPendiente.objects.count(), 5)
+        self.assertFalse(GrupoDuplicado.objects.exists())
+
+        # Volver a encolar un reporte pendiente no lo duplica en la cola
+        reportes[0].latitud = Decimal('10.963210')
+        reportes[0].save()
+        self.assertEqual(DeteccionPendiente.objects.count(), 5)
+
+        lotes = []
+        while True:
+            procesados, _ = DetectorDuplicados.procesar_pendientes(limite=2)
+            if not procesados:
+                break
+            lotes.append(procesados)
+        self.assertEqual(lotes, [2, 2, 1])
+        self.assertFalse(DeteccionPendiente.objects.exists())
+        self.assertEqual(particion_grupos(), {frozenset(reporte.id for reporte in reportes)})
+
+    def test_comando_procesa_y_termina(self):
+        from .models import DeteccionPendiente
+
+        cercanos = [self._crear('10.963200'), self._crear('10.963250'), self._crear('10.963300')]
+        self._crear('11.010500', '-74.830200')
+
+        salida = StringIO()
+        call_command('procesar_detecciones', '--una-vez', '--lote', '3', stdout=salida)
+        self.assertIn('Lote procesado: 3 reportes', salida.getvalue())
+        self.assertFalse(DeteccionPendiente.objects.exists())
+        self.assertEqual(particion_grupos(), {frozenset(reporte.id for reporte in cercanos)})
+
+
+class DeteccionParalelaTests(TestCase):
+    """ Repartir los vecindarios en procesos no cambia los pares ni los grupos """
+
+    def test_mismos_pares_que_en_serie(self):
+        import numpy as np
+        from .agrupamiento import pares_cercanos, pares_cercanos_paralelo
+
+        azar = np.random.default_rng(5)
+        n = 3000
+        latitudes = 10.96 + azar.uniform(0, 0.02, n)
+        longitudes = -74.80 + azar.uniform(0, 0.02, n)
+        tipos = azar.integers(0, 3, n)
+        tiempos = azar.uniform(0, 30 * 86400, n)
+        radios = np.where(tipos == 2, 0.15, 0.05)
+
+        def pares(i, j):
+            return {(min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist())}
+
+        en_serie = pares(*pares_cercanos(latitudes, longitudes, tipos, tiempos, radios, 7 * 86400))
+        # Teselas pequeñas para que muchos pares crucen de una tesela a otra
+        en_paralelo = pares(*pares_cercanos_paralelo(
+            latitudes, longitudes, tipos, tiempos, radios, 7 * 86400, trabajadores=2, tamano_tesela_km=0.3
+        ))
+        self.assertGreater(len(en_serie), 100)
+        self.assertEqual(en_paralelo, en_serie)
+
+    def test_lote_con_trabajadores(self):
+        from .duplicate_detector import DetectorDuplicados
+        from .sinteticos import crear_reportes
+
+        crear_reportes(300, crear_ciudadano(), semilla=11)
+
+        DetectorDuplicados.detectar_en_lote()
+        en_serie = particion_grupos()
+        Reporte.objects.update(duplicado=False, grupoDuplicado=None)
+        GrupoDuplicado.objects.all().delete()
+
+        DetectorDuplicados.detectar_en_lote(trabajadores=2)
+        self.assertTrue(en_serie)
+        self.assertEqual(particion_grupos(), en_serie)
+
+
+class DeteccionIncrementalTests(TestCase):
+    """ La detección incremental reanuda desde su marca de agua y agrupa igual que el lote completo """
+
+    def setUp(self):
+        from .sinteticos import crear_reportes
+
+        crear_reportes(400, crear_ciudadano(), semilla=3, dias=30)
+
+    def test_incremental_igual_a_lote_y_reanuda(self):
+        from .duplicate_detector import DetectorDuplicados
+        from .models import PuntoControlDeteccion
+
+        DetectorDuplicados.detectar_en_lote()
+        completo = particion_grupos()
+        self.assertTrue(completo)
+        Reporte.objects.update(duplicado=False, grupoDuplicado=None)
+        GrupoDuplicado.objects.all().delete()
+
+        # Ejecución interrumpida después del primer lote
+        lotes = DetectorDuplicados.detectar_incremental(tamano_lote=100)
+        nuevos, _, _ = next(lotes)
+        lotes.close()
+        self.assertEqual(nuevos, 100)
+        punto = PuntoControlDeteccion.objects.get(nombre='detectar_duplicados')
+        primeros = list(Reporte.objects.order_by('reportado_en', 'id').values_list('id', 'reportado_en')[:100])
+        self.assertEqual((punto.ultimo_id, punto.ultimo_reportado_en), primeros[-1])
+
+        # La siguiente ejecución sigue donde quedó
+        restantes = [nuevos for nuevos, _, _ in DetectorDuplicados.detectar_incremental(tamano_lote=100)]
+        self.assertEqual(restantes, [100, 100, 100])
+        self.assertEqual(particion_grupos(), completo)
+        self.assertEqual(list(DetectorDuplicados.detectar_incremental()), [])
+
+
+class RevisionGrupoTests(ReportesTestCase):
+    """ Eliminar un reporte revisa su grupo: se divide o se disuelve si pierde la conexión """
+
+    def test_eliminar_puente_divide_el_grupo(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        # Cadena sur - puente - norte: sin el puente las dos puntas quedan a más de 50 m
+        sur = [self._crear('10.963000'), self._crear('10.963050')]
+        puente = self._crear('10.963400')
+        norte = [self._crear('10.963800'), self._crear('10.963850')]
+        DetectorDuplicados.procesar_pendientes()
+        self.assertEqual(len(particion_grupos()), 1)
+        grupo_id = Reporte.objects.get(id=puente.id).grupoDuplicado_id
+
+        puente.delete()
+        self.assertEqual(particion_grupos(), {
+            frozenset(reporte.id for reporte in sur),
+            frozenset(reporte.id for reporte in norte),
+        })
+        # La parte más antigua conserva el grupo y sus estadísticas se recalculan
+        self.assertEqual(Reporte.objects.get(id=sur[0].id).grupoDuplicado_id, grupo_id)
+        self.assertEqual(GrupoDuplicado.objects.get(id=grupo_id).total_reportes, 2)
+
+    def test_quitar_coordenadas_vuelve_a_detectar_por_texto(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        texto = 'Hueco profundo frente al colegio San José de la calle 72'
+        lejano = self._crear('10.990000', '-74.800000', descripcion=f'{texto} esquina')
+        movido = self._crear('10.963000', descripcion=texto)
+        vecino = self._crear('10.963100')
+        DetectorDuplicados.procesar_pendientes()
+        self.assertEqual(particion_grupos(), {frozenset([movido.id, vecino.id])})
+
+        # Sin coordenadas sale del grupo y se vuelve a comparar, ahora por texto
+        movido.latitud = movido.longitud = None
+        movido.save()
+        DetectorDuplicados.procesar_pendientes()
+        self.assertEqual(particion_grupos(), {frozenset([movido.id, lejano.id])})
+
+    def test_eliminar_instancia_anterior_al_agrupamiento(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        primero = self._crear('10.963000')
+        segundo = self._crear('10.963100')
+        # Instancia cargada antes de que la cola agrupara el reporte
+        desactualizado = Reporte.objects.get(id=segundo.id)
+        DetectorDuplicados.procesar_pendientes()
+        self.assertIsNone(desactualizado.grupoDuplicado_id)
+
+        desactualizado.delete()
+        primero.refresh_from_db()
+        self.assertFalse(primero.duplicado)
+        self.assertIsNone(primero.grupoDuplicado_id)
+        self.assertFalse(GrupoDuplicado.objects.exists())
+
+
+class EstadisticasGrupoTests(ReportesTestCase):
+    """ Las estadísticas guardadas en el grupo siguen a sus miembros y evidencias """
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        super().setUp()
+        self.otro_usuario = crear_ciudadano('otro_ciudadano')
+
+    def _evidencia(self, reporte):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .models import Evidencia
+
+        return Evidencia.objects.create(
+            reporte=reporte, tipo_evidencia='documento',
+            archivo=SimpleUploadedFile('acta.txt', b'acta'), nombre_archivo='acta.txt'
+        )
+
+    def test_estadisticas_incrementales(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        primero = self._crear('10.963000')
+        segundo = self._crear('10.963100')
+        tercero = self._crear('10.963200', usuario=self.otro_usuario)
+        self._evidencia(primero)
+        DetectorDuplicados.procesar_pendientes()
+
+        grupo = GrupoDuplicado.objects.get()
+        self.assertEqual(grupo.reporte_principal_id, primero.id)
+        self.assertEqual(
+            (grupo.total_reportes, grupo.total_usuarios, grupo.total_evidencias), (3, 2, 1)
+        )
+        self.assertEqual(grupo.fecha_primer_reporte, primero.reportado_en)
+        self.assertEqual(grupo.fecha_ultimo_reporte, tercero.reportado_en)
+
+        evidencia = self._evidencia(segundo)
+        self.assertEqual(GrupoDuplicado.objects.get().total_evidencias, 2)
+        evidencia.delete()
+        self.assertEqual(GrupoDuplicado.objects.get().total_evidencias, 1)
+
+        # Al salir el reporte principal lo reemplaza el siguiente más antiguo
+        Reporte.objects.get(id=primero.id).delete()
+        grupo.refresh_from_db()
+        self.assertEqual(grupo.reporte_principal_id, segundo.id)
+        self.assertEqual(
+            (grupo.total_reportes, grupo.total_usuarios, grupo.total_evidencias), (2, 2, 0)
+        )
+        self.assertEqual(grupo.fecha_primer_reporte, segundo.reportado_en)
+
+    def test_pagina_de_grupos_con_consultas_fijas(self):
+        from django.test.utils import CaptureQueriesContext
+        from .duplicate_detector import DetectorDuplicados
+
+        autoridad = Usuario.objects.create_user(
+            username='autoridad', password='x', rol=Rol.objects.create(nombre='Autoridad')
+        )
+        self.client.force_login(autoridad)
+
+        def consultas_con(grupos):
+            for k in range(GrupoDuplicado.objects.count(), grupos):
+                latitud = 10.950000 + 0.002 * k
+                self._crear(f'{latitud:.6f}')
+                self._crear(f'{latitud + 0.0001:.6f}', usuario=self.otro_usuario)
+            DetectorDuplicados.procesar_pendientes()
+            self.assertEqual(GrupoDuplicado.objects.count(), grupos)
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.client.get(reverse('reportes:grupos_duplicados'))
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.context['total_grupos'], grupos)
+            return len(consultas)
+
+        self.assertEqual(consultas_con(2), consultas_con(8))
+
+
+@override_settings(DETECCION_DUPLICADOS={'POR_TIPO': {'inundacion': {'RADIO_KM': 0.15, 'VENTANA_DIAS': 2}}})
+class ConfiguracionPorTipoTests(ReportesTestCase):
+    """ Las excepciones por tipo de falla se respetan, también en las ejecuciones manuales """
+
+    def _pareja(self, tipo, latitud):
+        # Dos reportes a unos 100 m: cerca para inundaciones, lejos para baches
+        return {self._crear(f'{latitud + delta:.6f}', tipo=tipo).id for delta in (0, 0.0009)}
+
+    def test_ajustada_conserva_lo_que_no_cambia(self):
+        from .configuracion import ConfiguracionDeteccion, obtener_configuracion
+
+        config = obtener_configuracion()
+        self.assertEqual((config.radio_para('inundacion'), config.ventana_para('inundacion')), (0.15, 2))
+
+        otro_radio = config.ajustada(radio_km=0.08)
+        self.assertEqual((otro_radio.radio_para('inundacion'), otro_radio.ventana_para('inundacion')), (0.08, 2))
+        otra_ventana = config.ajustada(ventana_dias=5)
+        self.assertEqual((otra_ventana.radio_para('inundacion'), otra_ventana.ventana_para('inundacion')), (0.15, 5))
+        self.assertEqual(config.ajustada(radio_km=0.08, ventana_dias=5).por_tipo, ())
+        self.assertIs(config.ajustada(), config)
+
+        with self.assertRaises(ValueError):
+            ConfiguracionDeteccion(por_tipo=(('bache', -1, None),))
+        for valor in (float('nan'), float('inf')):
+            with self.assertRaises(ValueError):
+                config.ajustada(radio_km=valor)
+            with self.assertRaises(ValueError):
+                config.ajustada(ventana_dias=valor)
+            with self.assertRaises(ValueError):
+                ConfiguracionDeteccion(por_tipo=(('bache', valor, None),))
+
+    def test_radio_por_tipo_en_la_cola_y_en_lote(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        inundacion = self._pareja('inundacion', 10.963000)
+        self._pareja('bache', 10.970000)
+        DetectorDuplicados.procesar_pendientes()
+        self.assertEqual(particion_grupos(), {frozenset(inundacion)})
+
+        Reporte.objects.update(duplicado=False, grupoDuplicado=None)
+        GrupoDuplicado.objects.all().delete()
+        DetectorDuplicados.detectar_en_lote()
+        self.assertEqual(particion_grupos(), {frozenset(inundacion)})
+
+    def test_ejecucion_manual_sin_radio_conserva_el_del_tipo(self):
+        from .models import DeteccionPendiente
+
+        inundacion = self._pareja('inundacion', 10.963000)
+        self._pareja('bache', 10.970000)
+        DeteccionPendiente.objects.all().delete()
+
+        autoridad = Usuario.objects.create_user(
+            username='autoridad', password='x', rol=Rol.objects.create(nombre='Autoridad')
+        )
+        self.client.force_login(autoridad)
+        # Un radio que no es un número finito se rechaza antes de detectar
+        for radio in ('nan', 'inf'):
+            respuesta = self.client.post(reverse('reportes:ejecutar_deteccion'), {'radio': radio, 'dias': '3'})
+            self.assertRedirects(respuesta, reverse('reportes:ejecutar_deteccion'), fetch_redirect_response=False)
+        self.assertFalse(GrupoDuplicado.objects.exists())
+
+        respuesta = self.client.post(reverse('reportes:ejecutar_deteccion'), {'radio': '', 'dias': '3'})
+        self.assertRedirects(respuesta, reverse('reportes:grupos_duplicados'), fetch_redirect_response=False)
+        self.assertEqual(particion_grupos(), {frozenset(inundacion)})
+
+
+class RevisionGrupoFotoTextoTests(ReportesTestCase):
+    """ Los grupos unidos por foto o por texto no se deshacen al revisarlos por distancia """
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        super().setUp()
+
+    def test_eliminar_reporte_sin_coordenadas_conserva_grupo_por_foto(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .duplicate_detector import DetectorDuplicados, RAZON_MISMA_FOTO
+        from .models import Evidencia
+
+        # Misma foto en dos reportes a 1.5 km y en uno sin coordenadas
+        reportes = [self._crear('10.963000'), self._crear('10.976500'), self._crear()]
+        for reporte in reportes:
+            Evidencia.objects.create(
+                reporte=reporte, tipo_evidencia='foto',
+                archivo=SimpleUploadedFile('foto.jpg', b'foto'), nombre_archivo='foto.jpg'
+            )
+        Evidencia.objects.update(hash_perceptual=0x3C3C3C3C0F0F0F0F)
+        grupo = GrupoDuplicado.objects.create(razon=RAZON_MISMA_FOTO)
+        Reporte.objects.update(duplicado=True, grupoDuplicado=grupo)
+        DetectorDuplicados.actualizar_estadisticas([grupo.id])
+
+        Reporte.objects.get(id=reportes[2].id).delete()
+        self.assertEqual(particion_grupos(), {frozenset([reportes[0].id, reportes[1].id])})
+        self.assertEqual(GrupoDuplicado.objects.get(id=grupo.id).total_reportes, 2)
+
+        # Sin la foto ya no hay nada que los una
+        Evidencia.objects.filter(reporte_id=reportes[1].id).update(hash_perceptual=0)
+        DetectorDuplicados.revisar_grupo(grupo.id)
+        self.assertFalse(GrupoDuplicado.objects.exists())
+
+    def test_fotos_ilegibles_salen_del_indice(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .imagenes import IndiceImagenes, actualizar_hashes
+        from .models import Evidencia
+
+        reporte = self._crear('10.963000')
+        ilegible, pendiente = [
+            Evidencia.objects.create(
+                reporte=reporte, tipo_evidencia='foto',
+                archivo=SimpleUploadedFile('foto.jpg', b'no es una imagen'), nombre_archivo='foto.jpg'
+            )
+            for _ in range(2)
+        ]
+        indice = IndiceImagenes()
+        indice.sincronizar()
+        self.assertEqual(indice.sin_hash, {ilegible.id, pendiente.id})
+
+        # La que no se pudo leer queda marcada y no se vuelve a consultar ni a abrir
+        self.assertEqual(actualizar_hashes(Evidencia.objects.filter(id=ilegible.id)), {})
+        self.assertTrue(Evidencia.objects.get(id=ilegible.id).hash_fallido)
+        pendiente.delete()
+        indice.sincronizar()
+        self.assertEqual(indice.sin_hash, set())
+        with self.assertNumQueries(1):
+            actualizar_hashes(Evidencia.objects.filter(id=ilegible.id))
+
+    def test_eliminar_reporte_conserva_grupo_por_texto(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        reportes = [
+            self._crear(descripcion=f'Hueco profundo frente al colegio San José de la calle 72{final}')
+            for final in ('', ' esquina', ' por favor')
+        ]
+        self._crear(descripcion='Semáforo dañado en la avenida Circunvalar')
+        DetectorDuplicados.procesar_pendientes()
+        self.assertEqual(particion_grupos(), {frozenset(reporte.id for reporte in reportes)})
+
+        reportes[0].delete()
+        self.assertEqual(particion_grupos(), {frozenset(reporte.id for reporte in reportes[1:])})
+
+
+class TextoSimilarTests(ReportesTestCase):
+    """ Los reportes sin coordenadas se agrupan por firmas MinHash y bandas LSH """
+
+    def _crear(self, descripcion, tipo='bache'):
+        return super()._crear(tipo=tipo, descripcion=descripcion).id
+
+    def test_firma_y_similitud(self):
+        from .texto import NUM_BANDAS, bandas, calcular_firma, similitud
+
+        base = calcular_firma('Hueco profundo frente al colegio San José de la calle 72')
+        self.assertEqual(len(bandas(base)), NUM_BANDAS)
+        # Mayúsculas, tildes y puntuación no cambian la firma
+        self.assertTrue((calcular_firma('HUECO profundo, frente al colegio San Jose de la Calle 72!') == base).all())
+        self.assertGreater(similitud(base, calcular_firma('Hueco profundo frente al colegio San José calle 72 esquina')), 0.5)
+        self.assertLess(similitud(base, calcular_firma('Semáforo dañado en la avenida Circunvalar')), 0.25)
+        self.assertIsNone(calcular_firma(' ¡! '))
+
+    def test_cola_igual_a_lote(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        colegio = {
+            self._crear(f'Hueco profundo frente al colegio San José de la calle 72{final}')
+            for final in ('', ' esquina', ', por favor arreglar')
+        }
+        mercado = {
+            self._crear(f'Calle inundada junto al mercado de Barranquillita{final}', tipo='inundacion')
+            for final in ('', ' cuando llueve')
+        }
+        # Mismo texto pero otro tipo de falla, y texto distinto
+        self._crear('Hueco profundo frente al colegio San José de la calle 72', tipo='fisura')
+        self._crear('Semáforo dañado en la avenida Circunvalar')
+
+        DetectorDuplicados.procesar_pendientes()
+        self.assertEqual(particion_grupos(), {frozenset(colegio), frozenset(mercado)})
+
+        Reporte.objects.update(duplicado=False, grupoDuplicado=None, firma_texto=None)
+        GrupoDuplicado.objects.all().delete()
+        salida = StringIO()
+        call_command('indexar_textos', '--detectar', stdout=salida)
+        self.assertIn('Texto similar: 5 duplicados marcados en 2 grupos nuevos', salida.getvalue())
+        self.assertEqual(particion_grupos(), {frozenset(colegio), frozenset(mercado)})
+
+
+@override_settings(DETECCION_DUPLICADOS_ASINCRONA=False)
+class DeteccionConcurrenteTests(TransactionTestCase):
+    """
+    Reportes simultáneos sobre la misma falla deben terminar en un solo grupo.
+    En SQLite las detecciones se serializan con el bloqueo de escritura de la
+    base; el paralelismo por celdas solo se prueba con bloqueo de filas.
+    """
+
+    HILOS_POR_PUNTO = 8
+
+    def setUp(self):
+        self.usuarios = [crear_ciudadano(f'ciudadano{k}') for k in range(self.HILOS_POR_PUNTO * 2)]
+
+    def _reportar_a_la_vez(self, puntos):
+        """ Crea un reporte por hilo; todos arrancan al mismo tiempo """
+        barrera = threading.Barrier(len(puntos))
+        errores = []
+
+        def reportar(usuario, latitud, longitud):
+            try:
+                barrera.wait()
+                Reporte.objects.create(
+                    usuario=usuario,
+                    titulo='Hueco en la vía',
+                    descripcion='Hueco profundo en el carril derecho',
+                    tipo='bache',
+                    latitud=latitud,
+                    longitud=longitud,
+                )
+            except Exception as error:
+                errores.append(error)
+            finally:
+                connection.close()
+
+        hilos = [
+            threading.Thread(target=reportar, args=(usuario, latitud, longitud))
+            for usuario, (latitud, longitud) in zip(self.usuarios, puntos)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+
+    def test_reportes_simultaneos_misma_falla_un_grupo(self):
+        # Todos a menos de 50 m, repartidos a ambos lados de un borde de celda
+        puntos = [
+            (Decimal('10.963200') + Decimal('0.000050') * (k % 2), Decimal('-74.796500') + Decimal('0.000040') * k)
+            for k in range(self.HILOS_POR_PUNTO)
+        ]
+        self._reportar_a_la_vez(puntos)
+
+        self.assertEqual(GrupoDuplicado.objects.count(), 1)
+        grupo = GrupoDuplicado.objects.get()
+        self.assertEqual(grupo.reportes.count(), self.HILOS_POR_PUNTO)
+        self.assertFalse(Reporte.objects.filter(grupoDuplicado__isnull=True).exists())
+
+        grupo.refresh_from_db()
+        self.assertEqual(grupo.total_reportes, self.HILOS_POR_PUNTO)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_celdas_lejanas_no_se_esperan(self):
+        from .duplicate_detector import DetectorDuplicados
+        from .espacial import celdas_vecinas
+
+        centro = celdas_vecinas(10.9632, -74.7965, 0.05)
+        norte = celdas_vecinas(11.0105, -74.8302, 0.05)
+        bloqueado = threading.Event()
+        soltar = threading.Event()
+
+        def sostener():
+            try:
+                with transaction.atomic():
+                    DetectorDuplicados._bloquear_celdas(centro)
+                    bloqueado.set()
+                    soltar.wait(10)
+            finally:
+                connection.close()
+
+        def bloquear(celdas):
+            try:
+                with transaction.atomic():
+                    DetectorDuplicados._bloquear_celdas(celdas)
+            finally:
+                connection.close()
+
+        dueno = threading.Thread(target=sostener)
+        dueno.start()
+        self.assertTrue(bloqueado.wait(10))
+        lejano = threading.Thread(target=bloquear, args=(norte,))
+        vecino = threading.Thread(target=bloquear, args=(centro,))
+        lejano.start()
+        vecino.start()
+
+        # El norte termina mientras el centro sigue bloqueado; otra detección del centro espera
+        lejano.join(5)
+        vecino.join(0.5)
+        lejano_terminado, vecino_terminado = not lejano.is_alive(), not vecino.is_alive()
+        soltar.set()
+        for hilo in (dueno, lejano, vecino):
+            hilo.join(10)
+        self.assertTrue(lejano_terminado)
+        self.assertFalse(vecino_terminado)
+
+    def test_reportes_simultaneos_zonas_distintas_grupos_separados(self):
+        centro = [(Decimal('10.963200'), Decimal('-74.796500') + Decimal('0.000040') * k) for k in range(self.HILOS_POR_PUNTO)]
+        norte = [(Decimal('11.010500'), Decimal('-74.830200') + Decimal('0.000040') * k) for k in range(self.HILOS_POR_PUNTO)]
+        self._reportar_a_la_vez(centro + norte)
+
+        self.assertEqual(GrupoDuplicado.objects.count(), 2)
+        self.assertEqual(
+            sorted(GrupoDuplicado.objects.values_list('total_reportes', flat=True)),
+            [self.HILOS_POR_PUNTO, self.HILOS_POR_PUNTO]
+        )
+
+
+class BenchmarkDuplicadosTests(TestCase):
+    """ El benchmark no deja datos y detecta regresiones contra la línea base """
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.baseline = Path(directorio.name) / 'duplicados.json'
+
+    def _ejecutar(self, *argumentos):
+        call_command(
+            'benchmark_duplicados', '--tamanos', '300', '--muestras', '5',
+            '--baseline', str(self.baseline), *argumentos, stdout=StringIO()
+        )
+
+    def test_guarda_baseline_sin_dejar_datos(self):
+        self._ejecutar('--guardar-baseline')
+
+        resultados = json.loads(self.baseline.read_text())['resultados']['300']
+        self.assertIn('p95_ms', resultados['buscar_reportes_cercanos'])
+        self.assertIn('consultas', resultados['detectar_y_marcar_duplicado'])
+        self.assertIn('grupos', resultados['detectar_duplicados'])
+        self.assertFalse(Reporte.objects.exists())
+        self.assertFalse(GrupoDuplicado.objects.exists())
+
+    def test_falla_si_aumentan_las_consultas(self):
+        self._ejecutar('--guardar-baseline')
+        datos = json.loads(self.baseline.read_text())
+        datos['resultados']['300']['detectar_y_marcar_duplicado']['consultas'] -= 1
+        self.baseline.write_text(json.dumps(datos))
+
+        with self.assertRaises(CommandError):
+            self._ejecutar()
+
+    def test_falla_sin_linea_base(self):
+        with self.assertRaisesMessage(CommandError, 'No hay línea base'):
+            self._ejecutar()
+
+        self._ejecutar('--guardar-baseline')
+        with self.assertRaisesMessage(CommandError, 'no tiene 200 reportes'):
+            call_command(
+                'benchmark_duplicados', '--tamanos', '200', '--muestras', '5',
+                '--baseline', str(self.baseline), stdout=StringIO()
+            )
+
+        # Guardar otro tamaño conserva los que ya estaban
+        call_command(
+            'benchmark_duplicados', '--tamanos', '200', '--muestras', '5',
+            '--baseline', str(self.baseline), '--guardar-baseline', stdout=StringIO()
+        )
+        self.assertEqual(set(json.loads(self.baseline.read_text())['resultados']), {'200', '300'})
+
+    def test_linea_base_del_repositorio(self):
+        from django.conf import settings
+
+        datos = json.loads((settings.BASE_DIR / 'benchmarks' / 'duplicados.json').read_text(encoding='utf-8'))
+        self.assertEqual(set(datos['resultados']), {'10000', '100000', '1000000'})
+
+
+class SimuladorReportesTests(TestCase):
+    """ El simulador pasa por las señales reales y mide contra las etiquetas """
+
+    def test_precision_recall_pares(self):
+        from .management.commands.simular_reportes import precision_recall_pares
+
+        # Fallas: {1, 2, 3} y {4}; grupos: {1, 2} y {3, 4}
+        precision, exhaustividad = precision_recall_pares(
+            {1: 10, 2: 10, 3: 20, 4: 20},
+            {1: 'a', 2: 'a', 3: 'a', 4: 'b'}
+        )
+        self.assertAlmostEqual(precision, 1 / 2)
+        self.assertAlmostEqual(exhaustividad, 1 / 3)
+
+    def test_simulacion_en_cola_no_deja_datos(self):
+        salida = StringIO()
+        call_command('simular_reportes', '--cantidad', '150', '--dias', '5', stdout=salida)
+
+        self.assertIn('Espera en cola', salida.getvalue())
+        self.assertIn('precisión', salida.getvalue())
+        self.assertFalse(Reporte.objects.exists())
+        self.assertFalse(GrupoDuplicado.objects.exists())
+
+    def test_simulacion_sincrona_con_su_configuracion(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .configuracion import obtener_configuracion
+        from .models import DeteccionPendiente
+
+        general = obtener_configuracion()
+        salida = StringIO()
+        call_command(
+            'simular_reportes', '--cantidad', '150', '--dias', '5', '--modo', 'sincrono',
+            '--radio', '0.03', '--conservar', stdout=salida
+        )
+
+        self.assertIn('radio 30 m', salida.getvalue())
+        self.assertIs(obtener_configuracion(), general)
+        # Detectados en la misma petición, sin pasar por la cola, con las fechas simuladas
+        self.assertEqual(Reporte.objects.count(), 150)
+        self.assertFalse(DeteccionPendiente.objects.exists())
+        self.assertTrue(GrupoDuplicado.objects.exists())
+        self.assertLess(Reporte.objects.earliest('reportado_en').reportado_en, timezone.now() - timedelta(days=1))
+
+    def test_archivo_invalido(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ruta = Path(directorio.name) / 'historico.csv'
+        ruta.write_text('reportado_en,descripcion\n2025-03-01 08:00,Hueco\n', encoding='utf-8')
+
+        with self.assertRaisesMessage(CommandError, 'Faltan columnas en el CSV: tipo'):
+            call_command('simular_reportes', '--archivo', str(ruta), stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'No se pudo leer'):
+            call_command('simular_reportes', '--archivo', str(ruta.with_name('no_existe.csv')), stdout=StringIO())
+        self.assertFalse(Reporte.objects.exists())
+
+
+class SumarContadoresTests(TestCase):
+    """ El upsert compartido suma por clave, omite lo que no cambia y borra lo que queda vacío """
+
+    def test_suma_y_borra(self):
+        from datetime import date
+        from .mantenimiento import sumar_contadores
+        from .models import AgregadoMapa, CapaDensidad
+
+        claves = ('zoom', 'cx', 'cy', 'estado', 'tipo')
+        columnas = ('cantidad', 'suma_latitud', 'suma_longitud')
+        # La misma celda dos veces en el mismo upsert
+        sumar_contadores(AgregadoMapa, claves, columnas, [
+            (15, 1, 2, 0, 'bache', 1, 10.5, -74.5),
+            (15, 1, 2, 0, 'bache', 1, 10.5, -74.5),
+            (15, 3, 4, 0, 'bache', 1, 10.0, -74.0),
+        ], borrar_vacias='cantidad')
+        self.assertEqual(AgregadoMapa.objects.get(cx=1).cantidad, 2)
+
+        with self.assertNumQueries(0):
+            sumar_contadores(AgregadoMapa, claves, columnas, [
+                (15, 3, 4, 0, 'bache', 1, 10.0, -74.0),
+                (15, 3, 4, 0, 'bache', -1, -10.0, 74.0),
+            ], borrar_vacias='cantidad')
+
+        sumar_contadores(AgregadoMapa, claves, columnas, [(15, 3, 4, 0, 'bache', -1, -10.0, 74.0)], borrar_vacias='cantidad')
+        self.assertEqual(list(AgregadoMapa.objects.values_list('cx', 'cantidad')), [(1, 2)])
+
+        mes = date(2025, 3, 1)
+        for _ in range(2):
+            sumar_contadores(CapaDensidad, ('tipo', 'mes'), ('version',), [('bache', mes, 1)])
+        self.assertEqual(CapaDensidad.objects.get(tipo='bache', mes=mes).version, 2)
+
+
+class MapaReportesDatosTests(ReportesTestCase):
+    """ El mapa recibe solo los marcadores del recuadro visible """
+
+    def setUp(self):
+        super().setUp()
+        # Los agregados del mapa se actualizan al confirmar cada transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            self._crear('10.963200', '-74.796500')
+            self._crear('10.964000', '-74.797000', tipo='fisura')
+            self._crear('11.010500', '-74.830200')
+
+    def _pedir(self, **parametros):
+        return self.client.get('/reportes/mapa/datos/', parametros)
+
+    def test_filtra_por_recuadro_y_tipo(self):
+        datos = self._pedir(bbox='-74.80,10.96,-74.79,10.97', zoom=16).json()
+        self.assertEqual(len(datos['features']), 2)
+        self.assertFalse(datos['truncado'])
+
+        datos = self._pedir(bbox='-74.80,10.96,-74.79,10.97', zoom=16, tipo='bache').json()
+        self.assertEqual(len(datos['features']), 1)
+
+    def test_zoom_bajo_devuelve_grupos(self):
+        datos = self._pedir(bbox='-74.90,10.90,-74.70,11.10', zoom=11).json()
+        self.assertEqual(
+            sorted(feature['properties']['cantidad'] for feature in datos['features']),
+            [1, 2]
+        )
+        self.assertTrue(all(feature['properties']['grupo'] for feature in datos['features']))
+
+    def test_agregados_al_confirmar(self):
+        from .models import AgregadoMapa
+
+        total = lambda: sum(AgregadoMapa.objects.filter(zoom=11).values_list('cantidad', flat=True))
+        with self.captureOnCommitCallbacks() as pendientes:
+            self._crear('10.970000', '-74.800000')
+        # Un solo callback por reporte, y nada escrito antes de confirmar
+        self.assertEqual(len(pendientes), 1)
+        self.assertEqual(total(), 3)
+        pendientes[0]()
+        self.assertEqual(total(), 4)
+
+    def test_agregados_incrementales_igual_a_reconstruidos(self):
+        from .mapa import construir_agregados
+        from .models import AgregadoMapa
+
+        reporte = Reporte.objects.first()
+        reporte.latitud = Decimal('10.990000')
+        reporte.tipo = 'hundimiento'
+        with self.captureOnCommitCallbacks(execute=True):
+            reporte.save()
+            Reporte.objects.last().delete()
+
+        def filas():
+            return sorted(AgregadoMapa.objects.values_list('zoom', 'cx', 'cy', 'estado', 'tipo', 'cantidad'))
+
+        incrementales = filas()
+        construir_agregados()
+        self.assertEqual(incrementales, filas())
+
+    def test_formato_binario_y_revalidacion(self):
+        parametros = {'bbox': '-74.80,10.96,-74.79,10.97', 'zoom': 17, 'formato': 'binario'}
+        respuesta = self._pedir(**parametros)
+        self.assertEqual(respuesta['Content-Type'], 'application/octet-stream')
+
+        datos = respuesta.content
+        self.assertEqual(datos[:4], b'MRB2')
+        n = struct.unpack_from('<I', datos, 8)[0]
+        posicion, diccionarios = 12, []
+        for _ in range(3):
+            textos = []
+            for _ in range(datos[posicion]):
+                longitud = datos[posicion + 1]
+                textos.append(datos[posicion + 2:posicion + 2 + longitud].decode())
+                posicion += 1 + longitud
+            posicion += 1
+            diccionarios.append(textos)
+        posicion += -posicion % 4
+        ids = struct.unpack_from(f'<{n}I', datos, posicion)
+        latitudes = struct.unpack_from(f'<{n}f', datos, posicion + 4 * n)
+        duplicados = struct.unpack_from(f'<{n}H', datos, posicion + 12 * n)
+        tipos = datos[posicion + 15 * n:posicion + 16 * n]
+        self.assertEqual(set(duplicados), {1})
+
+        esperados = dict(Reporte.objects.filter(latitud__lt=10.97).values_list('id', 'tipo'))
+        self.assertEqual(sorted(ids), sorted(esperados))
+        for reporte_id, latitud, tipo in zip(ids, latitudes, tipos):
+            self.assertEqual(diccionarios[1][tipo], esperados[reporte_id])
+            self.assertAlmostEqual(latitud, float(Reporte.objects.get(id=reporte_id).latitud), places=5)
+
+        # Sin cambios: 304; al borrar un reporte del recuadro cambia el ETag
+        etag = respuesta['ETag']
+        self.assertEqual(self.client.get('/reportes/mapa/datos/', parametros, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Reporte.objects.get(id=ids[0]).delete()
+        self.assertEqual(self.client.get('/reportes/mapa/datos/', parametros, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_un_marcador_por_grupo_de_duplicados(self):
+        from .duplicate_detector import DetectorDuplicados
+
+        for k in range(4):
+            self._crear(
+                Decimal('10.965000') + Decimal(k) / 100000, '-74.795000', tipo='inundacion',
+                titulo='Inundación', descripcion='Calle inundada'
+            )
+        DetectorDuplicados.procesar_pendientes()
+        grupo = GrupoDuplicado.objects.get()
+        self.assertEqual(grupo.total_reportes, 4)
+
+        parametros = {'bbox': '-74.80,10.96,-74.79,10.97', 'zoom': 17}
+        respuesta = self._pedir(**parametros)
+        features = respuesta.json()['features']
+        self.assertEqual(len(features), 3)
+        agrupado = next(feature for feature in features if 'duplicados' in feature['properties'])
+        self.assertEqual(agrupado['id'], grupo.reporte_principal_id)
+        self.assertEqual(agrupado['properties']['duplicados'], 4)
+
+        # Los demás reportes del grupo se piden al desplegarlo
+        miembros = self.client.get(f'/reportes/mapa/reporte/{agrupado["id"]}/duplicados/').json()['features']
+        self.assertEqual(len(miembros), 3)
+        self.assertNotIn(agrupado['id'], [miembro['id'] for miembro in miembros])
+
+        # Sacar un reporte del grupo cambia el ETag aunque no cambie actualizado_en
+        etag = respuesta['ETag']
+        Reporte.objects.filter(id=miembros[0]['id']).update(grupoDuplicado=None, duplicado=False)
+        self.assertEqual(self.client.get('/reportes/mapa/datos/', parametros, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(len(self._pedir(**parametros).json()['features']), 4)
+
+    def test_grupo_con_principal_sin_coordenadas(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .duplicate_detector import RAZON_TEXTO_SIMILAR
+
+        ahora = timezone.now()
+
+        def crear(dias, latitud=None):
+            return self._crear(
+                latitud, '-74.795000', tipo='inundacion', titulo='Calle inundada', descripcion='Calle inundada',
+                reportado_en=ahora - timedelta(days=dias)
+            )
+
+        principal = crear(3)
+        reciente = crear(1, '10.965000')
+        antiguo = crear(2, '10.965100')
+        grupo = GrupoDuplicado.objects.create(razon=RAZON_TEXTO_SIMILAR, reporte_principal=principal)
+        Reporte.objects.filter(id__in=[principal.id, reciente.id, antiguo.id]).update(grupoDuplicado=grupo)
+
+        # El grupo se muestra en el más antiguo de sus reportes con coordenadas
+        features = self._pedir(bbox='-74.80,10.96,-74.79,10.97', zoom=17).json()['features']
+        self.assertEqual(len(features), 3)
+        agrupado = next(feature for feature in features if 'duplicados' in feature['properties'])
+        self.assertEqual(agrupado['id'], antiguo.id)
+        self.assertEqual(agrupado['properties']['duplicados'], 2)
+
+    def test_grupo_con_principal_fuera_de_los_filtros(self):
+        from .duplicate_detector import RAZON_TEXTO_SIMILAR
+
+        def crear(latitud):
+            return self._crear(
+                latitud, '-74.795000', tipo='inundacion', titulo='Calle inundada', descripcion='Calle inundada'
+            )
+
+        principal = crear('10.975000')
+        antiguo = crear('10.965000')
+        reciente = crear('10.965100')
+        grupo = GrupoDuplicado.objects.create(razon=RAZON_TEXTO_SIMILAR, reporte_principal=principal)
+        Reporte.objects.filter(id__in=[principal.id, antiguo.id, reciente.id]).update(grupoDuplicado=grupo)
+
+        def agrupado(**parametros):
+            features = self._pedir(bbox='-74.80,10.96,-74.79,10.97', zoom=17, **parametros).json()['features']
+            return next(feature for feature in features if 'duplicados' in feature['properties'])
+
+        # El principal queda fuera del recuadro: el grupo se muestra en el más antiguo visible
+        self.assertEqual(agrupado()['id'], antiguo.id)
+        self.assertEqual(agrupado()['properties']['duplicados'], 2)
+
+        # Dentro del recuadro pero fuera del filtro de tipo, tampoco lo representa
+        Reporte.objects.filter(id=principal.id).update(latitud=Decimal('10.965200'), tipo='bache')
+        self.assertEqual(agrupado(tipo='inundacion')['id'], antiguo.id)
+        self.assertEqual(agrupado()['id'], principal.id)
+
+    def test_recuadro_invalido(self):
+        self.assertEqual(self._pedir(bbox='-74.79,10.97').status_code, 400)
+        self.assertEqual(self._pedir(bbox='-74.80,10.96,-74.79,10.97', desde='ayer').status_code, 400)
+
+
+class IndiceRTreeTests(ReportesTestCase):
+    """ Los triggers mantienen el R*Tree igual a las coordenadas de los reportes """
+
+    def test_sigue_las_coordenadas(self):
+        from .espacial import ids_en_recuadro, ids_en_radio, rtree_disponible
+
+        self.assertTrue(rtree_disponible())
+        centro = self._crear('10.963200', '-74.796500')
+        vecino = self._crear('10.963500', '-74.796500')
+        lejano = self._crear('11.010500', '-74.830200')
+
+        self.assertEqual(sorted(ids_en_recuadro(10.96, -74.80, 10.97, -74.79)), [centro.id, vecino.id])
+        self.assertEqual(sorted(ids_en_radio(10.9632, -74.7965, 0.02)), [centro.id])
+
+        # QuerySet.update no dispara señales, pero sí los triggers
+        Reporte.objects.filter(id=lejano.id).update(latitud=Decimal('10.964000'), longitud=Decimal('-74.797000'))
+        vecino.delete()
+        self.assertEqual(sorted(ids_en_recuadro(10.96, -74.80, 10.97, -74.79)), [centro.id, lejano.id])
+
+
+class TeselasVectorialesTests(ReportesTestCase):
+    """ Las teselas se sirven del disco y solo se regeneran las que tocan un cambio """
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(TESELAS_DIR=Path(directorio.name))
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        super().setUp()
+        self.reporte = self._crear('10.963200', '-74.796500')
+
+    def _crear(self, *args, **kwargs):
+        # Las versiones de las teselas cambian al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            return super()._crear(*args, **kwargs)
+
+    def _url(self, latitud, longitud, z):
+        from .teselas import teselas_de_punto
+
+        _, x, y = next(t for t in teselas_de_punto(latitud, longitud) if t[0] == z)
+        return f'/reportes/tiles/{z}/{x}/{y}.mvt'
+
+    def test_cache_y_revalidacion(self):
+        url = self._url(10.9632, -74.7965, 16)
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'reportes', respuesta.content)
+        etag = respuesta['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Cambiar solo el título no toca el mapa
+        self.reporte.titulo = 'Otro título'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reporte.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Un reporte lejano no invalida esta tesela; uno dentro sí
+        self._crear('11.010500', '-74.830200')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self._crear('10.963300', '-74.796600')
+        nueva = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(nueva.status_code, 200)
+        self.assertGreater(len(nueva.content), len(respuesta.content))
+
+    def test_grupos_en_zoom_bajo_y_fuera_de_rango(self):
+        respuesta = self.client.get(self._url(10.9632, -74.7965, 10))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn(b'grupos', respuesta.content)
+        self.assertEqual(self.client.get('/reportes/tiles/3/8/0.mvt').status_code, 404)
+        self.assertEqual(self.client.get('/reportes/tiles/19/0/0.mvt').status_code, 404)
+
+
+class MapaCalorTests(ReportesTestCase):
+    """ Las capas del mapa de calor se mantienen con señales y la imagen se revalida por ETag """
+
+    def _crear(self, *args, **kwargs):
+        # Las capas cambian al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            return super()._crear(*args, **kwargs)
+
+    def test_incremental_igual_a_reconstruir(self):
+        from .densidad import construir_densidad
+        from .models import CeldaDensidad
+
+        movido = self._crear('10.963200', '-74.796500')
+        self._crear('10.963300', '-74.796400')
+        cambiado = self._crear('11.010500', '-74.830200', tipo='fisura')
+        borrado = self._crear('10.990000', '-74.800000')
+        self._crear('4.710000', '-74.070000')  # Fuera de la malla
+
+        movido.latitud = Decimal('10.970000')
+        cambiado.tipo = 'hundimiento'
+        with self.captureOnCommitCallbacks(execute=True):
+            movido.save()
+            cambiado.save()
+            borrado.delete()
+
+        def filas():
+            return sorted(CeldaDensidad.objects.values_list('tipo', 'mes', 'fila', 'columna', 'cantidad'))
+
+        incrementales = filas()
+        self.assertEqual(sum(fila[-1] for fila in incrementales), 3)
+        construir_densidad()
+        self.assertEqual(incrementales, filas())
+
+    def test_imagen_y_revalidacion(self):
+        self._crear('10.963200', '-74.796500')
+        respuesta = self.client.get('/reportes/mapa/densidad.png', {'tipo': 'bache'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.content[:8], b'\x89PNG\r\n\x1a\n')
+
+        etag = respuesta['ETag']
+        pedir = lambda: self.client.get('/reportes/mapa/densidad.png', {'tipo': 'bache'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(pedir().status_code, 304)
+
+        # Otra capa no invalida la imagen de los baches; un bache nuevo sí
+        self._crear('10.963300', '-74.796400', tipo='fisura')
+        self.assertEqual(pedir().status_code, 304)
+        self._crear('10.963300', '-74.796400')
+        self.assertEqual(pedir().status_code, 200)
+        self.assertEqual(self.client.get('/reportes/mapa/densidad.png', {'desde': 'ayer'}).status_code, 400)
+
+
+class ProveedorDePrueba:
+    """ Proveedor de geocodificación sin red que cuenta sus consultas """
+
+    nombre = 'prueba'
+    consultas = []
+
+    def __call__(self, latitud, longitud):
+        from .geocodificacion import ErrorGeocodificacion
+
+        self.consultas.append((latitud, longitud))
+        if latitud < 0:
+            raise ErrorGeocodificacion('sin conexión')
+        if latitud > 12:
+            return None  # En el mar
+        return f'Calle cerca de {latitud:.4f}, {longitud:.4f}'
+
+
+@override_settings(GEOCODIFICACION={'PROVEEDOR': 'apps.reportes.tests.ProveedorDePrueba'})
+class GeocodificacionTests(TestCase):
+    """ Las direcciones se reutilizan por celda y las fallas no se repiten """
+
+    def setUp(self):
+        from .geocodificacion import _cache
+
+        # La LRU vive en el proceso; la base de cada prueba se revierte
+        _cache.vaciar()
+        ProveedorDePrueba.consultas = []
+
+    def test_cache_por_celda(self):
+        from .geocodificacion import _cache, direccion_para
+        from .models import DireccionGeocodificada
+
+        direccion = direccion_para('10.963200', '-74.796500')
+        self.assertTrue(direccion.startswith('Calle cerca de'))
+        # A unos 3 m cae en la misma celda, también después de vaciar la LRU (sale de la base)
+        self.assertEqual(direccion_para(10.96321, -74.79652), direccion)
+        _cache.vaciar()
+        self.assertEqual(direccion_para(10.96321, -74.79652), direccion)
+        self.assertEqual(len(ProveedorDePrueba.consultas), 1)
+
+        self.assertNotEqual(direccion_para(10.9640, -74.7965), direccion)
+        self.assertEqual(len(ProveedorDePrueba.consultas), 2)
+
+        # Respuestas negativas y fallas tampoco se repiten
+        self.assertIsNone(direccion_para(12.5, -74.8))
+        self.assertIsNone(direccion_para(12.5, -74.8))
+        with self.assertLogs('apps.reportes.geocodificacion', 'WARNING'):
+            self.assertIsNone(direccion_para(-1.0, -74.8))
+        self.assertIsNone(direccion_para(-1.0, -74.8))
+        self.assertEqual(len(ProveedorDePrueba.consultas), 4)
+        # La falla no se guarda en la base; la respuesta negativa sí
+        self.assertEqual(DireccionGeocodificada.objects.filter(direccion='').count(), 1)
+        self.assertIsNone(direccion_para('no', 'es número'))
+
+    def test_una_sola_consulta_simultanea(self):
+        from .geocodificacion import UnSoloVuelo
+
+        vuelos = UnSoloVuelo()
+        barrera = threading.Barrier(8)
+        llamadas, resultados = [], []
+
+        def lenta():
+            llamadas.append(1)
+            threading.Event().wait(0.2)
+            return 'Carrera 46'
+
+        def consultar():
+            barrera.wait()
+            resultados.append(vuelos.hacer('celda', lenta))
+
+        hilos = [threading.Thread(target=consultar) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(llamadas), 1)
+        self.assertEqual(resultados, ['Carrera 46'] * 8)
+
+    def test_crear_desde_mapa(self):
+        self.client.force_login(crear_ciudadano())
+
+        self.client.get('/reportes/mapa/direccion/', {'lat': '10.963200', 'lng': '-74.796500'})
+        self.client.post('/reportes/crear-desde-mapa/', {
+            'latitud': '10.963210', 'longitud': '-74.796510', 'tipo': 'bache',
+            'titulo': 'Hueco', 'descripcion': 'Hueco en la vía',
+        })
+        self.assertTrue(Reporte.objects.get().direccion.startswith('Calle cerca de'))
+        self.assertEqual(len(ProveedorDePrueba.consultas), 1)
+
+    def test_nominatim_respuesta_cortada(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from .geocodificacion import ErrorGeocodificacion, ProveedorNominatim
+
+        class Cortada(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # Anuncia más bytes de los que envía y cierra la conexión
+                self.send_response(200)
+                self.send_header('Content-Length', '100')
+                self.end_headers()
+                self.wfile.write(b'{"display_name": "Calle')
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), Cortada)
+        hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+        hilo.start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+
+        proveedor = ProveedorNominatim()
+        proveedor.URL = f'http://127.0.0.1:{servidor.server_port}/reverse'
+        with self.assertRaises(ErrorGeocodificacion):
+            proveedor(10.9632, -74.7965)
+
+    def test_coordenadas_invalidas(self):
+        from .geocodificacion import direccion_para
+
+        self.client.force_login(crear_ciudadano())
+
+        invalidas = [('nan', '-74.7965'), ('10.9632', 'inf'), ('-inf', '-74.7965'), ('91', '-74.7965'),
+                     ('10.9632', '-181'), ('', '-74.7965'), ('norte', '-74.7965')]
+        for latitud, longitud in invalidas:
+            self.assertIsNone(direccion_para(latitud, longitud))
+            respuesta = self.client.get('/reportes/mapa/direccion/', {'lat': latitud, 'lng': longitud})
+            self.assertEqual(respuesta.status_code, 400)
+
+        self.client.post('/reportes/crear-desde-mapa/', {
+            'latitud': 'nan', 'longitud': '-74.796510', 'tipo': 'bache',
+            'titulo': 'Hueco', 'descripcion': 'Hueco en la vía',
+        })
+        self.assertFalse(Reporte.objects.exists())
+        self.assertEqual(ProveedorDePrueba.consultas, [])
+
+
+class GazetteerTests(TestCase):
+    """ El gazetteer local nombra calle, cruce, lugar y barrio sin red """
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = Path(directorio.name) / 'gazetteer.npz'
+        ajustes = override_settings(GEOCODIFICACION={'GAZETTEER': self.ruta})
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        def calle(nombre, *puntos):
+            return {
+                'type': 'Feature', 'properties': {'highway': 'primary', 'name': nombre},
+                'geometry': {'type': 'LineString', 'coordinates': [list(punto) for punto in puntos]},
+            }
+
+        coleccion = {'type': 'FeatureCollection', 'features': [
+            calle('Calle 72', (-74.810, 11.0000), (-74.800, 11.0000), (-74.790, 11.0000)),
+            calle('Carrera 46', (-74.8000, 10.990), (-74.8000, 11.010)),
+            {
+                'type': 'Feature', 'properties': {'tags': {'place': 'neighbourhood', 'name': 'El Prado'}},
+                'geometry': {'type': 'Polygon', 'coordinates': [[
+                    [-74.805, 10.995], [-74.795, 10.995], [-74.795, 11.005], [-74.805, 11.005], [-74.805, 10.995],
+                ]]},
+            },
+            {
+                'type': 'Feature', 'properties': {'amenity': 'school', 'name': 'Colegio Americano'},
+                'geometry': {'type': 'Point', 'coordinates': [-74.7920, 11.0002]},
+            },
+        ]}
+        archivo = Path(directorio.name) / 'baq.geojson'
+        archivo.write_text(json.dumps(coleccion), encoding='utf-8')
+        call_command('importar_gazetteer', str(archivo), stdout=StringIO())
+
+    def test_direcciones(self):
+        from .gazetteer import ProveedorGazetteer
+
+        proveedor = ProveedorGazetteer()
+        self.assertEqual(proveedor(11.00005, -74.8001), 'Calle 72 con Carrera 46, El Prado')
+        self.assertEqual(proveedor(11.0003, -74.7921), 'Calle 72 (Colegio Americano)')
+        self.assertEqual(proveedor(10.9970, -74.8002), 'Carrera 46, El Prado')
+        self.assertIsNone(proveedor(10.9500, -74.7000))
+
+    def test_sin_archivo_usa_respaldo(self):
+        from django.core.checks import run_checks
+        from .gazetteer import ProveedorGazetteer, _cargado
+        from .geocodificacion import ErrorGeocodificacion
+        from .sinteticos import direccion_aproximada
+
+        # El aviso se escribe una vez por proceso
+        _cargado.pop('avisado', None)
+        faltante = self.ruta.with_name('faltante.npz')
+        proveedor = ProveedorGazetteer()
+        respaldo = 'apps.reportes.geocodificacion.ProveedorAproximado'
+        with override_settings(GEOCODIFICACION={'GAZETTEER': faltante, 'RESPALDO': respaldo}):
+            with self.assertLogs('apps.reportes.gazetteer', 'WARNING'):
+                self.assertEqual(proveedor(10.9632, -74.7965), direccion_aproximada(10.9632, -74.7965))
+            self.assertEqual(proveedor.nombre, 'aproximado')
+            self.assertEqual([aviso.id for aviso in run_checks()], ['reportes.W001'])
+
+        with override_settings(GEOCODIFICACION={'GAZETTEER': faltante, 'RESPALDO': None}):
+            with self.assertRaises(ErrorGeocodificacion):
+                proveedor(10.9632, -74.7965)
+
+        self.assertEqual(proveedor.nombre, 'gazetteer')
+        self.assertEqual(run_checks(), [])
+
+    def test_formulario_propone_direccion(self):
+        from .forms import ReporteForm
+
+        datos = {'tipo': 'bache', 'titulo': 'Hueco', 'descripcion': 'Hueco en la vía'}
+        form = ReporteForm({**datos, 'latitud': '10.997000', 'longitud': '-74.800200'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['direccion'], 'Carrera 46, El Prado')
+
+        # La dirección escrita por el ciudadano se respeta
+        form = ReporteForm({**datos, 'latitud': '10.997000', 'longitud': '-74.800200', 'direccion': 'Frente al CAI'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['direccion'], 'Frente al CAI')
+
+        # Sin el archivo del gazetteer el formulario no consulta a ningún proveedor
+        ProveedorDePrueba.consultas = []
+        faltante = self.ruta.with_name('faltante.npz')
+        ajustes = {'GAZETTEER': faltante, 'PROVEEDOR': 'apps.reportes.tests.ProveedorDePrueba',
+                   'RESPALDO': 'apps.reportes.tests.ProveedorDePrueba'}
+        with override_settings(GEOCODIFICACION=ajustes):
+            form = ReporteForm({**datos, 'latitud': '10.997000', 'longitud': '-74.800200'})
+            self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['direccion'], '')
+        self.assertEqual(ProveedorDePrueba.consultas, [])
+
+
+class NomenclaturaTests(ReportesTestCase):
+    """ Las direcciones con nomenclatura se leen y se ubican con la malla vial ajustada """
+
+    @staticmethod
+    def _malla_real(calle, carrera):
+        # Malla girada: las calles suben al norte y las carreras van al occidente
+        return 10.95 + 0.0009 * calle - 0.0002 * carrera, -74.76 - 0.0009 * carrera - 0.0002 * calle
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = Path(directorio.name) / 'malla_vial.json'
+        ajustes = override_settings(GEOCODIFICACION={'MALLA_VIAL': self.ruta})
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        super().setUp()
+
+    def _crear(self, direccion, latitud=None, longitud=None):
+        return super()._crear(latitud, longitud, direccion=direccion)
+
+    def test_lectura(self):
+        from .nomenclatura import leer_direccion, numeros_malla
+
+        casos = {
+            'Calle 72 #43-85, Barranquilla': ('calle', 72, 43.85),
+            'Cra. 46 No. 72-10': ('carrera', 72.1, 46),
+            'Kr 54 N° 68B-20': ('carrera', 68.7, 54),
+            'Carrera 46 con Calle 72': ('carrera', 72, 46),
+            'Dg 45 # 2C-30': ('diagonal', 45, 2.75 + 0.3),
+        }
+        for texto, (via, calle, carrera) in casos.items():
+            direccion = leer_direccion(texto)
+            self.assertEqual(direccion.via, via, texto)
+            for obtenido, esperado in zip(numeros_malla(direccion), (calle, carrera)):
+                self.assertAlmostEqual(obtenido, esperado, places=6, msg=texto)
+
+        for texto in ('Vía 40 frente a la planta', 'Calle 72 con Calle 73', 'Calle 72 Sur # 43-85', ''):
+            self.assertIsNone(leer_direccion(texto), texto)
+
+    def test_completa_coordenadas(self):
+        from .models import HistorialReporte
+
+        # Reportes con GPS y dirección: puntos de control
+        for calle in range(40, 90, 10):
+            for carrera in range(20, 60, 10):
+                latitud, longitud = self._malla_real(calle, carrera)
+                self._crear(f'Calle {calle} # {carrera}-00', f'{latitud:.7f}', f'{longitud:.7f}')
+
+        ubicado = self._crear('Calle 72 # 43-50, Barranquilla')
+        esquina = self._crear('Carrera 46 con Calle 72')
+        lejano = self._crear('Transversal 3B # 180-20')
+        ilegible = self._crear('Frente al estadio')
+
+        salida = StringIO()
+        call_command('geocodificar_direcciones', '--con-reportes', stdout=salida)
+        self.assertIn('grado 2 con 20 puntos de control', salida.getvalue())
+        self.assertTrue(self.ruta.exists())
+
+        ubicado.refresh_from_db()
+        latitud, longitud = self._malla_real(72, 43.5)
+        self.assertAlmostEqual(float(ubicado.latitud), latitud, places=5)
+        self.assertAlmostEqual(float(ubicado.longitud), longitud, places=5)
+        self.assertEqual(ubicado.confianza_ubicacion, 1.0)
+        self.assertIsNotNone(ubicado.celda)
+        self.assertTrue(HistorialReporte.objects.filter(reporte=ubicado, accion__startswith='Ubicación estimada').exists())
+
+        esquina.refresh_from_db()
+        self.assertEqual(esquina.confianza_ubicacion, 0.85)
+        for reporte in (lejano, ilegible):
+            reporte.refresh_from_db()
+            self.assertIsNone(reporte.latitud)
+
+        # Con la malla guardada no hace falta ajustar de nuevo
+        lejano.direccion = 'Calle 50 # 30-10'
+        lejano.save()
+        call_command('geocodificar_direcciones', stdout=StringIO())
+        lejano.refresh_from_db()
+        self.assertIsNotNone(lejano.latitud)
+
+
+class ZonasTests(ReportesTestCase):
+    """ Cada reporte guarda su localidad y barrio; las autoridades filtran y cuentan por ellos """
+
+    @staticmethod
+    def _cuadro(oeste, sur, este, norte):
+        return [[oeste, sur], [este, sur], [este, norte], [oeste, norte], [oeste, sur]]
+
+    def setUp(self):
+        from .zonas import limpiar_indice
+
+        self.addCleanup(limpiar_indice)
+        super().setUp()
+
+        def zona(propiedades, *anillos):
+            return {'type': 'Feature', 'properties': propiedades, 'geometry': {'type': 'Polygon', 'coordinates': list(anillos)}}
+
+        coleccion = {'type': 'FeatureCollection', 'features': [
+            zona({'name': 'Riomar', 'boundary': 'administrative', 'admin_level': '8'}, self._cuadro(-74.83, 11.00, -74.79, 11.04)),
+            zona({'name': 'Norte-Centro Histórico', 'nivel': 'localidad'}, self._cuadro(-74.83, 10.96, -74.79, 11.00)),
+            # El Prado tiene un hueco (un parque que no es del barrio)
+            zona(
+                {'name': 'El Prado', 'place': 'neighbourhood'},
+                self._cuadro(-74.81, 10.98, -74.80, 10.99), self._cuadro(-74.806, 10.984, -74.804, 10.986)
+            ),
+            zona({'name': 'Altos de Riomar', 'place': 'neighbourhood'}, self._cuadro(-74.82, 11.01, -74.81, 11.02)),
+        ]}
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        archivo = Path(directorio.name) / 'zonas.geojson'
+        archivo.write_text(json.dumps(coleccion), encoding='utf-8')
+        self.archivo = str(archivo)
+
+    def test_etiqueta_al_guardar_y_en_lote(self):
+        from .models import Zona
+
+        # Reportes previos a las zonas: los etiqueta la importación
+        previo = self._crear('10.985000', '-74.808000')
+        self.assertIsNone(previo.barrio_id)
+        salida = StringIO()
+        call_command('importar_zonas', self.archivo, stdout=salida)
+        self.assertIn('Localidades: 2, barrios: 2', salida.getvalue())
+
+        prado = Zona.objects.get(nombre='El Prado')
+        centro = Zona.objects.get(nombre='Norte-Centro Histórico')
+        riomar = Zona.objects.get(nombre='Riomar')
+        self.assertEqual(prado.padre, centro)
+        self.assertEqual(Zona.objects.get(nombre='Altos de Riomar').padre, riomar)
+
+        previo.refresh_from_db()
+        self.assertEqual((previo.localidad, previo.barrio), (centro, prado))
+
+        # Al crear y al mover, sin pasar por el comando
+        en_hueco = self._crear('10.985000', '-74.805000')
+        self.assertEqual((en_hueco.localidad, en_hueco.barrio), (centro, None))
+        en_hueco.latitud, en_hueco.longitud = Decimal('11.015000'), Decimal('-74.815000')
+        en_hueco.save(update_fields=['latitud', 'longitud'])
+        en_hueco.refresh_from_db()
+        self.assertEqual(en_hueco.barrio.nombre, 'Altos de Riomar')
+        self.assertEqual(en_hueco.localidad, riomar)
+        self.assertEqual(self._crear('4.710000', '-74.070000').localidad, None)
+
+        # bulk_create no pasa por save(): asignar_zonas los completa
+        Reporte.objects.bulk_create([
+            Reporte(usuario=self.usuario, titulo='Falla', descripcion='x', tipo='bache',
+                    latitud=Decimal('10.981000'), longitud=Decimal('-74.809000'))
+            for _ in range(3)
+        ])
+        salida = StringIO()
+        call_command('asignar_zonas', stdout=salida)
+        self.assertIn('3 reportes cambiaron de zona', salida.getvalue())
+        self.assertEqual(Reporte.objects.filter(barrio=prado).count(), 4)
+
+    def test_filtros_y_conteos_de_autoridad(self):
+        call_command('importar_zonas', self.archivo, stdout=StringIO())
+        for latitud, longitud in [('10.985000', '-74.808000'), ('10.981000', '-74.809000'), ('11.030000', '-74.800000')]:
+            self._crear(latitud, longitud)
+
+        from .models import Zona
+
+        autoridad = Usuario.objects.create_user(
+            username='autoridad', password='x', rol=Rol.objects.create(nombre='Autoridad')
+        )
+        self.client.force_login(autoridad)
+        prado = Zona.objects.get(nombre='El Prado')
+        respuesta = self.client.get('/reportes/lista-autoridad/', {'barrio': prado.id})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['total_reportes'], 2)
+        self.assertEqual(len(respuesta.context['reportes']), 2)
+
+        riomar = Zona.objects.get(nombre='Riomar')
+        respuesta = self.client.get('/reportes/lista-autoridad/', {'localidad': riomar.id})
+        self.assertEqual(respuesta.context['total_reportes'], 1)
+        self.assertEqual([barrio.nombre for barrio in respuesta.context['barrios']], ['Altos de Riomar'])
+
+        respuesta = self.client.get(reverse('usuarios:autoridad_home'))
+        totales = {fila['zona'].nombre: fila['total'] for fila in respuesta.context['reportes_por_localidad']}
+        self.assertEqual(totales, {'Norte-Centro Histórico': 2, 'Riomar': 1})
+        self.assertEqual(list(respuesta.context['reportes_por_barrio'])[0]['total'], 2)
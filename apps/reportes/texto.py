@@ -0,0 +1,106 @@
+"""
+Similitud de texto entre reportes
+Firmas MinHash y bandas LSH sobre título, descripción y dirección
+"""
+
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+
+# Fragmentos de 4 caracteres: toleran errores de tipeo y palabras en otro orden
+TAMANO_FRAGMENTO = 4
+
+# 16 bandas de 4 filas: dos textos con similitud de Jaccard s comparten
+# alguna banda con probabilidad 1 - (1 - s^4)^16 (≈ 0.65 con s = 0.5,
+# ≈ 0.99 con s = 0.7 y ≈ 0.06 con s = 0.25)
+NUM_BANDAS = 16
+FILAS_POR_BANDA = 4
+NUM_PERMUTACIONES = NUM_BANDAS * FILAS_POR_BANDA
+
+_PRIMO = (1 << 31) - 1
+
+# Semilla fija: las firmas guardadas deben coincidir entre procesos y despliegues
+_generador = np.random.RandomState(20251119)
+_A = _generador.randint(1, _PRIMO, NUM_PERMUTACIONES).astype(np.int64)
+_B = _generador.randint(0, _PRIMO, NUM_PERMUTACIONES).astype(np.int64)
+
+
+def normalizar(texto):
+    """ Minúsculas, sin tildes ni signos de puntuación y con espacios simples """
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return re.sub(r'[^a-z0-9ñ]+', ' ', texto).strip()
+
+
+def texto_reporte(reporte):
+    return ' '.join([reporte.titulo or '', reporte.descripcion or '', reporte.direccion or ''])
+
+
+def fragmentos(texto):
+    """ Hashes de 31 bits de los fragmentos de TAMANO_FRAGMENTO caracteres """
+    texto = normalizar(texto)
+    if not texto:
+        return set()
+    if len(texto) <= TAMANO_FRAGMENTO:
+        return {zlib.crc32(texto.encode()) & _PRIMO}
+    return {
+        zlib.crc32(texto[k:k + TAMANO_FRAGMENTO].encode()) & _PRIMO
+        for k in range(len(texto) - TAMANO_FRAGMENTO + 1)
+    }
+
+
+def calcular_firma(texto):
+    """ Firma MinHash de NUM_PERMUTACIONES valores, o None si no hay texto """
+    valores = fragmentos(texto)
+    if not valores:
+        return None
+    x = np.fromiter(valores, dtype=np.int64, count=len(valores))
+    # a * x + b cabe en 63 bits porque a, x, b < 2^31
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIMO).min(axis=1).astype(np.uint32)
+
+
+def firma_a_bytes(firma):
+    return firma.astype('<u4').tobytes()
+
+
+def firma_desde_bytes(datos):
+    return np.frombuffer(bytes(datos), dtype='<u4')
+
+
+def bandas(firma):
+    """ Lista de (banda, cubeta) de una firma """
+    return [
+        (banda, zlib.crc32(firma[banda * FILAS_POR_BANDA:(banda + 1) * FILAS_POR_BANDA].astype('<u4').tobytes()))
+        for banda in range(NUM_BANDAS)
+    ]
+
+
+def similitud(firma_a, firma_b):
+    """ Estimación de la similitud de Jaccard entre los dos textos """
+    return float(np.count_nonzero(firma_a == firma_b)) / NUM_PERMUTACIONES
+
+
+def indexar_textos(reportes):
+    """
+    Calcula la firma de los reportes indicados y reemplaza sus bandas LSH.
+    Recibe instancias de Reporte con titulo, descripcion y direccion.
+    """
+    from apps.reportes.models import Reporte, BandaTexto
+
+    reportes = list(reportes)
+    nuevas_bandas = []
+    for reporte in reportes:
+        firma = calcular_firma(texto_reporte(reporte))
+        reporte.firma_texto = firma_a_bytes(firma) if firma is not None else None
+        if firma is not None:
+            nuevas_bandas.extend(
+                BandaTexto(reporte_id=reporte.id, banda=banda, cubeta=cubeta)
+                for banda, cubeta in bandas(firma)
+            )
+
+    Reporte.objects.bulk_update(reportes, ['firma_texto'], batch_size=1000)
+    BandaTexto.objects.filter(reporte__in=reportes).delete()
+    BandaTexto.objects.bulk_create(nuevas_bandas, batch_size=2000)
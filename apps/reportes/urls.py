@@ -8,6 +8,12 @@ urlpatterns = [
     # SE Públicas
     path('', views.lista_reportes, name='lista_reportes'),
     path('mapa/', views.mapa_reportes, name='mapa'),
+    path('mapa/datos/', views.mapa_reportes_datos, name='mapa_datos'),
+    path('mapa/reporte/<int:pk>/', views.mapa_reporte_popup, name='mapa_popup'),
+    path('mapa/reporte/<int:pk>/duplicados/', views.mapa_reporte_duplicados, name='mapa_duplicados'),
+    path('mapa/direccion/', views.mapa_direccion, name='mapa_direccion'),
+    path('mapa/densidad.png', views.mapa_densidad, name='mapa_densidad'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', views.tesela_reportes, name='tesela'),
     
     # SE Ciudadanos
     path('crear/', views.crear_reporte, name='crear_reporte'),
@@ -2,11 +2,33 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import Count, Max, Q, Sum
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.dateformat import format as date_format
+from django.utils.dateparse import parse_date
+from django.utils.http import quote_etag
+from django.utils.text import Truncator
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET
 from .forms import ReporteForm, EvidenciaForm
 from .models import Reporte, EstadoReporte, PrioridadReporte, Evidencia, GrupoDuplicado
 from .duplicate_detector import DetectorDuplicados
+from .configuracion import obtener_configuracion
+from .densidad import RECUADRO_DENSIDAD, imagen_densidad, version_densidad
+from .espacial import filtro_recuadro, leer_bbox, leer_coordenadas
+from .geocodificacion import direccion_para
+from .mapa import (
+    TIPO_BINARIO, ZOOM_MAXIMO_AGREGADO, agrupar_reportes, empaquetar_marcadores, grupos_en_recuadro,
+    marcadores_reportes
+)
+from .teselas import (
+    TIPO_MVT, ZOOM_MAXIMO_TESELA, ZOOM_MINIMO_PUNTOS, generacion_cache, obtener_tesela, version_tesela
+)
 import os
+from math import ceil, log10
 
 
 @login_required
@@ -173,18 +195,308 @@ def lista_reportes(request):
     return render(request, 'reportes/lista_reportes.html', context)
 
 def mapa_reportes(request):
-    """Vista del mapa interactivo con todos los reportes"""
-    # Solo obtener reportes que tengan coordenadas válidas
-    reportes = Reporte.objects.filter(
-        latitud__isnull=False,
-        longitud__isnull=False
-    ).select_related('estado', 'prioridad', 'usuario')
-    
+    """Vista del mapa interactivo; los marcadores se piden a mapa_reportes_datos"""
     context = {
-        'reportes': reportes,
+        'estados': EstadoReporte.objects.all(),
+        'prioridades': PrioridadReporte.objects.all(),
+        'tipos': Reporte.TIPOS_FALLA,
+        'zoom_maximo_agregado': ZOOM_MAXIMO_AGREGADO,
+        'zoom_maximo_tesela': ZOOM_MAXIMO_TESELA,
+        'zoom_minimo_puntos': ZOOM_MINIMO_PUNTOS,
+        'recuadro_densidad': RECUADRO_DENSIDAD,
     }
     return render(request, 'reportes/mapa_reportes.html', context)
 
+
+# Tope de marcadores por respuesta; con más, el mapa pide acercarse
+MAX_MARCADORES_MAPA = 5000
+
+
+def _decimales_para_zoom(zoom):
+    """ Decimales que distinguen un píxel en ese zoom (256 px por tesela) """
+    return max(3, min(7, ceil(log10(256 * 2 ** zoom / 360))))
+
+
+def _leer_consulta_mapa(parametros):
+    """ Valida los parámetros del mapa; devuelve (consulta, None) o (None, error) """
+    bbox = leer_bbox(parametros.get('bbox', ''))
+    if bbox is None:
+        return None, 'bbox debe ser oeste,sur,este,norte'
+    oeste, sur, este, norte = bbox
+
+    try:
+        zoom = max(0, min(22, int(parametros.get('zoom', 13))))
+    except ValueError:
+        return None, 'zoom debe ser un entero'
+
+    reportes, error = _filtrar_reportes(Reporte.objects.filter(filtro_recuadro(sur, oeste, norte, este)), parametros)
+    if error:
+        return None, error
+
+    return {
+        'bbox': bbox,
+        'zoom': zoom,
+        'reportes': reportes,
+        'estado': parametros.get('estado', ''),
+        'tipo': parametros.get('tipo', ''),
+        'por_fecha_o_prioridad': any(parametros.get(nombre) for nombre in ('prioridad', 'desde', 'hasta')),
+        'binario': parametros.get('formato') == 'binario',
+    }, None
+
+
+def _filtrar_reportes(reportes, parametros):
+    """ Filtros estado, prioridad, tipo, desde y hasta del mapa; devuelve (reportes, error) """
+    for parametro, filtro in (('estado', 'estado__nombre'), ('prioridad', 'prioridad__nombre'), ('tipo', 'tipo')):
+        if parametros.get(parametro):
+            reportes = reportes.filter(**{filtro: parametros[parametro]})
+
+    for parametro, filtro in (('desde', 'reportado_en__date__gte'), ('hasta', 'reportado_en__date__lte')):
+        if parametros.get(parametro):
+            fecha = parse_date(parametros[parametro])
+            if fecha is None:
+                return None, f'{parametro} debe tener el formato AAAA-MM-DD'
+            reportes = reportes.filter(**{filtro: fecha})
+    return reportes, None
+
+
+def _consulta_mapa(request):
+    """ La consulta se arma una sola vez por petición (la usan también ETag y Last-Modified) """
+    if not hasattr(request, '_consulta_mapa'):
+        request._consulta_mapa = _leer_consulta_mapa(request.GET)
+    return request._consulta_mapa
+
+
+def _marca_mapa(request):
+    """
+    Cantidad y último actualizado_en de los reportes de una respuesta de
+    marcadores. Los grupos no llevan marca: salen de AgregadoMapa y pesan poco.
+    """
+    if not hasattr(request, '_marca_mapa'):
+        consulta, error = _consulta_mapa(request)
+        if error or consulta['zoom'] <= ZOOM_MAXIMO_AGREGADO:
+            request._marca_mapa = None
+        else:
+            # Agrupar duplicados no toca actualizado_en: las sumas de grupo y
+            # principal cambian cuando un reporte entra o sale de un grupo
+            request._marca_mapa = consulta['reportes'].order_by().aggregate(
+                total=Count('id'), ultimo=Max('actualizado_en'),
+                grupos=Sum('grupoDuplicado_id'), principales=Sum('grupoDuplicado__reporte_principal_id')
+            )
+    return request._marca_mapa
+
+
+def _etag_mapa(request):
+    # La cantidad cambia también cuando se borra un reporte, que no mueve la fecha
+    marca = _marca_mapa(request)
+    if marca is None:
+        return None
+    ultimo = marca['ultimo'].timestamp() if marca['ultimo'] else 0
+    formato = 'binario' if _consulta_mapa(request)[0]['binario'] else 'geojson'
+    return f'{formato}-{marca["total"]}-{ultimo}-{marca["grupos"] or 0}-{marca["principales"] or 0}'
+
+
+def _ultima_modificacion_mapa(request):
+    marca = _marca_mapa(request)
+    return marca['ultimo'] if marca else None
+
+
+@require_GET
+@gzip_page
+@condition(etag_func=_etag_mapa, last_modified_func=_ultima_modificacion_mapa)
+def mapa_reportes_datos(request):
+    """
+    GeoJSON con los reportes dentro del recuadro visible del mapa.
+    Parámetros: bbox (oeste,sur,este,norte), zoom y los filtros opcionales
+    estado, prioridad, tipo, desde y hasta (AAAA-MM-DD). Hasta el zoom
+    ZOOM_MAXIMO_AGREGADO devuelve grupos con su cantidad y el estado y
+    tipo más frecuentes; después, un punto por reporte con solo id y
+    prioridad (el resto se pide al abrir su ventana). Cada grupo de
+    duplicados es un solo punto, su reporte principal, con la cantidad de
+    reportes en duplicados; mapa_reporte_duplicados da los demás.
+
+    Con formato=binario los marcadores sueltos van en columnas (ver
+    mapa.empaquetar_marcadores). Las respuestas de marcadores llevan ETag y
+    Last-Modified, así que una recarga sin cambios recibe 304.
+    """
+    consulta, error = _consulta_mapa(request)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    oeste, sur, este, norte = consulta['bbox']
+    zoom = consulta['zoom']
+    reportes = consulta['reportes']
+
+    if zoom <= ZOOM_MAXIMO_AGREGADO:
+        if consulta['por_fecha_o_prioridad']:
+            # AgregadoMapa no guarda prioridad ni fecha: se agrupa en el momento
+            grupos = agrupar_reportes(reportes, zoom)
+        else:
+            estados = None
+            if consulta['estado']:
+                estados = list(EstadoReporte.objects.filter(nombre=consulta['estado']).values_list('id', flat=True))
+            grupos = grupos_en_recuadro(oeste, sur, este, norte, zoom, estados=estados, tipo=consulta['tipo'])
+        return _respuesta_grupos(grupos, zoom)
+
+    filas, truncado = marcadores_reportes(reportes, MAX_MARCADORES_MAPA)
+    if consulta['binario']:
+        contenido = empaquetar_marcadores(filas, truncado=truncado)
+        if contenido is not None:
+            response = HttpResponse(contenido, content_type=TIPO_BINARIO)
+            patch_cache_control(response, no_cache=True)
+            return response
+
+    response = _respuesta_marcadores(filas, truncado, _decimales_para_zoom(zoom))
+    # El navegador guarda la respuesta pero la revalida siempre con ETag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _respuesta_marcadores(filas, truncado, decimales):
+    """ GeoJSON de filas de mapa.marcadores_reportes; los grupos llevan duplicados """
+    features = []
+    for reporte_id, latitud, longitud, _, _, prioridad, duplicados in filas:
+        propiedades = {'prioridad': prioridad}
+        if duplicados > 1:
+            propiedades['duplicados'] = duplicados
+        features.append({
+            'type': 'Feature',
+            'id': reporte_id,
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [round(float(longitud), decimales), round(float(latitud), decimales)],
+            },
+            'properties': propiedades,
+        })
+    return JsonResponse({'type': 'FeatureCollection', 'truncado': truncado, 'features': features})
+
+
+def _respuesta_grupos(grupos, zoom):
+    decimales = _decimales_para_zoom(zoom)
+    return JsonResponse({
+        'type': 'FeatureCollection',
+        'truncado': False,
+        'features': [
+            {
+                'type': 'Feature',
+                'id': f'{zoom}/{grupo["cx"]}/{grupo["cy"]}',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [round(grupo['longitud'], decimales), round(grupo['latitud'], decimales)],
+                },
+                'properties': {
+                    'grupo': True,
+                    'cantidad': grupo['cantidad'],
+                    'estado': grupo['estado'],
+                    'tipo': grupo['tipo'],
+                },
+            }
+            for grupo in grupos
+        ],
+    })
+
+
+@require_GET
+def tesela_reportes(request, z, x, y):
+    """
+    Tesela vectorial (MVT) de los reportes. Se sirve desde la caché en disco;
+    el ETag cambia solo cuando cambia algún reporte dentro de la tesela.
+    """
+    if not (0 <= z <= ZOOM_MAXIMO_TESELA and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise Http404('Tesela fuera de rango')
+
+    version = version_tesela(z, x, y)
+    etag = quote_etag(f'{generacion_cache()}-{version}')
+    no_modificada = get_conditional_response(request, etag=etag)
+    if no_modificada is not None:
+        return no_modificada
+
+    response = HttpResponse(obtener_tesela(z, x, y, version), content_type=TIPO_MVT)
+    response['ETag'] = etag
+    # El navegador puede reutilizarla un momento y después la revalida con el ETag
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+@require_GET
+def mapa_densidad(request):
+    """
+    PNG del mapa de calor sobre RECUADRO_DENSIDAD. Parámetros opcionales:
+    tipo, desde y hasta (AAAA-MM-DD; se toman los meses completos).
+    """
+    fechas = {}
+    for parametro in ('desde', 'hasta'):
+        valor = request.GET.get(parametro, '')
+        fechas[parametro] = parse_date(valor) if valor else None
+        if valor and fechas[parametro] is None:
+            return JsonResponse({'error': f'{parametro} debe tener el formato AAAA-MM-DD'}, status=400)
+    tipo = request.GET.get('tipo', '')
+
+    version = version_densidad(tipo, **fechas)
+    etag = quote_etag(version)
+    no_modificada = get_conditional_response(request, etag=etag)
+    if no_modificada is not None:
+        return no_modificada
+
+    _, imagen = imagen_densidad(tipo, version=version, **fechas)
+    response = HttpResponse(imagen, content_type='image/png')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_GET
+def mapa_reporte_duplicados(request, pk):
+    """
+    Los demás reportes del grupo de duplicados de un marcador, con los
+    filtros del mapa. El mapa los pide al desplegar el grupo.
+    """
+    reporte = get_object_or_404(Reporte.objects.only('id', 'grupoDuplicado'), pk=pk)
+    miembros = Reporte.objects.none()
+    if reporte.grupoDuplicado_id is not None:
+        miembros = Reporte.objects.filter(
+            grupoDuplicado_id=reporte.grupoDuplicado_id, latitud__isnull=False, longitud__isnull=False
+        ).exclude(pk=pk)
+
+    miembros, error = _filtrar_reportes(miembros, request.GET)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    filas = list(
+        miembros.order_by('reportado_en')
+        .values_list('id', 'latitud', 'longitud', 'estado__nombre', 'tipo', 'prioridad__nombre')
+        [:MAX_MARCADORES_MAPA + 1]
+    )
+    filas = [(*fila[:5], fila[5] or 'Sin prioridad', 1) for fila in filas]
+    return _respuesta_marcadores(filas[:MAX_MARCADORES_MAPA], len(filas) > MAX_MARCADORES_MAPA, 7)
+
+
+@login_required
+@require_GET
+def mapa_direccion(request):
+    """
+    Dirección de un punto para la ventana de crear reporte. Pasa por la
+    misma caché que crear_reporte_desde_mapa, que después la encuentra lista.
+    """
+    coordenadas = leer_coordenadas(request.GET.get('lat'), request.GET.get('lng'))
+    if coordenadas is None:
+        return JsonResponse({'error': 'lat y lng deben ser coordenadas válidas'}, status=400)
+    return JsonResponse({'direccion': direccion_para(*coordenadas)})
+
+
+@require_GET
+def mapa_reporte_popup(request, pk):
+    """ Datos de la ventana emergente de un marcador del mapa """
+    reporte = get_object_or_404(Reporte.objects.select_related('estado', 'prioridad'), pk=pk)
+    return JsonResponse({
+        'id': reporte.id,
+        'titulo': reporte.titulo,
+        'descripcion': Truncator(reporte.descripcion).words(20),
+        'estado': reporte.estado.nombre if reporte.estado else 'Sin estado',
+        'prioridad': reporte.prioridad.nombre if reporte.prioridad else 'Sin prioridad',
+        'direccion': reporte.direccion,
+        'fecha': date_format(timezone.localtime(reporte.reportado_en), 'd/m/Y H:i'),
+        'url': reverse('reportes:detalle_reporte', args=[reporte.pk]),
+    })
+
 @login_required
 def crear_reporte_desde_mapa(request):
     """Vista para crear un reporte desde el mapa interactivo"""
@@ -201,18 +513,12 @@ def crear_reporte_desde_mapa(request):
         if not latitud or not longitud:
             messages.error(request, 'Error: No se recibieron las coordenadas.')
             return redirect('reportes:mapa')
+        if leer_coordenadas(latitud, longitud) is None:
+            messages.error(request, 'Error: Las coordenadas recibidas no son válidas.')
+            return redirect('reportes:mapa')
         
-        # Obtener dirección desde coordenadas (Nominatim)
-        try:
-            import requests
-            url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={latitud}&lon={longitud}"
-            headers = {'User-Agent': 'MonitoreoCallesBAQ/1.0'}
-            response = requests.get(url, headers=headers, timeout=5)
-            data = response.json()
-            direccion = data.get('display_name', f'Lat: {latitud}, Lng: {longitud}')
-        except Exception as e:
-            print(f"Error obteniendo dirección: {e}")
-            direccion = f'Lat: {latitud}, Lng: {longitud}'
+        # Obtener dirección desde coordenadas; cerca de otro reporte sale de la caché
+        direccion = direccion_para(latitud, longitud) or f'Lat: {latitud}, Lng: {longitud}'
         
         # Crear reporte
         reporte = Reporte()
@@ -273,25 +579,28 @@ def ver_grupos_duplicados(request):
         messages.error(request, 'No tienes permisos para ver esta página.')
         return redirect('usuarios:home')
     
-    # Obtener todos los grupos con sus reportes
-    grupos = GrupoDuplicado.objects.prefetch_related(
-        'reportes__usuario',
-        'reportes__estado',
-        'reportes__prioridad'
+    # Las estadísticas están guardadas en cada grupo: cada página cuesta
+    # un conteo y una consulta, sin importar cuántos reportes tengan
+    grupos = GrupoDuplicado.objects.select_related(
+        'reporte_principal__usuario',
+        'reporte_principal__estado',
+        'reporte_principal__prioridad'
     ).order_by('-fechaDeteccion')
     
-    # Calcular estadísticas para cada grupo
+    paginator = Paginator(grupos, 20)
+    grupos_page = paginator.get_page(request.GET.get('page'))
+    
     grupos_con_stats = []
-    for grupo in grupos:
-        stats = DetectorDuplicados.obtener_estadisticas_grupo(grupo)
+    for grupo in grupos_page:
         grupos_con_stats.append({
             'grupo': grupo,
-            'stats': stats
+            'stats': DetectorDuplicados.obtener_estadisticas_grupo(grupo)
         })
     
     context = {
+        'grupos': grupos_page,
         'grupos_con_stats': grupos_con_stats,
-        'total_grupos': grupos.count(),
+        'total_grupos': paginator.count,
     }
     
     return render(request, 'reportes/grupos_duplicados.html', context)
@@ -301,7 +610,10 @@ def ver_grupos_duplicados(request):
 def detalle_grupo_duplicado(request, pk):
     """Vista detallada de un grupo de duplicados"""
     
-    grupo = get_object_or_404(GrupoDuplicado, pk=pk)
+    grupo = get_object_or_404(
+        GrupoDuplicado.objects.select_related('reporte_principal'),
+        pk=pk
+    )
     stats = DetectorDuplicados.obtener_estadisticas_grupo(grupo)
     principal = DetectorDuplicados.obtener_reporte_principal(grupo)
     reportes = grupo.reportes.all().order_by('reportado_en')
@@ -345,11 +657,9 @@ def desmarcar_duplicado(request, pk):
         
         messages.success(request, f'Reporte #{reporte.id} desmarcado como duplicado.')
         
-        # Si el grupo quedó vacío, eliminarlo
+        # Si el grupo quedó con un solo reporte (o dividido), reorganizarlo
         if grupo_id:
-            grupo = GrupoDuplicado.objects.filter(id=grupo_id).first()
-            if grupo and grupo.reportes.count() == 0:
-                grupo.delete()
+            DetectorDuplicados.revisar_grupo(grupo_id)
         
         return redirect('reportes:detalle_reporte', pk=reporte.pk)
     
@@ -367,30 +677,25 @@ def ejecutar_deteccion_duplicados(request):
         return redirect('usuarios:home')
     
     if request.method == 'POST':
-        # Obtener parámetros
-        radio = float(request.POST.get('radio', 0.05))
-        dias = int(request.POST.get('dias', 7))
-        
-        # Actualizar configuración
-        DetectorDuplicados.RADIO_BUSQUEDA_KM = radio
-        DetectorDuplicados.VENTANA_TEMPORAL_DIAS = dias
-        
-        # Obtener reportes no marcados con coordenadas
-        reportes = Reporte.objects.filter(
-            latitud__isnull=False,
-            longitud__isnull=False,
-            duplicado=False
-        ).order_by('reportado_en')
+        # Obtener parámetros (solo para esta ejecución)
+        config = obtener_configuracion()
+        try:
+            # Un campo vacío conserva el valor general y las excepciones por tipo
+            radio = request.POST.get('radio')
+            dias = request.POST.get('dias')
+            config = config.ajustada(
+                radio_km=float(radio) if radio else None,
+                ventana_dias=int(dias) if dias else None
+            )
+        except ValueError:
+            messages.error(request, 'El radio y la ventana deben ser números positivos.')
+            return redirect('reportes:ejecutar_deteccion')
         
-        duplicados_encontrados = 0
-        for reporte in reportes:
-            es_duplicado, _ = DetectorDuplicados.detectar_y_marcar_duplicado(reporte)
-            if es_duplicado:
-                duplicados_encontrados += 1
+        marcados, grupos_creados = DetectorDuplicados.detectar_en_lote(config=config)
         
         messages.success(
             request,
-            f'Detección completada: {duplicados_encontrados} duplicados encontrados de {reportes.count()} reportes'
+            f'Detección completada: {marcados} duplicados encontrados en {grupos_creados} grupos nuevos'
         )
         
         return redirect('reportes:grupos_duplicados')
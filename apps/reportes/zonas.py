@@ -0,0 +1,344 @@
+"""
+Localidades y barrios de los reportes
+Los polígonos de Zona se cargan en un STR-tree (Sort-Tile-Recursive) en
+memoria. Las consultas bajan por el árbol con todos los puntos a la vez y
+prueban punto en polígono con numpy, así que etiquetar un reporte o
+recorrer la tabla entera cuesta lo mismo por punto.
+"""
+
+import threading
+import time
+from math import ceil, sqrt
+
+import numpy as np
+from django.db import transaction
+
+from .gazetteer import _es_barrio, _nombre, _partes, _propiedades
+
+
+# Zonas (o nodos) por nodo del árbol
+CAPACIDAD_NODO = 8
+
+# Cada cuánto un proceso revisa si otro importó zonas nuevas
+SEGUNDOS_REVISION = 60
+
+# Pares punto × arista por bloque en la prueba de punto en polígono
+PARES_POR_BLOQUE = 2_000_000
+
+# admin_level de OSM que se toma como localidad (los barrios son 9-10 o place=*)
+NIVELES_LOCALIDAD = ('7', '8')
+
+
+# ============================================
+# ÍNDICE
+# ============================================
+
+def _empaquetar(cajas, capacidad):
+    """
+    Un nivel del STR-tree: ordena las cajas en franjas verticales por x y
+    dentro de cada franja por y, y las agrupa de a capacidad. Devuelve el
+    orden de las cajas, las cajas de los nodos y el rango de cada nodo.
+    """
+    n = len(cajas)
+    franjas = ceil(sqrt(ceil(n / capacidad)))
+    por_franja = ceil(n / franjas / capacidad) * capacidad
+    centro_x = (cajas[:, 0] + cajas[:, 2]) / 2
+    centro_y = (cajas[:, 1] + cajas[:, 3]) / 2
+
+    por_x = np.argsort(centro_x, kind='stable')
+    orden = np.concatenate([
+        franja[np.argsort(centro_y[franja], kind='stable')]
+        for franja in (por_x[inicio:inicio + por_franja] for inicio in range(0, n, por_franja))
+    ])
+
+    ordenadas = cajas[orden]
+    inicios = np.arange(0, n, capacidad)
+    nodos = np.column_stack([
+        np.minimum.reduceat(ordenadas[:, 0], inicios),
+        np.minimum.reduceat(ordenadas[:, 1], inicios),
+        np.maximum.reduceat(ordenadas[:, 2], inicios),
+        np.maximum.reduceat(ordenadas[:, 3], inicios),
+    ])
+    return orden, nodos, inicios, np.append(inicios[1:], n)
+
+
+def _dentro(cajas, x, y):
+    return (cajas[:, 0] <= x) & (x <= cajas[:, 2]) & (cajas[:, 1] <= y) & (y <= cajas[:, 3])
+
+
+class IndiceZonas:
+    """
+    STR-tree de las zonas. zonas es una lista de (id, nivel, poligonos) con
+    poligonos en coordenadas GeoJSON de MultiPolygon (lon, lat).
+    """
+
+    def __init__(self, zonas):
+        zonas = list(zonas)
+        self.ids = np.array([zona_id for zona_id, _, _ in zonas], dtype=np.int64)
+        self.es_barrio = np.array([nivel == 'barrio' for _, nivel, _ in zonas], dtype=bool)
+
+        # Aristas de todos los anillos de cada zona, contiguas por zona
+        aristas, inicio = [], [0]
+        cajas = []
+        for _, _, poligonos in zonas:
+            propias = []
+            for poligono in poligonos:
+                for anillo in poligono:
+                    vertices = np.array([punto[:2] for punto in anillo], dtype=np.float64)
+                    propias.append(np.hstack([vertices, np.roll(vertices, -1, axis=0)]))
+            propias = np.vstack(propias) if propias else np.zeros((0, 4))
+            aristas.append(propias)
+            inicio.append(inicio[-1] + len(propias))
+            cajas.append((
+                propias[:, 0].min(), propias[:, 1].min(), propias[:, 0].max(), propias[:, 1].max()
+            ) if len(propias) else (np.inf, np.inf, -np.inf, -np.inf))
+        self.aristas = np.vstack(aristas) if aristas else np.zeros((0, 4))
+        self.aristas_inicio = np.array(inicio, dtype=np.int64)
+        self.cajas = np.array(cajas, dtype=np.float64).reshape(-1, 4)
+
+        # Niveles del árbol, de las hojas a la raíz; cada nodo apunta a un
+        # rango del nivel de abajo (el de las hojas, a self.orden)
+        self.niveles = []
+        if len(zonas):
+            orden, nodos, inicios, fines = _empaquetar(self.cajas, CAPACIDAD_NODO)
+            self.orden = orden
+            self.niveles.append((nodos, inicios, fines))
+            while len(nodos) > 1:
+                orden, nodos, inicios_padre, fines_padre = _empaquetar(nodos, CAPACIDAD_NODO)
+                # Reordenar el nivel de abajo y sus rangos según el orden del nuevo nivel
+                anterior, inicios_hijo, fines_hijo = self.niveles[-1]
+                self.niveles[-1] = (anterior[orden], inicios_hijo[orden], fines_hijo[orden])
+                self.niveles.append((nodos, inicios_padre, fines_padre))
+        self.niveles.reverse()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidatos(self, x, y):
+        """
+        Pares (punto, zona) cuyo recuadro contiene el punto. Todos los puntos
+        bajan juntos por el árbol; en cada nivel se expanden los pares a los
+        hijos del nodo y se descartan los que caen fuera de su caja.
+        """
+        raiz = self.niveles[0][0]
+        puntos = np.repeat(np.arange(len(x)), len(raiz))
+        nodos = np.tile(np.arange(len(raiz)), len(x))
+
+        for cajas, inicios, fines in self.niveles:
+            adentro = _dentro(cajas[nodos], x[puntos], y[puntos])
+            puntos, nodos = puntos[adentro], nodos[adentro]
+
+            # Hijos de cada nodo: rango [inicio, fin) del nivel siguiente
+            cantidades = fines[nodos] - inicios[nodos]
+            desplazamiento = np.arange(cantidades.sum()) - np.repeat(np.cumsum(cantidades) - cantidades, cantidades)
+            puntos = np.repeat(puntos, cantidades)
+            nodos = np.repeat(inicios[nodos], cantidades) + desplazamiento
+
+        zonas = self.orden[nodos]
+        adentro = _dentro(self.cajas[zonas], x[puntos], y[puntos])
+        return puntos[adentro], zonas[adentro]
+
+    def _contiene(self, zona, x, y):
+        """ Regla par-impar contra todas las aristas de la zona (los huecos quedan fuera) """
+        x1, y1, x2, y2 = self.aristas[self.aristas_inicio[zona]:self.aristas_inicio[zona + 1]].T
+        resultado = np.zeros(len(x), dtype=bool)
+        paso = max(1, PARES_POR_BLOQUE // max(1, len(x1)))
+        for inicio in range(0, len(x), paso):
+            px = x[inicio:inicio + paso, None]
+            py = y[inicio:inicio + paso, None]
+            cortan = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_corte = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            resultado[inicio:inicio + paso] = np.count_nonzero(cortan & (px < x_corte), axis=1) % 2 == 1
+        return resultado
+
+    def ubicar(self, latitudes, longitudes):
+        """
+        Ids de localidad y barrio de cada punto (0 si ninguna lo contiene).
+        Si dos zonas del mismo nivel se solapan, gana la de recuadro menor.
+        """
+        y = np.asarray(latitudes, dtype=np.float64)
+        x = np.asarray(longitudes, dtype=np.float64)
+        localidades = np.zeros(len(x), dtype=np.int64)
+        barrios = np.zeros(len(x), dtype=np.int64)
+        if not len(self) or not len(x):
+            return localidades, barrios
+
+        puntos, zonas = self._candidatos(x, y)
+        if not len(puntos):
+            return localidades, barrios
+
+        # Zonas de mayor a menor recuadro: las más pequeñas se escriben al final
+        area = (self.cajas[:, 2] - self.cajas[:, 0]) * (self.cajas[:, 3] - self.cajas[:, 1])
+        orden = np.lexsort((zonas, -area[zonas]))
+        puntos, zonas = puntos[orden], zonas[orden]
+        cortes = np.flatnonzero(np.diff(zonas)) + 1
+        for grupo_puntos, grupo_zonas in zip(np.split(puntos, cortes), np.split(zonas, cortes)):
+            zona = grupo_zonas[0]
+            dentro = grupo_puntos[self._contiene(zona, x[grupo_puntos], y[grupo_puntos])]
+            (barrios if self.es_barrio[zona] else localidades)[dentro] = self.ids[zona]
+        return localidades, barrios
+
+
+_indice = {}
+_candado = threading.Lock()
+
+
+def limpiar_indice():
+    with _candado:
+        _indice.clear()
+
+
+def obtener_indice():
+    """
+    Índice de las zonas guardadas. Se reconstruye cuando cambia alguna
+    zona; otros procesos lo notan en la siguiente revisión.
+    """
+    from django.db.models import Count, Max
+    from apps.reportes.models import Zona
+
+    ahora = time.monotonic()
+    with _candado:
+        if _indice and ahora < _indice['revisar_en']:
+            return _indice['indice']
+
+        marca = tuple(Zona.objects.aggregate(total=Count('id'), ultima=Max('actualizada_en')).values())
+        if _indice.get('marca') != marca:
+            _indice['indice'] = IndiceZonas(Zona.objects.values_list('id', 'nivel', 'poligonos'))
+            _indice['marca'] = marca
+        _indice['revisar_en'] = ahora + SEGUNDOS_REVISION
+        return _indice['indice']
+
+
+def zonas_de(latitud, longitud):
+    """ (localidad_id, barrio_id) del punto; None donde no hay zona """
+    if latitud is None or longitud is None:
+        return None, None
+    indice = obtener_indice()
+    if not len(indice):
+        return None, None
+    localidades, barrios = indice.ubicar([float(latitud)], [float(longitud)])
+    return int(localidades[0]) or None, int(barrios[0]) or None
+
+
+# ============================================
+# ASIGNACIÓN EN LOTE
+# ============================================
+
+def asignar_zonas(tamano_lote=20000):
+    """
+    Recalcula localidad y barrio de todos los reportes. Cada lote se ubica
+    en una sola pasada por el índice y se guarda con un UPDATE por cada
+    combinación (localidad, barrio) que cambió. Devuelve cuántos cambiaron.
+    """
+    from apps.reportes.models import Reporte
+
+    indice = obtener_indice()
+    cambiados = Reporte.objects.filter(latitud__isnull=True).exclude(localidad=None, barrio=None).update(
+        localidad=None, barrio=None
+    )
+
+    ultimo = 0
+    while True:
+        filas = list(
+            Reporte.objects.filter(id__gt=ultimo, latitud__isnull=False, longitud__isnull=False)
+            .order_by('id').values_list('id', 'latitud', 'longitud', 'localidad_id', 'barrio_id')[:tamano_lote]
+        )
+        if not filas:
+            return cambiados
+        ultimo = filas[-1][0]
+
+        ids, latitudes, longitudes, localidades, barrios = zip(*filas)
+        ids = np.array(ids, dtype=np.int64)
+        nuevas_localidades, nuevos_barrios = indice.ubicar(
+            [float(valor) for valor in latitudes], [float(valor) for valor in longitudes]
+        )
+        actuales_localidades = np.array([valor or 0 for valor in localidades], dtype=np.int64)
+        actuales_barrios = np.array([valor or 0 for valor in barrios], dtype=np.int64)
+        cambio = (nuevas_localidades != actuales_localidades) | (nuevos_barrios != actuales_barrios)
+        if not cambio.any():
+            continue
+
+        pares = np.column_stack([nuevas_localidades[cambio], nuevos_barrios[cambio]])
+        unicos, grupo = np.unique(pares, axis=0, return_inverse=True)
+        with transaction.atomic():
+            for posicion, (localidad, barrio) in enumerate(unicos.tolist()):
+                Reporte.objects.filter(id__in=ids[cambio][grupo.ravel() == posicion].tolist()).update(
+                    localidad_id=localidad or None, barrio_id=barrio or None
+                )
+        cambiados += int(cambio.sum())
+
+
+# ============================================
+# IMPORTACIÓN
+# ============================================
+
+def _nivel(propiedades):
+    nivel = str(propiedades.get('nivel', '')).lower()
+    if nivel in ('localidad', 'barrio'):
+        return nivel
+    if str(propiedades.get('admin_level')) in NIVELES_LOCALIDAD:
+        return 'localidad'
+    if _es_barrio(propiedades):
+        return 'barrio'
+    return None
+
+
+def importar_zonas(coleccion, nivel=None, reemplazar=False):
+    """
+    Guarda como Zona los polígonos con nombre de una FeatureCollection.
+    El nivel sale de la propiedad "nivel", de admin_level o de las
+    etiquetas de barrio de OSM, salvo que se indique para todo el archivo.
+    Cada barrio queda bajo la localidad que contiene su primer anillo
+    (o la de su propiedad "localidad"). Devuelve (localidades, barrios).
+    """
+    from apps.reportes.models import Zona
+
+    zonas = {}
+    padres = {}
+    for feature in coleccion.get('features', []):
+        geometria = feature.get('geometry')
+        propiedades = _propiedades(feature)
+        nombre = _nombre(propiedades)[:150]
+        poligonos = _partes(geometria, 'Polygon', 'MultiPolygon') if geometria else []
+        nivel_zona = nivel or _nivel(propiedades)
+        if not nombre or not poligonos or nivel_zona is None:
+            continue
+        zonas.setdefault((nivel_zona, nombre), []).extend(poligonos)
+        if nivel_zona == 'barrio' and propiedades.get('localidad'):
+            padres[nombre] = str(propiedades['localidad']).strip()
+
+    with transaction.atomic():
+        guardadas = {}
+        for (nivel_zona, nombre), poligonos in zonas.items():
+            vertices = np.array([punto[:2] for poligono in poligonos for anillo in poligono for punto in anillo])
+            guardadas[(nivel_zona, nombre)], _ = Zona.objects.update_or_create(
+                nivel=nivel_zona, nombre=nombre,
+                defaults={
+                    'poligonos': poligonos,
+                    'oeste': float(vertices[:, 0].min()), 'sur': float(vertices[:, 1].min()),
+                    'este': float(vertices[:, 0].max()), 'norte': float(vertices[:, 1].max()),
+                },
+            )
+        if reemplazar:
+            Zona.objects.exclude(id__in=[zona.id for zona in guardadas.values()]).delete()
+
+        # Localidad de cada barrio: la del archivo o la que contiene su primer anillo
+        localidades = {nombre: zona for (nivel_zona, nombre), zona in guardadas.items() if nivel_zona == 'localidad'}
+        indice = IndiceZonas(
+            (zona.id, 'localidad', zona.poligonos)
+            for zona in Zona.objects.filter(nivel='localidad')
+        )
+        barrios = [zona for (nivel_zona, _), zona in guardadas.items() if nivel_zona == 'barrio']
+        for barrio in barrios:
+            padre = localidades.get(padres.get(barrio.nombre))
+            if padre is not None:
+                barrio.padre_id = padre.id
+                continue
+            anillo = np.array([punto[:2] for punto in barrio.poligonos[0][0]], dtype=np.float64)
+            contenedoras, _ = indice.ubicar([anillo[:, 1].mean()], [anillo[:, 0].mean()])
+            barrio.padre_id = int(contenedoras[0]) or None
+        Zona.objects.bulk_update(barrios, ['padre'])
+
+    limpiar_indice()
+    return len(localidades), len(barrios)
@@ -8,7 +8,7 @@ from .forms import RegistroForm, LoginForm
 from .models import Usuario
 from apps.reportes.models import (
     Reporte, Notificacion, EstadoReporte, PrioridadReporte,
-    Asignacion, HistorialReporte, Evidencia
+    Asignacion, HistorialReporte, Evidencia, Zona
 )
 
 def registro_view(request):
@@ -189,7 +189,7 @@ def autoridad_home(request):
     # SE Reportes recientes sin asignar
     reportes_recientes = Reporte.objects.filter(
         asignaciones__isnull=True
-    ).select_related('usuario', 'estado', 'prioridad').order_by('-reportado_en')[:10]
+    ).select_related('usuario', 'estado', 'prioridad', 'barrio').order_by('-reportado_en')[:10]
     
     # SE Reportes por tipo (tipo es CharField, no ForeignKey)
     reportes_por_tipo = Reporte.objects.values('tipo').annotate(
@@ -201,11 +201,34 @@ def autoridad_home(request):
         total=Count('id')
     ).order_by('-total')
     
+    # SE Reportes por localidad y barrio (la zona se guarda en el reporte)
+    por_localidad = dict(
+        Reporte.objects.order_by().values_list('localidad').annotate(total=Count('id'))
+    )
+    sin_asignar_por_localidad = dict(
+        Reporte.objects.filter(asignaciones__isnull=True).order_by()
+        .values_list('localidad').annotate(total=Count('id'))
+    )
+    reportes_por_localidad = [
+        {
+            'zona': localidad,
+            'total': por_localidad.get(localidad.id, 0),
+            'sin_asignar': sin_asignar_por_localidad.get(localidad.id, 0),
+        }
+        for localidad in Zona.objects.filter(nivel='localidad')
+    ]
+    reportes_por_barrio = Reporte.objects.filter(barrio__isnull=False).values(
+        'barrio', 'barrio__nombre'
+    ).annotate(total=Count('id')).order_by('-total')[:10]
+
     context = {
         'estadisticas': estadisticas,
         'reportes_recientes': reportes_recientes,
         'reportes_por_tipo': reportes_por_tipo,
         'reportes_por_prioridad': reportes_por_prioridad,
+        'reportes_por_localidad': reportes_por_localidad,
+        'reportes_por_barrio': reportes_por_barrio,
+        'sin_zona': por_localidad.get(None, 0),
     }
     return render(request, 'usuarios/autoridad_home.html', context)
 
@@ -500,9 +523,18 @@ def lista_reportes_autoridad(request):
         messages.error(request, 'No tienes permisos para ver esta página.')
         return redirect('usuarios:home')
     
+    # SE Zona (localidad y barrio se guardan en el reporte: se filtra por su id)
+    localidad_filtro = request.GET.get('localidad', '')
+    barrio_filtro = request.GET.get('barrio', '')
+    en_zona = Reporte.objects.all()
+    if localidad_filtro.isdigit():
+        en_zona = en_zona.filter(localidad_id=localidad_filtro)
+    if barrio_filtro.isdigit():
+        en_zona = en_zona.filter(barrio_id=barrio_filtro)
+
     # SE Obtener todos los reportes
-    reportes = Reporte.objects.all().select_related(
-        'usuario', 'estado', 'prioridad'
+    reportes = en_zona.select_related(
+        'usuario', 'estado', 'prioridad', 'localidad', 'barrio'
     ).prefetch_related('asignaciones__tecnico').order_by('-reportado_en')
     
     # SE Filtros
@@ -515,19 +547,27 @@ def lista_reportes_autoridad(request):
     if prioridad_filtro:
         reportes = reportes.filter(prioridad__id=prioridad_filtro)
     
-    # SE Estadísticas
-    total_reportes = Reporte.objects.count()
-    sin_asignar = Reporte.objects.filter(asignaciones__isnull=True).count()
-    en_proceso = Reporte.objects.filter(estado__nombre='En Proceso').count()
-    resueltos = Reporte.objects.filter(estado__nombre='Resuelto').count()
+    # SE Estadísticas (de la zona elegida)
+    total_reportes = en_zona.count()
+    sin_asignar = en_zona.filter(asignaciones__isnull=True).count()
+    en_proceso = en_zona.filter(estado__nombre='En Proceso').count()
+    resueltos = en_zona.filter(estado__nombre='Resuelto').count()
     
     estados = EstadoReporte.objects.all()
     prioridades = PrioridadReporte.objects.all()
+
+    # SE Zonas con su cantidad de reportes; los barrios, de la localidad elegida
+    localidades = Zona.objects.filter(nivel='localidad').annotate(total=Count('reportes_localidad'))
+    barrios = Zona.objects.filter(nivel='barrio').annotate(total=Count('reportes_barrio'))
+    if localidad_filtro.isdigit():
+        barrios = barrios.filter(padre_id=localidad_filtro)
     
     return render(request, 'reportes/lista_reportes_autoridad.html', {
         'reportes': reportes,
         'estados': estados,
         'prioridades': prioridades,
+        'localidades': localidades,
+        'barrios': barrios,
         'total_reportes': total_reportes,
         'sin_asignar': sin_asignar,
         'en_proceso': en_proceso,
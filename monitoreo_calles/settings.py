@@ -73,6 +73,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Espera a que se libere el bloqueo de escritura en vez de fallar
+        # de inmediato cuando varias peticiones escriben a la vez
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        # Base de pruebas en disco: las pruebas con varios hilos necesitan
+        # conexiones independientes a la misma base
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -111,6 +121,43 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Caché en disco de las teselas vectoriales del mapa (se puede borrar cuando sea)
+TESELAS_DIR = BASE_DIR / 'cache' / 'teselas'
+
+# Detección de duplicados: los reportes nuevos se encolan y el comando
+# procesar_detecciones los agrupa por lotes
+DETECCION_DUPLICADOS_ASINCRONA = True
+
+# Parámetros por defecto de la detección de duplicados. POR_TIPO permite
+# otro radio (km) o ventana (días) para tipos de falla concretos,
+# DISTANCIA_IMAGEN es la tolerancia en bits para considerar iguales dos fotos
+# y SIMILITUD_TEXTO la similitud mínima entre textos de reportes sin GPS
+DETECCION_DUPLICADOS = {
+    'RADIO_KM': 0.05,
+    'VENTANA_DIAS': 7,
+    'DISTANCIA_IMAGEN': 6,
+    'SIMILITUD_TEXTO': 0.5,
+    'POR_TIPO': {},
+}
+
+# Geocodificación inversa de los reportes. Las direcciones se guardan por
+# celdas de TAMANO_CELDA_M metros; PROVEEDOR es la ruta de un invocable
+# (latitud, longitud) -> dirección. El gazetteer local (GAZETTEER, lo crea
+# importar_gazetteer) responde sin red; mientras no exista su archivo responde
+# RESPALDO, y con None los reportes quedan sin dirección. También están
+# ProveedorNominatim (con red) y ProveedorAproximado en apps.reportes.geocodificacion
+GEOCODIFICACION = {
+    'PROVEEDOR': 'apps.reportes.gazetteer.ProveedorGazetteer',
+    'RESPALDO': None,
+    'GAZETTEER': BASE_DIR / 'datos' / 'gazetteer.npz',
+    'MALLA_VIAL': BASE_DIR / 'datos' / 'malla_vial.json',
+    'TAMANO_CELDA_M': 15,
+    'DIAS_VIGENCIA': 180,
+    'SEGUNDOS_NEGATIVO': 3600,
+    'TAMANO_LRU': 4096,
+    'TIEMPO_ESPERA': 5,
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 